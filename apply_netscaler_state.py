@@ -4,10 +4,26 @@ import yaml
 import logging
 from schema import Schema, And, Use, Or, Optional, SchemaError
 import socket
+import argparse
+import threading
+import os
+import re
+import time
+import json
+import hashlib
+import signal
+import gzip
+import zlib
+import urllib
+import urllib2
+from multiprocessing.pool import ThreadPool
 from time import strftime
-from collections import OrderedDict
+from collections import OrderedDict, Counter, deque
+import heapq
+from itertools import chain
 from nsnitro.nsnitro import NSNitro
-from nsnitro.nsexceptions import NSNitroError
+from nsnitro.nsexceptions import NSNitroError, NSNitroExceptionClassMap
+from nsnitro.nsutil import NSNitroResponse
 from nsnitro.nsresources.nsserver import NSServer
 from nsnitro.nsresources.nsservicegroup import NSServiceGroup
 from nsnitro.nsresources.nsservicegroupserverbinding import NSServiceGroupServerBinding
@@ -18,23 +34,130 @@ from nsnitro.nsresources.nscsvserver import NSCSVServer
 from nsnitro.nsresources.nscsvservercspolicybinding import NSCSVServerCSPolicyBinding
 from nsnitro.nsresources.nsbaseresource import NSBaseResource
 
-log_filename = 'apply_netscaler_state_{}.log'.format(strftime("%Y%m%d_%H%M%S"))
+# libyaml-based loader and dumper when PyYAML was built with libyaml; the pure Python versions otherwise
+try:
+    from yaml import CSafeLoader as YAMLSafeLoader, CSafeDumper as YAMLSafeDumper
+except ImportError:
+    from yaml import SafeLoader as YAMLSafeLoader, SafeDumper as YAMLSafeDumper
+
+# inotify wakes the reconcile daemon as soon as the state file changes when pyinotify is installed; the file is
+# polled otherwise
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+run_timestamp = strftime("%Y%m%d_%H%M%S")
+log_filename = 'apply_netscaler_state_{}.log'.format(run_timestamp)
 log = logging.getLogger('apply_netscaler_state')
 log.setLevel(logging.DEBUG)
 stream = logging.StreamHandler()
 stream.setLevel(logging.DEBUG)
-file = logging.FileHandler(log_filename)
 log.addHandler(stream)
-log.addHandler(file)
+
+# Name of the ns_group processed by the current thread; used to tag and route log records
+ns_group_context = threading.local()
+
+
+class NSGroupLogFilter(logging.Filter):
+    '''
+    Tags log records with the ns_group processed by the current thread.  When created with an ns_group name, only
+    records logged while processing that ns_group pass the filter.
+    '''
+    def __init__(self, ns_group_name=None):
+        logging.Filter.__init__(self)
+        self.ns_group_name = ns_group_name
+
+    def filter(self, record):
+        record.ns_group = getattr(ns_group_context,'name',None)
+        record.ns_group_tag = '[{}] '.format(record.ns_group) if record.ns_group else ''
+        return self.ns_group_name is None or record.ns_group == self.ns_group_name
+
+
+log.addFilter(NSGroupLogFilter())
+stream.setFormatter(logging.Formatter('%(ns_group_tag)s%(message)s'))
+
+
+def add_log_file(filename):
+    '''
+
+    :param filename: Name of the log file
+    :return: logging.FileHandler writing every record of the log to the file
+
+    The log file of a run is only created by main(), so importing this module (e.g. from nitro_mock.py or the
+    benchmarks) does not create log files.
+    '''
+    log_file = logging.FileHandler(filename)
+    log_file.setFormatter(logging.Formatter('%(ns_group_tag)s%(message)s'))
+    log.addHandler(log_file)
+    return log_file
 
 
 ns_resource_id = {'server':'name',
                 'csaction':'name',
                 'cspolicy':'policyname',
                 'lbvserver':'name',
+                'csvserver':'name',
                 'servicegroup':'servicegroupname'
                 }
 
+ns_resource_classes = {'server':NSServer,
+                       'servicegroup':NSServiceGroup,
+                       'lbvserver':NSLBVServer,
+                       'csvserver':NSCSVServer,
+                       'servicegroup_servicegroupmember_binding':NSServiceGroupServerBinding,
+                       'lbvserver_servicegroup_binding':NSLBVServerServiceGroupBinding,
+                       'csvserver_cspolicy_binding':NSCSVServerCSPolicyBinding
+                       }
+
+ns_snapshot_resource_types = ['server','servicegroup','lbvserver','csvserver','cspolicy','csaction']
+
+# Properties that identify the address in use by a resource; only one resource of a type can hold an address
+ns_address_properties = {'server':['ipaddress'],
+                         'lbvserver':['ipv46','port'],
+                         'csvserver':['ipv46','port']
+                         }
+
+# Bindings are kept in the snapshot under the parent resource name, keyed by the 'key' properties
+ns_binding_types = OrderedDict([('servicegroup_servicegroupmember_binding',
+                                 {'parent':'servicegroup','parent_property':'servicegroupname',
+                                  'target':'server','target_property':'servername',
+                                  'key':['servername','port']}),
+                                ('lbvserver_servicegroup_binding',
+                                 {'parent':'lbvserver','parent_property':'name',
+                                  'target':'servicegroup','target_property':'servicegroupname',
+                                  'key':['servicegroupname']}),
+                                ('csvserver_cspolicy_binding',
+                                 {'parent':'csvserver','parent_property':'name',
+                                  'target':'cspolicy','target_property':'policyname',
+                                  'key':['policyname']}),
+                                ('csvserver_lbvserver_binding',
+                                 {'parent':'csvserver','parent_property':'name',
+                                  'target':'lbvserver','target_property':'lbvserver',
+                                  'key':['lbvserver']})
+                                ])
+
+# HTTP method and Nitro action used to send operations in bulk, by operation action
+ns_bulk_requests = {'add':{'method':'POST','action':None},
+                    'update':{'method':'PUT','action':None},
+                    'delete':{'method':'POST','action':'rm'}
+                    }
+
+ns_bulk_binding_requests = {'add':{'method':'PUT','action':None},
+                            'delete':{'method':'POST','action':'unbind'}
+                            }
+
+# Resource properties that refer to other resources by name
+ns_resource_references = {'csaction':[{'nitro':'targetlbvserver','resource_type':'lbvserver'}],
+                          'cspolicy':[{'nitro':'action','resource_type':'csaction'}]
+                          }
+
+# Read-only properties that operations are planned from, in addition to the managed properties in rw_properties
+ns_state_properties = {'cspolicy':['cspolicytype']}
+
+# Filename extension of the compact configuration and backup format (gzip-compressed JSON lines)
+compact_config_extension = '.jsonl.gz'
+
 yaml_config_resource_types = ['servers','service_groups','lbvservers','csvservers','cs_actions','cs_policies']
 
 rw_properties = {'server':
@@ -82,11 +205,12 @@ rw_properties = {'server':
                        'yaml':'name'},
                       {'nitro':'port',
                        'yaml':'port'}],
-                 'cspolicy_csvserver_binding':
+                 'csvserver_cspolicy_binding':
                      [{'nitro':'policyname',
                        'yaml':'name'},
                       {'nitro':'priority',
-                       'yaml':'priority'}]
+                       'yaml':'priority',
+                       'type':int}]
                  }
 
 
@@ -101,7 +225,7 @@ def get_config_yaml(filename):
     try:
         stream = open(filename,"r")
         try:
-            conf = ordered_load(stream,Loader=yaml.SafeLoader)
+            conf = ordered_load(stream,Loader=YAMLSafeLoader)
             ret = conf
         except yaml.YAMLError as error:
             log.info('YAML import failed: {}'.format(error.message))
@@ -123,7 +247,7 @@ def update_yaml(conf,filename):
     try:
         stream = open(filename,"w")
         try:
-            ordered_dump(conf,stream,Dumper=yaml.SafeDumper)
+            ordered_dump(conf,stream,Dumper=YAMLSafeDumper)
             ret = True
         except yaml.YAMLError as error:
             log.info('YAML export failed: {}'.format(error.message))
@@ -134,11 +258,217 @@ def update_yaml(conf,filename):
     return ret
 
 
+def is_compact_config(filename):
+    '''
+
+    :param filename: Filename of a configuration or backup file
+    :return: True if the file is in the compact format (gzip-compressed JSON lines); False if it is YAML
+
+    The partial file of an interrupted backup (see open_backup()) is in the format of the backup.
+    '''
+    return filename.endswith(compact_config_extension) or filename.endswith(compact_config_extension + '.partial')
+
+
+def convert_json_strings(value):
+    '''
+
+    :param value: Object decoded from JSON
+    :return: The object with unicode strings encoded as UTF-8 str, as the YAML loader returns them
+    '''
+    if isinstance(value,unicode):
+        return value.encode('utf-8')
+    if isinstance(value,dict):
+        return OrderedDict([(convert_json_strings(k), convert_json_strings(v)) for k, v in value.items()])
+    if isinstance(value,list):
+        return [convert_json_strings(item) for item in value]
+    return value
+
+
+def dump_compact_ns_group(ns_group_conf,stream):
+    '''
+
+    :param ns_group_conf: Configuration dictionary representing an ns_group
+    :param stream: stream object for file output
+    :return: None
+
+    Writes the ns_group in the compact format: one JSON line naming the ns_group with the number of keys that
+    follow, then one JSON line for each key of the ns_group (ns_instance and each resource type) holding its value.
+    '''
+    name = ns_group_conf.get('name')
+    keys = [key for key in ns_group_conf.keys() if key != 'name']
+    stream.write(json.dumps({'ns_group':name,'keys':len(keys)}) + '\n')
+    for key in keys:
+        stream.write(json.dumps({'ns_group':name,'key':key,'value':ns_group_conf[key]},separators=(',',':')) + '\n')
+    return None
+
+
+def get_compact_config_ns_groups(filename):
+    '''
+
+    :param filename: Filename of a configuration in the compact format
+    :return: Generator of ns_group configuration dictionaries, in file order
+
+    The lines of each ns_group are read and joined as they are reached, so only one ns_group is held in memory.
+    A file cut short by an interrupted backup yields the complete ns_groups before the cut.  Raises IOError if the
+    file cannot be opened.
+    '''
+    ns_group = None
+    remaining_keys = 0
+    with gzip.open(filename,'rb') as stream:
+        try:
+            for line in stream:
+                record = convert_json_strings(json.loads(line,object_pairs_hook=OrderedDict))
+                if 'key' not in record:
+                    ns_group = OrderedDict()
+                    if record['ns_group'] is not None:
+                        ns_group['name'] = record['ns_group']
+                    remaining_keys = record['keys']
+                else:
+                    ns_group[record['key']] = record['value']
+                    remaining_keys -= 1
+                if remaining_keys == 0:
+                    yield ns_group
+                    ns_group = None
+        except (IOError, EOFError, ValueError, zlib.error) as error:
+            log.info('{} is incomplete; ns_groups after the last complete ns_group were not read: {}'.format(
+                filename,error))
+
+
+def get_config(filename):
+    '''
+
+    :param filename: filename of YAML or compact state declaration file
+    :return: object containing config items; None if the file cannot be read
+    '''
+    if not is_compact_config(filename):
+        return get_config_yaml(filename)
+    try:
+        return {'ns_groups':list(get_compact_config_ns_groups(filename))}
+    except IOError as error:
+        log.info('Failed to open {}'.format(filename))
+    return None
+
+
+def get_config_ns_groups(filename):
+    '''
+
+    :param filename: filename of YAML or compact state declaration file
+    :return: Generator of ns_group configuration dictionaries; see get_config_yaml_ns_groups()
+    '''
+    if is_compact_config(filename):
+        return get_compact_config_ns_groups(filename)
+    return get_config_yaml_ns_groups(filename)
+
+
+def update_config(conf,filename):
+    '''
+
+    :param conf: Dictionary containing YAML-based configuration
+    :param filename: Filename of YAML or compact config file
+    :return: True if export succeeds; False otherwise
+    '''
+    if not is_compact_config(filename):
+        return update_yaml(conf,filename)
+    ret = False
+    try:
+        stream = gzip.open(filename,'wb')
+        try:
+            for ns_group in conf['ns_groups']:
+                dump_compact_ns_group(ns_group,stream)
+            ret = True
+        finally:
+            stream.close()
+    except IOError as error:
+        log.info('Failed to write {}: {}'.format(filename,error))
+    return ret
+
+
+def open_backup(filename):
+    '''
+
+    :param filename: Filename of the backup file; YAML unless the filename ends with compact_config_extension
+    :return: Dictionary describing the open backup; None if the file cannot be created
+
+    ns_groups are appended to '<filename>.partial' as they are processed and the file is renamed to filename when
+    the backup is closed.  The partial file is a valid configuration after every append, so the ns_groups backed
+    up before an interrupted run can still be loaded with get_config().
+    '''
+    backup = {'filename':filename,'partial_filename':filename + '.partial','count':0,'lock':threading.Lock(),
+              'compact':is_compact_config(filename)}
+    try:
+        if backup['compact']:
+            backup['stream'] = gzip.open(backup['partial_filename'],'wb')
+        else:
+            backup['stream'] = open(backup['partial_filename'],'w')
+    except IOError as error:
+        log.info('Failed to open {}'.format(backup['partial_filename']))
+        return None
+    return backup
+
+
+def sync_backup(backup):
+    # GzipFile.flush() ends the compressed block, so everything written so far can be decompressed
+    backup['stream'].flush()
+    os.fsync(backup['stream'].fileno())
+
+
+def append_backup(backup,ns_group_conf):
+    '''
+
+    :param backup: Dictionary from open_backup()
+    :param ns_group_conf: Backup configuration of an ns_group
+    :return: True if the ns_group is written to disk; False otherwise
+
+    Safe to call from concurrent ns_group workers.
+    '''
+    ret = False
+    with backup['lock']:
+        try:
+            if backup['compact']:
+                dump_compact_ns_group(ns_group_conf,backup['stream'])
+            else:
+                if backup['count'] == 0:
+                    backup['stream'].write('ns_groups:\n')
+                ordered_dump([ns_group_conf],backup['stream'],Dumper=YAMLSafeDumper)
+            sync_backup(backup)
+            backup['count'] += 1
+            ret = True
+        except (IOError, OSError, yaml.YAMLError) as error:
+            log.info('Backup of ns_group {} failed: {}'.format(ns_group_conf.get('name'),error))
+    return ret
+
+
+def close_backup(backup):
+    '''
+
+    :param backup: Dictionary from open_backup()
+    :return: True if the backup is saved under its final filename; False otherwise
+    '''
+    ret = False
+    with backup['lock']:
+        try:
+            if backup['count'] == 0 and not backup['compact']:
+                backup['stream'].write('ns_groups: []\n')
+            sync_backup(backup)
+            backup['stream'].close()
+            os.rename(backup['partial_filename'],backup['filename'])
+            # The rename is durable once the directory entry is synced
+            directory = os.open(os.path.dirname(os.path.abspath(backup['filename'])),os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+            ret = True
+        except (IOError, OSError) as error:
+            log.info('Failed to save backup {}: {}'.format(backup['filename'],error))
+    return ret
+
+
 def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
     '''
 
     :param stream: stream object for file input
-    :param Loader: yaml.Loader class
+    :param Loader: yaml.Loader class; the libyaml-based yaml.CSafeLoader keeps the key order as well
     :param object_pairs_hook: assocated with OrderedDict
     :return:
 
@@ -162,7 +492,7 @@ def ordered_dump(data, stream=None, Dumper=yaml.Dumper, **kwds):
 
     :param data: Input data object to be exported
     :param stream: stream object for file access
-    :param Dumper: yaml.Dumper class
+    :param Dumper: yaml.Dumper class; the libyaml-based yaml.CSafeDumper keeps the key order as well
     :param kwds: keywords passed to yaml dumper
     :return: yaml.dump return value
 
@@ -180,1123 +510,2588 @@ def ordered_dump(data, stream=None, Dumper=yaml.Dumper, **kwds):
     return yaml.dump(data, stream, OrderedDumper, default_flow_style=False)
 
 
-def connect(ns_instance):
+class EventLoader(yaml.composer.Composer, yaml.constructor.SafeConstructor, yaml.resolver.Resolver):
     '''
-
-    :param ns_instance: NSNitro instance
-    :return: Connected NSNitro instance
+    Composes and constructs YAML nodes from an iterator of parser events, so a document can be constructed one node
+    at a time while the events are produced by either the libyaml-based or the pure Python parser.  Mappings are
+    constructed as OrderedDict objects.
     '''
-    nitro = NSNitro(ns_instance['address'],ns_instance['user'],ns_instance['pass'])
-    try:
-        nitro.login()
-    except NSNitroError as error:
-        log.debug('NSNitro.login() failed: {0}'.format(error))
-    return nitro
+    def __init__(self, events):
+        self.events = events
+        self.current_event = None
+        yaml.composer.Composer.__init__(self)
+        yaml.constructor.SafeConstructor.__init__(self)
+        yaml.resolver.Resolver.__init__(self)
 
+    def peek_event(self):
+        if self.current_event is None:
+            self.current_event = next(self.events,None)
+        return self.current_event
 
-def disconnect(nitro):
-    '''
+    def check_event(self, *choices):
+        event = self.peek_event()
+        if event is None:
+            return False
+        if not choices:
+            return True
+        return isinstance(event,choices)
 
-    :param nitro: NSNitro instance
-    :return:  Disconnected NSNitro instance
-    '''
-    try:
-        nitro.logout()
-    except NSNitroError as error:
-        log.debug('NSNitro.logout() failed: {0}'.format(error))
-        return None
-    return nitro
+    def get_event(self):
+        event = self.peek_event()
+        self.current_event = None
+        return event
 
+    def construct_ordered_mapping(self, node):
+        self.flatten_mapping(node)
+        return OrderedDict(self.construct_pairs(node))
 
-def ensure_server_state(nitro, server_conf):
-    '''
 
-    :param nitro: NSNitro instance
-    :param server_conf: Server configuration item from input file
-    :return: True if configuration is applied successfully; False otherwise
+EventLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,EventLoader.construct_ordered_mapping)
 
-    Validates NS configuration and applies any changes needed to match the input server configuration item.
-    - If a server name and IP match the input configuration, nothing changes.
-    - If a server name matches the input configuration but the IP doesn't, the IP is updated.
-    - If an existing server has an IP address used in the configuration but the name doesn't match, the existing server is deleted and a new server is created. 
+
+def get_config_yaml_ns_groups(filename):
     '''
-    ret = True
-    
-    all_servers = NSServer.get_all(nitro)
-    matches_found = {}
-    for server in all_servers:
-      if server.get_name() == server_conf['name'] and server.get_ipaddress() == server_conf['ip_address']:
-          matches_found['full_match'] = server
-      elif server.get_name() == server_conf['name']:
-          matches_found['name'] = server
-      elif server.get_ipaddress() == server_conf['ip_address']:
-          matches_found['ip_address'] = server
-
-    if 'full_match' in matches_found.keys():
-        return True
-    else:
-        update = False
-        if 'ip_address' in matches_found.keys() and not 'name' in matches_found.keys():
-            server_to_delete = matches_found['ip_address']
-            try:
-                NSServer.delete(nitro,server_to_delete)
-            except NSNitroError as error:
-                log.debug('NSServer.delete() failed: {0}'.format(error))
-                ret = False
-        if 'name' in matches_found.keys() and not 'ip_address' in matches_found.keys():
-            update = True
-            updated_server = matches_found['name']
-            updated_server.set_ipaddress(server_conf['ip_address'])
-            updated_server.set_translationip(None)
-            updated_server.set_translationmask(None)
-            try:
-                NSServer.update(nitro, updated_server)
-            except NSNitroError as error:
-                log.debug('NSServer.update() failed: {0}'.format(error))
-                ret = False
-        if 'name' in matches_found.keys() and 'ip_address' in matches_found.keys():
-            update = True
-            server_to_delete = matches_found['ip_address']
-            try:
-                NSServer.delete(nitro,server_to_delete)
-            except NSNitroError as error:
-                log.debug('NSServer.delete() failed: {0}'.format(error))
-                ret = False 
-            updated_server = matches_found['name']
-            updated_server.set_ipaddress(server_conf['ip_address'])
-            updated_server.set_translationip(None)
-            updated_server.set_translationmask(None)
-            try:
-                NSServer.update(nitro, updated_server)
-            except NSNitroError as error:
-                log.debug('NSServer.update() failed: {0}'.format(error))
-                ret = False
-        if not update:
-            new_server = NSServer()
-            new_server.set_name(server_conf['name'])
-            new_server.set_ipaddress(server_conf['ip_address'])
-            try:
-                NSServer.add(nitro,new_server)
-            except NSNitroError as error:
-                log.debug('NSServer.add() failed: {0}'.format(error))
-                ret = False
 
-    
-    return ret
+    :param filename: filename of YAML state declaration file
+    :return: Generator of ns_group configuration dictionaries, in file order
 
-def create_ns_resource_object(ns_resource_object,object_conf):
-    options = map_yaml_config_to_nitro_object_options(object_conf)
-    ns_resource_object.set_options(object_conf)
+    Reads the ns_groups of the file one at a time from the YAML event stream, so only the ns_group being processed
+    is held in memory.  Keys other than ns_groups are skipped.  Raises IOError if the file cannot be opened and
+    yaml.YAMLError if it is not a valid YAML state declaration.
+    '''
+    with open(filename,"r") as stream:
+        loader = EventLoader(yaml.parse(stream,Loader=YAMLSafeLoader))
+        loader.get_event()
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise yaml.YAMLError('yaml format error: expected a mapping with an ns_groups key')
+        loader.get_event()
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = loader.construct_document(loader.compose_node(None,None))
+            if key == 'ns_groups' and loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(loader.compose_node(None,None))
+                loader.get_event()
+            else:
+                loader.compose_node(None,None)
 
-def map_yaml_config_to_nitro_object_options(resource_type,object_conf):
-    options = {}
-    for property in rw_properties[resource_type]:
-        nitro_property = property['nitro']
-        yaml_property = property['yaml']
-        options[nitro_property] = object_conf[yaml_property]
-    return options
 
+# Nitro call instrumentation.  Every Nitro request is counted and timed by HTTP verb, resource type and ns_group;
+# latencies are counted in cumulative histogram buckets (upper bounds in seconds).
+nitro_latency_buckets = [0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0]
 
-def map_nitro_object_options_to_yaml_config(resource_type,nitro_object):
-    yaml_config = {}
-    for property in rw_properties[resource_type]:
-        nitro_property = property['nitro']
-        yaml_property = property['yaml']
-        yaml_config[yaml_property] = nitro_object.options[nitro_property]
-    return yaml_config
+# (verb, resource type, ns_group) -> {'calls','errors','seconds','max','buckets'}
+nitro_metrics = {}
+nitro_metrics_lock = threading.Lock()
+
+nitro_resource_type_pattern = re.compile(r'^([^/?]*)')
 
 
-def ensure_service_group_state(nitro, service_group_conf):
+def record_nitro_call(verb,resource_type,seconds,failed):
     '''
 
-    :param nitro: NSNitro instance
-    :param service_group_conf: Service Group configuration item from input file
-    :return: True if configuration is applied successfully; False otherwise
+    :param verb: HTTP verb of the Nitro request
+    :param resource_type: Nitro resource type of the request; 'login' or 'logout' for session requests
+    :param seconds: Duration of the request in seconds
+    :param failed: True if the request failed
+    :return: None
+
+    The request is recorded under the ns_group processed by the current thread.
+    '''
+    key = (verb,resource_type,getattr(ns_group_context,'name',None) or '')
+    with nitro_metrics_lock:
+        metric = nitro_metrics.get(key)
+        if metric is None:
+            metric = {'calls':0,'errors':0,'seconds':0.0,'max':0.0,'buckets':[0] * len(nitro_latency_buckets)}
+            nitro_metrics[key] = metric
+        metric['calls'] += 1
+        if failed:
+            metric['errors'] += 1
+        metric['seconds'] += seconds
+        metric['max'] = max(metric['max'],seconds)
+        for i, bound in enumerate(nitro_latency_buckets):
+            if seconds <= bound:
+                metric['buckets'][i] += 1
+    return None
 
-    Validates NS configuration and applies any changes needed to match the input service group configuration item.
-    - Creates a new service group configuration if a matching name is not found in existing service groups.
-    - If an existing service group is found with same name as configuration item, the service type is validated to match the protocol in the configuration item
-    - A new service group is created if no matching service group exists
-    - Service group binding to servers is validated and updated if necessary
 
+def call_nitro(verb,resource_type,function,*args):
     '''
-    ret = True
-    existing_service_group = NSServiceGroup()
 
-    existing_service_group.set_servicegroupname(service_group_conf['name'])
+    :param verb: HTTP verb of the Nitro request
+    :param resource_type: Nitro resource type of the request
+    :param function: Function sending the request
+    :param args: Arguments of the function
+    :return: Return value of the function; exceptions raised by the function, and failed bulk responses, are
+             recorded as failures and exceptions are re-raised
+    '''
+    start = time.time()
+    failed = True
     try:
-        existing_service_group = NSServiceGroup.get(nitro,existing_service_group)
-    except NSNitroError as error:
-        log.debug('no existing service_group found for {}'.format(service_group_conf['name']))
-        existing_service_group = None
+        ret = function(*args)
+        failed = getattr(ret,'failed',False)
+        return ret
+    finally:
+        record_nitro_call(verb,resource_type,time.time() - start,failed)
 
-    if existing_service_group:
-        if existing_service_group.get_servicetype() != service_group_conf['protocol']:
-            try:
-                NSServiceGroup.delete(nitro, existing_service_group)
-            except NSNitroError as error:
-                log.debug('NSServiceGroup.delete() failed: {0}'.format(error))
-                ret = False
-            existing_service_group = None
-
-    if not existing_service_group:
-        new_service_group = NSServiceGroup()
-        new_service_group.set_servicegroupname(service_group_conf['name'])
-        new_service_group.set_servicetype(service_group_conf['protocol'])
-        try:
-            NSServiceGroup.add(nitro, new_service_group)
-        except NSNitroError as error:
-            log.debug('NSServiceGroup.add() failed: {0}'.format(error))
-            ret = False
-        current_service_group= new_service_group
-
-    #existing_bindings = get_bindings_for_service_group(nitro,service_group_conf)
-    existing_bindings = get_all_resources_by_type_and_name(nitro,'servicegroup_servicegroupmember_binding',service_group_conf['name'])
-
-    if existing_bindings is not None:
-        bindings_to_remove = []
-        for existing_binding in existing_bindings:
-            binding_found = False
-            for server_binding_conf in service_group_conf['servers']:
-                existing_conf = map_nitro_object_options_to_yaml_config('servicegroup_servicegroupmember_binding',existing_binding)
-                if  existing_conf == server_binding_conf:
-                    binding_found = True
-                    server_binding_conf['bound'] = True
-            if not binding_found:
-                if 'ip' in existing_binding.options.keys():
-                    existing_binding.options.pop('ip')
-                binding_to_remove = NSServiceGroupServerBinding(existing_binding.options)
-                try:
-                    NSServiceGroupServerBinding.delete(nitro, binding_to_remove)
-                except NSNitroError as error:
-                    log.debug('NSServiceGroupServerBinding.remove() failed: {0}'.format(error))
-                    ret = False
-
-
-        for server_binding_conf in service_group_conf['servers']:
-            if not 'bound' in server_binding_conf.keys():
-                new_binding = NSServiceGroupServerBinding()
-                new_binding.set_servicegroupname(service_group_conf['name'])
-                new_binding.set_servername(server_binding_conf['name'])
-                new_binding.set_port(server_binding_conf['port'])
-                try:
-                    NSServiceGroupServerBinding.add(nitro, new_binding)
-                except NSNitroError as error:
-                    log.debug('NSServiceGroupServerBinding.add() failed: {0}'.format(error))
-                    ret = False
-            else:
-                server_binding_conf.pop('bound')
 
-    
-    return ret
+def get_nitro_payload_resource_type(payload):
+    '''
 
-def ensure_service_groups_state(nitro,service_groups_conf):
+    :param payload: NSNitro POST payload (form fields with a JSON 'object') or PUT payload (dictionary)
+    :return: Nitro resource type of the payload
     '''
+    if 'object' in payload:
+        payload = json.loads(payload['object'])
+    resource_types = [key for key in payload.keys() if key not in ['params','sessionid']]
+    return resource_types[0] if len(resource_types) == 1 else 'unknown'
 
-    :param nitro: NSNitro instance
-    :param sservice_groups_conf: List of server configuration items from input file
-    :return: True if configuration is applied successfully; False otherwise
 
-    Validates NS configuration and applies any changes needed to match the list of input service group configuration items.
-    - Checks for matching service group names between NS and config file
-    - Each server group config item in list is sent to ensure_service_group_state()
-    - Existing service groups that do not match the config are deleted
-    '''
-    ret = True
-    if service_groups_conf is not None:
-        for service_group_conf in service_groups_conf:
-            ensure_service_group_state(nitro,service_group_conf)
-        remove_all_existing_service_groups = False
-    else:
-        remove_all_existing_service_groups = True
-
-    all_service_groups = NSServiceGroup.get_all(nitro)
-    service_groups_to_remove = []
-    for service_group in all_service_groups:
-        found_match = False
-        if not remove_all_existing_service_groups:
-            for service_group_conf in service_groups_conf:
-                if service_group_conf['name'] == service_group.get_servicegroupname():
-                    found_match = True
-        if not found_match:
-            service_groups_to_remove.append(service_group)
-
-    for service_group_to_remove in service_groups_to_remove:
-        try:
-            NSServiceGroup.delete(nitro, service_group_to_remove)
-        except NSNitroError as error:
-            log.debug('NSServiceGroupServerBinding.delete() failed: {0}'.format(error))
-            ret = False
+# Adaptive concurrency of the Nitro requests sent to each NetScaler (AIMD).  The limit of requests in flight grows
+# by one for every 'limit' requests answered within 'latency_target' seconds, and is multiplied by 'decrease_factor'
+# when a request is slower or cannot reach the NetScaler, at most once per round trip.
+scheduler_settings = {'initial_limit':4,'min_limit':1,'max_limit':32,'latency_target':2.0,'decrease_factor':0.5}
+
+# NetScaler address -> scheduler from new_appliance_scheduler()
+appliance_schedulers = {}
+appliance_schedulers_lock = threading.Lock()
 
-    
-    return ret
 
-def ensure_servers_state(nitro,servers_conf):
+def new_appliance_scheduler(max_rps=None):
     '''
 
-    :param nitro: NSNitro instance
-    :param servers_conf: List of server configuration items from input file
-    :return: True if configuration is applied successfully; False otherwise
+    :param max_rps: Maximum number of requests per second sent to the NetScaler; None for no limit
+    :return: Dictionary holding the concurrency limit, requests in flight and request pacing of one NetScaler
+    '''
+    return {'condition':threading.Condition(),
+            'limit':float(min(scheduler_settings['initial_limit'],scheduler_settings['max_limit'])),
+            'in_flight':0,
+            'max_rps':max_rps,
+            'next_request':0.0,
+            'last_decrease':0.0,
+            'decreases':0}
+
 
-    Validates NS configuration and applies any changes needed to match the list of input server configuration items.
-    - Sends all server config items to ensure_server_state()
-    - Iterates through list of server config items to find matching names in existing servers on the NS
-    - Deletes existing servers on the NS that do not match any server config items
+def get_appliance_scheduler(ns_instance):
     '''
-    ret = True
-    if servers_conf is not None:
-        for server_conf in servers_conf:
-            ensure_server_state(nitro,server_conf)
-        remove_all_existing_servers = False
-    else:
-        remove_all_existing_servers = True
-
-    all_servers = NSServer.get_all(nitro)
-    servers_to_remove = []
-    for server in all_servers:
-        found_match = False
-        if not remove_all_existing_servers:
-            for server_conf in servers_conf:
-                if server_conf['name'] == server.get_name():
-                    found_match = True
-        if not found_match:
-            servers_to_remove.append(server)
-
-    for server_to_remove in servers_to_remove:
-        try:
-            NSServer.delete(nitro, server_to_remove)
-        except NSNitroError as error:
-            log.debug('NSServer.delete() failed: {0}'.format(error))
-            ret = False
 
-    
-    return ret
+    :param ns_instance: ns_instance configuration dictionary
+    :return: Scheduler shared by every ns_group with the same NetScaler address
 
-def ensure_lbvservers_state(nitro,lbvservers_conf):
+    The lowest max_rps of the ns_groups of a NetScaler applies.
+    '''
+    max_rps = ns_instance.get('max_rps')
+    if max_rps is not None:
+        max_rps = float(max_rps)
+    with appliance_schedulers_lock:
+        scheduler = appliance_schedulers.get(ns_instance['address'])
+        if scheduler is None:
+            scheduler = new_appliance_scheduler(max_rps)
+            appliance_schedulers[ns_instance['address']] = scheduler
+        elif max_rps is not None:
+            scheduler['max_rps'] = min(scheduler['max_rps'] or max_rps,max_rps)
+    return scheduler
+
+
+def acquire_appliance_slot(scheduler):
     '''
 
-    :param nitro: NSNitro instance
-    :param lbvservers_conf: List of load balancing virtual server configuration items from input file
-    :return: True if configuration is applied successfully; False otherwise
+    :param scheduler: Scheduler from get_appliance_scheduler()
+    :return: Time the request may be sent
 
-    Validates NS configuration and applies any changes needed to match the list of input lbvserver configuration items.
-    - Sends all lbvserver config items to ensure_lbvserver_state()
-    - Iterates through list of lbvserver config items to find matching names in existing lbvservers on the NS
-    - Deletes existing lbvservers on the NS that do not match any lbvserver config items
+    Waits until fewer requests than the concurrency limit are in flight, then until the next request is allowed
+    by max_rps.
+    '''
+    with scheduler['condition']:
+        while scheduler['in_flight'] >= int(scheduler['limit']):
+            scheduler['condition'].wait()
+        scheduler['in_flight'] += 1
+        now = time.time()
+        start = now
+        if scheduler['max_rps'] is not None:
+            start = max(now,scheduler['next_request'])
+            scheduler['next_request'] = start + 1.0 / scheduler['max_rps']
+    if start > now:
+        time.sleep(start - now)
+    return start
+
+
+def release_appliance_slot(scheduler,start,congested):
     '''
-    ret = True
-    if lbvservers_conf is not None:
-        for lbvserver_conf in lbvservers_conf:
-            ensure_lbvserver_state(nitro,lbvserver_conf)
-        remove_all_existing_lbvservers = False
-    else:
-        remove_all_existing_lbvservers = True
-
-    all_lbvservers = NSLBVServer.get_all(nitro)
-    lbvservers_to_remove = []
-    for lbvserver in all_lbvservers:
-        found_match = False
-        if not remove_all_existing_lbvservers:
-            for lbvserver_conf in lbvservers_conf:
-                if lbvserver_conf['name'] == lbvserver.get_name():
-                    found_match = True
-        if not found_match:
-            lbvservers_to_remove.append(lbvserver)
-
-    for lbvserver_to_remove in lbvservers_to_remove:
-        try:
-            NSLBVServer.delete(nitro, lbvserver_to_remove)
-        except NSNitroError as error:
-            log.debug('NSLBVServer.delete() failed: {0}'.format(error))
-            ret = False
 
-    
-    return ret
+    :param scheduler: Scheduler from get_appliance_scheduler()
+    :param start: Time the request was sent, from acquire_appliance_slot()
+    :param congested: True if the request could not reach the NetScaler
+    :return: None
 
-def ensure_lbvserver_state(nitro, lbvserver_conf):
+    Adjusts the concurrency limit from the outcome and latency of the request.  Requests sent before the last
+    decrease do not decrease the limit again, so a burst of slow requests decreases it only once.
     '''
+    now = time.time()
+    with scheduler['condition']:
+        scheduler['in_flight'] -= 1
+        if congested or now - start > scheduler_settings['latency_target']:
+            if start >= scheduler['last_decrease']:
+                scheduler['limit'] = max(scheduler_settings['min_limit'],
+                                         scheduler['limit'] * scheduler_settings['decrease_factor'])
+                scheduler['last_decrease'] = now
+                scheduler['decreases'] += 1
+                log.debug('Nitro concurrency limit decreased to {:.1f} after a {:.3f} s {}request'.format(
+                    scheduler['limit'],now - start,'failed ' if congested else ''))
+        elif scheduler['in_flight'] + 1 >= int(scheduler['limit']):
+            # The limit only grows while it is in use
+            scheduler['limit'] = min(scheduler_settings['max_limit'],scheduler['limit'] + 1.0 / scheduler['limit'])
+        scheduler['condition'].notify_all()
+    return None
 
-    :param nitro: NSNitro instance
-    :param lbvserver_conf: Load balancing virtual server configuration item from input file
-    :return: True if configuration is applied successfully; False otherwise
 
-    Validates NS configuration and applies any changes needed to match the input lbvserver configuration item.
-    - Iterates through existing lbvservers on the NS to find matching name and/or IP address contained in the lbvserver config item
-    - An existing lbvserver on the NS with a matching name is validated and updated if necessary to match the IP of the lbvserver config item
-    - An existing lbvserver on the NS is deleted if it:
-        - Does not have a name that matches the lbvserver config item
-        - Does have an IP address the matches the lbvserver config item
-    - Creates an lbvserver on the NS using the lbvserver config item if one does not exist
-    - Iterates through lbvserver bindings to service groups in the config item
-    - Deletes existing lbvserver bindings on the NS that do not match the lbvserver config item
-    - Creates lbvserver binding on the NS for each lbvserver config item binding that does not exist
+class InstrumentedNSNitro(NSNitro):
     '''
-    ret = True
-    
-    
-    all_lbvservers = NSLBVServer.get_all(nitro)
-    matches_found = {}
-    for lbvserver in all_lbvservers:
-      if lbvserver.get_name() == lbvserver_conf['name'] and lbvserver.get_ipv46() == lbvserver_conf['vip_address'] and lbvserver.get_port == lbvserver_conf['port'] and lbvserver.get_servicetype == lbvserver_conf['protocol']:
-          matches_found['full_match'] = lbvserver
-      elif lbvserver.get_name() == lbvserver_conf['name']:
-          matches_found['name'] = lbvserver
-      elif lbvserver.get_ipv46() == lbvserver_conf['vip_address']:
-          matches_found['vip_address'] = lbvserver
-
-    if not 'full_match' in matches_found.keys():
-
-        check_for_port_and_protocol_match = False
-
-        if 'vip_address' in matches_found.keys() and not 'name' in matches_found.keys():
-            updated_lbvserver = matches_found['vip_address']
-            updated_lbvserver.set_newname(lbvserver_conf['name'])
-            try:
-                NSLBVServer.rename(nitro, updated_lbvserver)
-            except NSNitroError as error:
-                log.debug('NSLBVServer.update() failed: {0}'.format(error))
-                ret = False
-            lbvserver = NSLBVServer()
-            lbvserver.set_name(lbvserver_conf['name'])
-            updated_lbvserver = NSLBVServer.get(nitro,lbvserver)
-            check_for_port_and_protocol_match = True
-
-        if 'name' in matches_found.keys() and not 'vip_address' in matches_found.keys():
-            updated_lbvserver = matches_found['name']
-            updated_lbvserver.set_ipv46(lbvserver_conf['vip_address'])
-            try:
-                NSLBVServer.update(nitro, updated_lbvserver)
-            except NSNitroError as error:
-                log.debug('NSLBVServer.update() failed: {0}'.format(error))
-                ret = False
-            check_for_port_and_protocol_match = True
-
-        if 'name' in matches_found.keys() and 'vip_address' in matches_found.keys():
-            update = True
-            lbvserver_to_delete = matches_found['vip_address']
-            try:
-                NSLBVServer.delete(nitro,lbvserver_to_delete)
-            except NSNitroError as error:
-                log.debug('NSLBVServer.delete() failed: {0}'.format(error))
-                ret = False 
-            updated_lbvserver = matches_found['name']
-            updated_lbvserver.set_ipv46(lbvserver_conf['vip_address'])
-            try:
-                NSLBVServer.update(nitro, updated_lbvserver)
-            except NSNitroError as error:
-                log.debug('NSLBVServer.update() failed: {0}'.format(error))
-                ret = False
-            check_for_port_and_protocol_match = True
-        if check_for_port_and_protocol_match:
-            update = False
-            if updated_lbvserver.get_port() != lbvserver_conf['port']:
-                update = True
-                updated_lbvserver.set_port(lbvserver_conf['port'])
-            if updated_lbvserver.get_servicetype() != lbvserver_conf['protocol']:
-                update = True
-                updated_lbvserver.set_servicetype(lbvserver_conf['protocol'])
-            if update:
-                try:
-                    NSLBVServer.update(nitro, updated_lbvserver)
-                except NSNitroError as error:
-                    log.debug('NSLBVServer.update() failed: {0}'.format(error))
-                    ret = False
+    NSNitro connection that records every request with record_nitro_call().  NSNitro resource classes and
+    NSBaseResource send all requests through these methods.  With a cassette in nitro_settings, requests and
+    responses are recorded to the cassette, or served from it without connecting to the NetScaler.  Requests sent
+    to the NetScaler are scheduled with the scheduler of the NetScaler (see get_appliance_scheduler()).
+    '''
+    scheduler = None
 
-    existing_lbvserver = NSLBVServer()
-    existing_lbvserver.set_name(lbvserver_conf['name'])
+    def get_url_resource_type(self, url):
+        return nitro_resource_type_pattern.match(url[len(self.get_url()):]).group(1)
 
-    try:
-        existing_lbvserver = NSLBVServer.get(nitro,existing_lbvserver)
-    except NSNitroError as error:
-        log.debug('no existing lbvserver found for {}'.format(lbvserver_conf['name']))
-        existing_lbvserver = None
-
-    if existing_lbvserver:
-        update_needed = False
-        delete_needed = False
-        if existing_lbvserver.get_servicetype() != lbvserver_conf['protocol'] or existing_lbvserver.get_port() != lbvserver_conf['port']:
-            delete_needed = True
-        elif existing_lbvserver.get_ipv46() != lbvserver_conf['vip_address']:
-            update_needed = True
-            existing_lbvserver.set_ipv46(lbvserver_conf['vip_address'])
-        if delete_needed:
-            try:
-                NSLBVServer.delete(nitro, existing_lbvserver)
-            except NSNitroError as error:
-                log.debug('NSLBVServer.delete() failed: {0}'.format(error))
-                ret = False
-            existing_lbvserver = None
-        elif update_needed:
-            try:
-                NSLBVServer.update(nitro, existing_lbvserver)
-            except NSNitroError as error:
-                log.debug('NSLBVServer.update() failed: {0}'.format(error))
-                ret = False
-
-    if not existing_lbvserver:
-        new_lbvserver = NSLBVServer()
-        new_lbvserver.set_name(lbvserver_conf['name'])
-        new_lbvserver.set_ipv46(lbvserver_conf['vip_address'])
-        new_lbvserver.set_port(lbvserver_conf['port'])
-        new_lbvserver.set_servicetype(lbvserver_conf['protocol'])
+    def call(self, verb, resource_type, function, *args):
+        if self.scheduler is None:
+            return call_nitro(verb,resource_type,function,*args)
+        start = acquire_appliance_slot(self.scheduler)
+        # Errors reported by the NetScaler carry a Nitro error code; errors without one did not reach it
+        congested = True
         try:
-            NSLBVServer.add(nitro, new_lbvserver)
+            ret = call_nitro(verb,resource_type,function,*args)
+            congested = False
+            return ret
         except NSNitroError as error:
-            log.debug('NSLBVServer.add() failed: {0}'.format(error))
-            ret = False
-        current_lbvserver= new_lbvserver
+            congested = not getattr(error,'code',0)
+            raise
+        finally:
+            release_appliance_slot(self.scheduler,start,congested)
+
+    def send(self, verb, url, payload, response_class, function, *args):
+        if payload is not None:
+            resource_type = get_nitro_payload_resource_type(payload)
+        else:
+            resource_type = self.get_url_resource_type(url)
+        cassette = nitro_settings['cassette']
+        if cassette is None:
+            return self.call(verb,resource_type,function,*args)
+        interaction = new_cassette_interaction(self,verb,url,payload)
+        if cassette['mode'] == 'replay':
+            return call_nitro(verb,resource_type,replay_cassette_interaction,cassette,interaction,response_class)
+        try:
+            response = self.call(verb,resource_type,function,*args)
+        except (NSNitroError, urllib2.URLError) as error:
+            record_cassette_interaction(cassette,interaction,error=error)
+            raise
+        record_cassette_interaction(cassette,interaction,response.get_string_response())
+        return response
 
-    lbvserver_service_group_binding = NSLBVServerServiceGroupBinding()
-    lbvserver_service_group_binding.set_name(lbvserver_conf['name'])
-    try:
-        bindings = NSLBVServerServiceGroupBinding.get(nitro, lbvserver_service_group_binding)
-    except NSNitroError as error:
-        log.debug('no existing lbvserver server bindings found for {}'.format(lbvserver_conf['name']))
-        bindings = None
-
-    lbvserver_service_group_bindings = {}
-    for lbvserver_service_group_binding in lbvserver_conf['service_group_bindings']:
-        lbvserver_service_group_bindings[lbvserver_service_group_binding] = None
-
-    if bindings is not None:
-        bindings_to_remove = []
-        for binding in bindings:
-            binding_found = False
-            for lbvserver_service_group_binding in lbvserver_service_group_bindings.keys():
-                if binding.get_servicegroupname() == lbvserver_service_group_binding:
-                    binding_found = True
-                    lbvserver_service_group_bindings[lbvserver_service_group_binding] = True
-            if not binding_found:
-                binding_to_remove = binding
-                try:
-                    NSLBVServerServiceGroupBinding.delete(nitro, binding_to_remove)
-                except NSNitroError as error:
-                    log.debug('NSLBVServerServiceGroupBinding.remove() failed: {0}'.format(error))
-                    ret = False
-
-    for lbvserver_service_group_binding in lbvserver_service_group_bindings.keys():
-        if lbvserver_service_group_bindings[lbvserver_service_group_binding] is None:
-            new_binding = NSLBVServerServiceGroupBinding()
-            new_binding.set_name(lbvserver_conf['name'])
-            new_binding.set_servicegroupname(lbvserver_service_group_binding)
-            try:
-                NSLBVServerServiceGroupBinding.add(nitro, new_binding)
-            except NSNitroError as error:
-                log.debug('NSLBVServerServiceGroupBinding.add() failed: {0}'.format(error))
-                ret = False
+    def get(self, url):
+        return self.send('GET',url,None,NSNitroResponse,NSNitro.get,self,url)
 
-    
-    return ret
+    def delete(self, url):
+        return self.send('DELETE',url,None,NSNitroResponse,NSNitro.delete,self,url)
 
+    def post(self, payload):
+        return self.send('POST',self.get_url(),payload,NSNitroResponse,NSNitro.post,self,payload)
 
-def add_cs_action(nitro,cs_action_conf):
-    '''
+    def put(self, payload):
+        return self.send('PUT',self.get_url(),payload,NSNitroResponse,NSNitro.put,self,payload)
+
+    def send_bulk(self, method, url, payload):
+        return self.send(method,url,payload,NSNitroBulkResponse,send_nitro_bulk_request,self,method,url,payload)
 
-    :param nitro: NSNitro instance
-    :param cs_action_conf: Content Switching Action configuration item from input file
-    :return: True if configuration is applied successfully; False otherwise
 
-    Creates new Content Switching Action from cs_action configuration item
-    - No NSNitro object implements this functionality
-    - Used to implement CRUD capability for CS Actions
+def get_nitro_metrics_summary():
     '''
-    ret = True
-    cs_action = NSBaseResource()
-    cs_action.set_options({'name':cs_action_conf['name'], 'targetlbvserver':cs_action_conf['target_lbvserver']})
-    cs_action.resourcetype = 'csaction'
-    try:
-        cs_action.add_resource(nitro)
-    except NSNitroError as error:
-        log.debug('NSBaseResource.add_resource() failed: {0}'.format(error))
-        ret = False
-    return ret
-    
 
-def get_cs_action(nitro,cs_action_name):
+    :return: List of lines of a table with the number of calls, errors, total and mean seconds and the slowest call
+             by verb, resource type and ns_group; empty if no Nitro calls were made
+    '''
+    with nitro_metrics_lock:
+        metrics = sorted([(key, dict(metric)) for key, metric in nitro_metrics.items()])
+    if len(metrics) == 0:
+        return []
+    row = '{0:<8} {1:<40} {2:<20} {3:>7} {4:>6} {5:>9} {6:>9} {7:>9}'
+    lines = [row.format('verb','resource type','ns_group','calls','errors','total s','mean ms','max ms')]
+    for (verb, resource_type, ns_group), metric in metrics:
+        lines.append(row.format(verb,resource_type,ns_group,metric['calls'],metric['errors'],
+                                '{:.3f}'.format(metric['seconds']),
+                                '{:.1f}'.format(metric['seconds'] * 1000 / metric['calls']),
+                                '{:.1f}'.format(metric['max'] * 1000)))
+    lines.append(row.format('total','','',sum([metric['calls'] for key, metric in metrics]),
+                            sum([metric['errors'] for key, metric in metrics]),
+                            '{:.3f}'.format(sum([metric['seconds'] for key, metric in metrics])),'',''))
+    return lines
+
+
+def get_prometheus_label_value(value):
+    return value.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+
+def get_nitro_metrics_textfile():
     '''
 
-    :param nitro: NSNitro instance
-    :param cs_action_name: Content Switching Action name
-    :return: NSBaseResource containing CS Action attributes obtained from NS
+    :return: Nitro metrics in the Prometheus text exposition format
+    '''
+    with nitro_metrics_lock:
+        metrics = sorted([(key, dict(metric,buckets=list(metric['buckets']))) for key, metric in nitro_metrics.items()])
+    lines = ['# HELP netscaler_state_nitro_requests_total Nitro requests sent',
+             '# TYPE netscaler_state_nitro_requests_total counter']
+    labels = []
+    for (verb, resource_type, ns_group), metric in metrics:
+        labels.append('verb="{}",resource_type="{}",ns_group="{}"'.format(
+            get_prometheus_label_value(verb),get_prometheus_label_value(resource_type),
+            get_prometheus_label_value(ns_group)))
+        lines.append('netscaler_state_nitro_requests_total{{{}}} {}'.format(labels[-1],metric['calls']))
+    lines.extend(['# HELP netscaler_state_nitro_request_errors_total Nitro requests that failed',
+                  '# TYPE netscaler_state_nitro_request_errors_total counter'])
+    for label, (key, metric) in zip(labels,metrics):
+        lines.append('netscaler_state_nitro_request_errors_total{{{}}} {}'.format(label,metric['errors']))
+    lines.extend(['# HELP netscaler_state_nitro_request_duration_seconds Duration of Nitro requests',
+                  '# TYPE netscaler_state_nitro_request_duration_seconds histogram'])
+    for label, (key, metric) in zip(labels,metrics):
+        for bound, count in zip(nitro_latency_buckets,metric['buckets']):
+            lines.append('netscaler_state_nitro_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(label,bound,
+                                                                                                        count))
+        lines.append('netscaler_state_nitro_request_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(
+            label,metric['calls']))
+        lines.append('netscaler_state_nitro_request_duration_seconds_sum{{{}}} {}'.format(label,repr(metric['seconds'])))
+        lines.append('netscaler_state_nitro_request_duration_seconds_count{{{}}} {}'.format(label,metric['calls']))
+    with appliance_schedulers_lock:
+        schedulers = sorted(appliance_schedulers.items())
+    lines.extend(['# HELP netscaler_state_nitro_concurrency_limit Limit of Nitro requests in flight at the end of the run',
+                  '# TYPE netscaler_state_nitro_concurrency_limit gauge'])
+    for address, scheduler in schedulers:
+        lines.append('netscaler_state_nitro_concurrency_limit{{address="{}"}} {}'.format(
+            get_prometheus_label_value(address),repr(scheduler['limit'])))
+    lines.extend(['# HELP netscaler_state_nitro_concurrency_decreases_total Decreases of the Nitro concurrency limit',
+                  '# TYPE netscaler_state_nitro_concurrency_decreases_total counter'])
+    for address, scheduler in schedulers:
+        lines.append('netscaler_state_nitro_concurrency_decreases_total{{address="{}"}} {}'.format(
+            get_prometheus_label_value(address),scheduler['decreases']))
+    return '\n'.join(lines) + '\n'
+
+
+def report_nitro_metrics(metrics_filename=None):
+    '''
+
+    :param metrics_filename: Prometheus textfile collector file to write; None to only log the summary
+    :return: None
 
-    Gets Content Switching Action from NS using name
-    - No NSNitro object implements this functionality
-    - Used to implement CRUD capability for CS Actions
+    Logs the summary table of the Nitro calls made during the run and writes the textfile (see
+    write_nitro_metrics_textfile()).
     '''
-    ret = None
-    cs_action = NSBaseResource()
-    cs_action.resourcetype = 'csaction'
-    try:
-        cs_action.get_resource(nitro, cs_action_name)
-        ret = cs_action
-    except NSNitroError as error:
-        pass
+    for line in get_nitro_metrics_summary():
+        log.info(line)
+    with appliance_schedulers_lock:
+        for address, scheduler in sorted(appliance_schedulers.items()):
+            if scheduler['decreases'] > 0:
+                log.info('Nitro concurrency limit of {} decreased {} times; {:.1f} at the end of the run'.format(
+                    address,scheduler['decreases'],scheduler['limit']))
+    if metrics_filename is not None:
+        write_nitro_metrics_textfile(metrics_filename)
+    return None
 
-    return ret
 
-def delete_cs_action(nitro,cs_action_name):
+def write_nitro_metrics_textfile(metrics_filename):
     '''
 
-    :param nitro: NSNitro instance
-    :param cs_action_name: Content Switching Action name
-    :return: True if delete is successful; False otherwise
+    :param metrics_filename: Prometheus textfile collector file to write
+    :return: None
 
-    Deletes Content Switching Action from NS using name
-    - No NSNitro object implements this functionality
-    - Used to implement CRUD capability for CS Actions
+    The textfile is written to a temporary file that replaces the previous one, so the collector never reads a
+    partial file.
     '''
-    ret = True
-    cs_action = NSBaseResource()
-    cs_action.resourcetype = 'csaction'
-    cs_action.options = {'name':cs_action_name}
+    temp_filename = metrics_filename + '.tmp'
     try:
-        cs_action.delete_resource(nitro)
+        with open(temp_filename,'w') as f:
+            f.write(get_nitro_metrics_textfile())
+        os.rename(temp_filename,metrics_filename)
+    except (IOError, OSError) as error:
+        log.info('Metrics file {} could not be written: {}'.format(metrics_filename,error))
+    return None
+
+
+# Nitro connection settings.  'cassette' is the cassette from open_cassette() that Nitro requests are recorded to
+# or replayed from; None to send requests to the NetScaler without recording them.  'page_size' is the number of
+# resources read per request (see iter_projected_resources()); 0 reads a table in one request.
+nitro_settings = {'cassette':None,'page_size':1000}
+
+# Replaces credentials and session ids in cassettes
+cassette_scrubbed_value = 'scrubbed'
+
+
+class NSNitroBulkResponse(NSNitroResponse):
+    '''
+    NSNitroResponse of a bulk request; a failed bulk request sets 'failed' instead of raising NSNitroError, so the
+    result of each item can be read from the response.
+    '''
+    def _raise_exception(self):
+        return None
+
+
+def send_nitro_bulk_request(nitro,method,url,payload):
+    '''
+
+    :param nitro: NSNitro instance
+    :param method: HTTP method, 'POST' or 'PUT'
+    :param url: Request URL
+    :param payload: Nitro payload dictionary
+    :return: NSNitroBulkResponse; raises NSNitroError if the NetScaler cannot be reached or the response cannot be
+             parsed
+
+    Requests are encoded the same way NSNitro encodes them (form-encoded object for POST, JSON with the session id
+    for PUT).
+    '''
+    if method == 'POST':
+        data = urllib.urlencode({'object':json.dumps(payload)})
+        headers = {'Content-type':'application/x-www-form-urlencoded'}
+    else:
+        payload = dict(payload,sessionid=nitro.get_sessionid())
+        data = json.dumps(payload)
+        headers = {'Content-type':'application/json'}
+    headers['Cookie'] = 'sessionid=' + nitro.get_sessionid()
+    request = urllib2.Request(url,data,headers)
+    request.get_method = lambda: method
+    try:
+        try:
+            return NSNitroBulkResponse(urllib2.urlopen(request).read())
+        except urllib2.HTTPError as error:
+            return NSNitroBulkResponse(error.read())
+    except (urllib2.URLError, ValueError, KeyError) as error:
+        raise NSNitroError('{0} {1} failed: {2}'.format(method,url,error))
+
+
+def get_cassette_body(payload):
+    '''
+
+    :param payload: NSNitro POST payload (form fields with a JSON 'object') or PUT payload (dictionary); None for
+                    GET and DELETE requests
+    :return: JSON string of the payload with the session id removed and login credentials scrubbed; None if there
+             is no payload
+    '''
+    if payload is None:
+        return None
+    if 'object' in payload:
+        body = json.loads(payload['object'])
+    else:
+        body = dict(payload)
+    body.pop('sessionid',None)
+    if 'login' in body:
+        body['login'] = {'username':cassette_scrubbed_value,'password':cassette_scrubbed_value}
+    return json.dumps(body,sort_keys=True)
+
+
+def get_cassette_response(response):
+    '''
+
+    :param response: Nitro response body
+    :return: Response body with the session id scrubbed
+    '''
+    if '"sessionid"' in response:
+        body = json.loads(response)
+        body['sessionid'] = cassette_scrubbed_value
+        response = json.dumps(body)
+    return response
+
+
+def get_cassette_key(interaction):
+    return (interaction['ns_group'],interaction['verb'],interaction['url'],interaction['body'])
+
+
+def open_cassette(filename,mode):
+    '''
+
+    :param filename: Cassette filename; gzip compressed if the filename ends with .gz
+    :param mode: 'record' to record Nitro requests and responses to the cassette; 'replay' to serve Nitro requests
+                 from the cassette without connecting to the NetScaler
+    :return: Cassette dictionary; None if the cassette cannot be read
+
+    A cassette holds one JSON line per Nitro request with the ns_group, HTTP verb, URL path after /nitro/v1/config/
+    and payload of the request, and either the response body or the error raised.  Credentials and session ids are
+    scrubbed.  When replaying, each request is answered with the next recorded response of the same ns_group,
+    verb, URL and payload.
+    '''
+    cassette = {'filename':filename,'mode':mode,'lock':threading.Lock(),'interactions':[],'queues':{},
+                'replayed':0,'missing':0,'cpu_start':sum(os.times()[:2])}
+    if mode == 'replay':
+        try:
+            with (gzip.open(filename,'rb') if filename.endswith('.gz') else open(filename,'r')) as f:
+                for line in f:
+                    interaction = json.loads(line)
+                    cassette['queues'].setdefault(get_cassette_key(interaction),deque()).append(interaction)
+        except (IOError, ValueError, KeyError, zlib.error) as error:
+            log.info('Cassette {} could not be read: {}'.format(filename,error))
+            return None
+    return cassette
+
+
+def close_cassette(cassette):
+    '''
+
+    :param cassette: Cassette dictionary from open_cassette()
+    :return: True if the recorded cassette is written, or if every replayed request was in the cassette; False
+             otherwise
+
+    Writes a recorded cassette.  For a replayed cassette, logs the number of requests replayed, the requests that
+    were not in the cassette and the recorded requests that were not made, along with the CPU time of the run.
+    '''
+    if cassette['mode'] == 'record':
+        try:
+            with (gzip.open(cassette['filename'],'wb') if cassette['filename'].endswith('.gz') else
+                  open(cassette['filename'],'w')) as f:
+                for interaction in cassette['interactions']:
+                    f.write(json.dumps(interaction) + '\n')
+        except (IOError, OSError) as error:
+            log.info('Cassette {} could not be written: {}'.format(cassette['filename'],error))
+            return False
+        log.info('Recorded {} Nitro calls to {}'.format(len(cassette['interactions']),cassette['filename']))
+        return True
+    unused = sum([len(queue) for queue in cassette['queues'].values()])
+    log.info('Replayed {} Nitro calls from {}; {} calls were not in the cassette and {} recorded calls were not '
+             'made; {:.3f} s CPU time'.format(cassette['replayed'],cassette['filename'],cassette['missing'],unused,
+                                              sum(os.times()[:2]) - cassette['cpu_start']))
+    return cassette['missing'] == 0
+
+
+def new_cassette_interaction(nitro,verb,url,payload):
+    return OrderedDict([('ns_group',getattr(ns_group_context,'name',None)),('verb',verb),
+                        ('url',url[len(nitro.get_url()):]),('body',get_cassette_body(payload))])
+
+
+def record_cassette_interaction(cassette,interaction,response=None,error=None):
+    '''
+
+    :param cassette: Cassette dictionary from open_cassette()
+    :param interaction: Request from new_cassette_interaction()
+    :param response: Response body; None if the request raised an error
+    :param error: Exception raised by the request
+    :return: None
+    '''
+    if error is not None:
+        interaction['error'] = {'message':str(getattr(error,'message',None) or error),
+                                'errorcode':getattr(error,'code',0) if isinstance(error,NSNitroError) else 0}
+    else:
+        interaction['response'] = get_cassette_response(response)
+    with cassette['lock']:
+        cassette['interactions'].append(interaction)
+    return None
+
+
+def replay_cassette_interaction(cassette,interaction,response_class):
+    '''
+
+    :param cassette: Cassette dictionary from open_cassette()
+    :param interaction: Request from new_cassette_interaction()
+    :param response_class: NSNitroResponse class of the response
+    :return: Recorded response of the request; raises the recorded error, or NSNitroError if the request was not
+             recorded
+    '''
+    with cassette['lock']:
+        queue = cassette['queues'].get(get_cassette_key(interaction))
+        if not queue:
+            cassette['missing'] += 1
+            raise NSNitroError('{0} {1} is not in cassette {2}'.format(interaction['verb'],interaction['url'],
+                                                                       cassette['filename']))
+        recorded = queue.popleft()
+        cassette['replayed'] += 1
+    if 'error' in recorded:
+        error = recorded['error']
+        if error['errorcode']:
+            # Error codes nsnitro does not map raise NSNitroError, as they do on a live connection
+            raise NSNitroExceptionClassMap.get(error['errorcode'],NSNitroError)(error['message'],error['errorcode'])
+        raise NSNitroError(error['message'])
+    return response_class(recorded['response'])
+
+
+def connect(ns_instance):
+    '''
+
+    :param ns_instance: NSNitro instance
+    :return: Connected InstrumentedNSNitro instance; None if login fails
+    '''
+    nitro = InstrumentedNSNitro(ns_instance['address'],ns_instance['user'],ns_instance['pass'])
+    nitro.scheduler = get_appliance_scheduler(ns_instance)
+    try:
+        nitro.login()
+    except NSNitroError as error:
+        log.debug('NSNitro.login() failed: {0}'.format(error))
+        nitro = None
+    return nitro
+
+
+def disconnect(nitro):
+    '''
+
+    :param nitro: NSNitro instance
+    :return:  Disconnected NSNitro instance
+    '''
+    try:
+        nitro.logout()
+    except NSNitroError as error:
+        log.debug('NSNitro.logout() failed: {0}'.format(error))
+        return None
+    return nitro
+
+
+def create_ns_resource_object(ns_resource_object,object_conf):
+    options = map_yaml_config_to_nitro_object_options(object_conf)
+    ns_resource_object.set_options(object_conf)
+
+def map_yaml_config_to_nitro_object_options(resource_type,object_conf):
+    options = {}
+    for property in rw_properties[resource_type]:
+        nitro_property = property['nitro']
+        yaml_property = property['yaml']
+        options[nitro_property] = object_conf[yaml_property]
+    return options
+
+
+def map_nitro_object_options_to_yaml_config(resource_type,nitro_object):
+    return map_nitro_options_to_yaml_config(resource_type,nitro_object.options)
+
+
+def map_nitro_options_to_yaml_config(resource_type,options):
+    yaml_config = {}
+    for property in rw_properties[resource_type]:
+        nitro_property = property['nitro']
+        yaml_property = property['yaml']
+        yaml_config[yaml_property] = options[nitro_property]
+        # Nitro returns some numeric properties as strings; the YAML schema expects integers
+        if 'type' in property:
+            yaml_config[yaml_property] = property['type'](yaml_config[yaml_property])
+    return yaml_config
+
+
+def new_ns_snapshot():
+    '''
+
+    :return: Empty snapshot dictionary
+
+    A snapshot holds the managed configuration of one NetScaler in memory:
+    - 'resources': resource type -> OrderedDict of resource name -> Nitro options
+    - 'bindings': binding type -> parent resource name -> OrderedDict of binding key -> Nitro options
+    - 'addresses': resource type -> address key (IP, or VIP and port) -> resource name
+    - 'targets': binding type -> target resource name -> set of parent resource names that may bind it
+    '''
+    snapshot = {'resources':{}, 'bindings':{}, 'addresses':{}, 'targets':{}}
+    for resource_type in ns_snapshot_resource_types:
+        snapshot['resources'][resource_type] = OrderedDict()
+    for binding_type in ns_binding_types.keys():
+        snapshot['bindings'][binding_type] = {}
+        snapshot['targets'][binding_type] = {}
+    for resource_type in ns_address_properties.keys():
+        snapshot['addresses'][resource_type] = {}
+    return snapshot
+
+
+def copy_ns_snapshot(snapshot):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :return: Copy of the snapshot that can be changed without changing the input snapshot
+
+    Copies the containers and option dictionaries of the snapshot; keys and option values are never changed in place
+    so they are shared.
+    '''
+    snapshot_copy = new_ns_snapshot()
+    for resource_type, resources in snapshot['resources'].items():
+        resources_copy = snapshot_copy['resources'][resource_type]
+        for name, options in resources.items():
+            resources_copy[name] = dict(options)
+    for binding_type, parents in snapshot['bindings'].items():
+        parents_copy = snapshot_copy['bindings'][binding_type]
+        for parent_name, parent_bindings in parents.items():
+            parents_copy[parent_name] = OrderedDict([(key, dict(options)) for key, options in parent_bindings.items()])
+    for resource_type, addresses in snapshot['addresses'].items():
+        snapshot_copy['addresses'][resource_type] = dict(addresses)
+    for binding_type, targets in snapshot['targets'].items():
+        snapshot_copy['targets'][binding_type] = dict([(name, set(parent_names)) for name, parent_names in targets.items()])
+    return snapshot_copy
+
+
+def get_ns_snapshot(nitro):
+    '''
+
+    :param nitro: NSNitro connection object
+    :return: Snapshot dictionary (see new_ns_snapshot()) containing the managed configuration of the NetScaler
+
+    Fetches every managed resource type and every binding type once, in pages for large tables, and adds each
+    resource to the snapshot as its page is read.  Raises NSNitroError if any table cannot be read, rather than
+    return a snapshot missing part of it.  Operations are planned against this snapshot and it is kept
+    current after each change applied, so the NetScaler is never queried again while the state is applied.
+    '''
+    snapshot = new_ns_snapshot()
+    for resource_type in ns_snapshot_resource_types:
+        for resource in get_all_resources_by_type(nitro,resource_type):
+            add_resource_to_snapshot(snapshot,resource_type,resource.options)
+    for binding_type, binding in ns_binding_types.items():
+        parent_names = snapshot['resources'][binding['parent']].keys()
+        for resource in get_all_bindings_by_type(nitro,binding_type,parent_names):
+            add_binding_to_snapshot(snapshot,binding_type,resource.options)
+    return snapshot
+
+
+def get_snapshot_key(options,properties):
+    '''
+
+    :param options: Dictionary of Nitro options
+    :param properties: List of Nitro property names
+    :return: Tuple of the property values as strings; None if any property is missing
+
+    Values are compared as strings since the NetScaler returns some numeric properties (e.g. port, priority) as strings.
+    '''
+    key = []
+    for property in properties:
+        if options.get(property) is None:
+            return None
+        key.append(str(options[property]))
+    return tuple(key)
+
+
+def get_changed_properties(existing_options,desired_options):
+    '''
+
+    :param existing_options: Dictionary of Nitro options from the snapshot
+    :param desired_options: Dictionary of Nitro options built from the input configuration
+    :return: List of desired property names whose value differs from the existing resource
+    '''
+    changed_properties = []
+    for property in desired_options.keys():
+        if get_snapshot_key(existing_options,[property]) != get_snapshot_key(desired_options,[property]):
+            changed_properties.append(property)
+    return changed_properties
+
+
+def get_snapshot_resource(snapshot,resource_type,resource_name):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :param resource_name: Name of resource
+    :return: Dictionary of Nitro options for the named resource; None if it does not exist
+    '''
+    return snapshot['resources'][resource_type].get(resource_name)
+
+
+def get_snapshot_address_owner(snapshot,resource_type,options):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type listed in ns_address_properties
+    :param options: Dictionary of Nitro options containing the address properties
+    :return: Name of the existing resource using the same address; None if the address is free
+    '''
+    return snapshot['addresses'][resource_type].get(get_snapshot_key(options,ns_address_properties[resource_type]))
+
+
+def get_snapshot_bindings(snapshot,binding_type,parent_name):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param binding_type: Nitro binding type listed in ns_binding_types
+    :param parent_name: Name of the resource the bindings belong to
+    :return: OrderedDict of binding key -> Nitro options; empty if no bindings exist
+    '''
+    return snapshot['bindings'][binding_type].get(parent_name,OrderedDict())
+
+
+def add_resource_to_snapshot(snapshot,resource_type,options):
+    name = options[ns_resource_id[resource_type]]
+    snapshot['resources'][resource_type][name] = options
+    if resource_type in ns_address_properties:
+        address = get_snapshot_key(options,ns_address_properties[resource_type])
+        if address is not None:
+            snapshot['addresses'][resource_type][address] = name
+
+
+def remove_address_from_snapshot(snapshot,resource_type,options):
+    if resource_type in ns_address_properties:
+        address = get_snapshot_key(options,ns_address_properties[resource_type])
+        if snapshot['addresses'][resource_type].get(address) == options[ns_resource_id[resource_type]]:
+            snapshot['addresses'][resource_type].pop(address)
+
+
+def update_resource_in_snapshot(snapshot,resource_type,options):
+    existing_options = get_snapshot_resource(snapshot,resource_type,options[ns_resource_id[resource_type]])
+    if existing_options is not None:
+        remove_address_from_snapshot(snapshot,resource_type,existing_options)
+        existing_options.update(options)
+        add_resource_to_snapshot(snapshot,resource_type,existing_options)
+
+
+def remove_resource_from_snapshot(snapshot,resource_type,resource_name):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :param resource_name: Name of the deleted resource
+    :return: None
+
+    Removes the resource along with the bindings the NetScaler removes when the resource is deleted.
+    '''
+    options = snapshot['resources'][resource_type].pop(resource_name,None)
+    if options is not None:
+        remove_address_from_snapshot(snapshot,resource_type,options)
+        for binding_type, binding in ns_binding_types.items():
+            if binding['parent'] == resource_type:
+                snapshot['bindings'][binding_type].pop(resource_name,None)
+            elif binding['target'] == resource_type:
+                for parent_bindings in pop_target_bindings(snapshot,binding_type,resource_name):
+                    for key, binding_options in list(parent_bindings.items()):
+                        if binding_options.get(binding['target_property']) == resource_name:
+                            parent_bindings.pop(key)
+    return None
+
+
+def pop_target_bindings(snapshot,binding_type,target_name):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param binding_type: Nitro binding type listed in ns_binding_types
+    :param target_name: Name of the bound resource
+    :return: List of the OrderedDicts of bindings (see get_snapshot_bindings()) that may bind the target
+
+    Looks up the parents binding the target in the 'targets' index instead of scanning every binding of the type.
+    The index entry is removed; entries are not removed with the bindings, so the returned bindings may not bind
+    the target anymore.
+    '''
+    parent_names = snapshot['targets'][binding_type].pop(target_name,set())
+    return [snapshot['bindings'][binding_type][parent_name] for parent_name in parent_names
+            if parent_name in snapshot['bindings'][binding_type]]
+
+
+def rename_resource_in_snapshot(snapshot,resource_type,resource_name,new_name):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :param resource_name: Current name of the resource
+    :param new_name: New name of the resource
+    :return: None
+
+    Renames the resource and every binding or reference to it, matching the NetScaler rename behavior.
+    '''
+    options = snapshot['resources'][resource_type].pop(resource_name,None)
+    if options is None:
+        return None
+    remove_address_from_snapshot(snapshot,resource_type,options)
+    options[ns_resource_id[resource_type]] = new_name
+    add_resource_to_snapshot(snapshot,resource_type,options)
+    for binding_type, binding in ns_binding_types.items():
+        if binding['parent'] == resource_type and resource_name in snapshot['bindings'][binding_type]:
+            parent_bindings = snapshot['bindings'][binding_type].pop(resource_name)
+            for binding_options in parent_bindings.values():
+                binding_options[binding['parent_property']] = new_name
+                add_binding_target_to_snapshot(snapshot,binding_type,binding_options)
+            snapshot['bindings'][binding_type][new_name] = parent_bindings
+        elif binding['target'] == resource_type:
+            for parent_bindings in pop_target_bindings(snapshot,binding_type,resource_name):
+                for key, binding_options in list(parent_bindings.items()):
+                    if binding_options.get(binding['target_property']) == resource_name:
+                        parent_bindings.pop(key)
+                        binding_options[binding['target_property']] = new_name
+                        parent_bindings[get_snapshot_key(binding_options,binding['key'])] = binding_options
+                        add_binding_target_to_snapshot(snapshot,binding_type,binding_options)
+    for referring_type, references in ns_resource_references.items():
+        for reference in references:
+            if reference['resource_type'] == resource_type:
+                for referring_options in snapshot['resources'][referring_type].values():
+                    if referring_options.get(reference['nitro']) == resource_name:
+                        referring_options[reference['nitro']] = new_name
+    return None
+
+
+def add_binding_to_snapshot(snapshot,binding_type,options):
+    binding = ns_binding_types[binding_type]
+    parent_bindings = snapshot['bindings'][binding_type].setdefault(options[binding['parent_property']],OrderedDict())
+    parent_bindings[get_snapshot_key(options,binding['key'])] = options
+    add_binding_target_to_snapshot(snapshot,binding_type,options)
+
+
+def add_binding_target_to_snapshot(snapshot,binding_type,options):
+    binding = ns_binding_types[binding_type]
+    if binding['target_property'] in options:
+        parent_names = snapshot['targets'][binding_type].setdefault(options[binding['target_property']],set())
+        parent_names.add(options[binding['parent_property']])
+
+
+def remove_binding_from_snapshot(snapshot,binding_type,options):
+    binding = ns_binding_types[binding_type]
+    parent_bindings = snapshot['bindings'][binding_type].get(options[binding['parent_property']])
+    if parent_bindings is not None:
+        parent_bindings.pop(get_snapshot_key(options,binding['key']),None)
+
+
+def update_snapshot(snapshot,operation):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param operation: Operation applied to the NetScaler (see new_operation())
+    :return: None
+
+    Keeps the snapshot current after a change has been applied to the NetScaler.
+    '''
+    action = operation['action']
+    resource_type = operation['resource_type']
+    options = dict(operation['options'])
+    if resource_type in ns_binding_types:
+        if action == 'add':
+            add_binding_to_snapshot(snapshot,resource_type,options)
+        elif action == 'update':
+            snapshot['bindings'][resource_type][operation['name']] = OrderedDict()
+            add_binding_to_snapshot(snapshot,resource_type,options)
+        elif action == 'delete':
+            remove_binding_from_snapshot(snapshot,resource_type,options)
+    else:
+        if action == 'add':
+            add_resource_to_snapshot(snapshot,resource_type,options)
+        elif action == 'update':
+            update_resource_in_snapshot(snapshot,resource_type,options)
+        elif action == 'rename':
+            rename_resource_in_snapshot(snapshot,resource_type,operation['name'],options['newname'])
+        elif action == 'delete':
+            remove_resource_from_snapshot(snapshot,resource_type,operation['name'])
+    return None
+
+
+def new_operation(action,resource_type,name,options):
+    '''
+
+    :param action: 'add', 'update', 'rename' or 'delete'
+    :param resource_type: Nitro resource or binding type
+    :param name: Name of the resource; name of the parent resource for bindings
+    :param options: Dictionary of Nitro options sent to the NetScaler
+    :return: OrderedDict describing a single change to the NetScaler configuration
+
+    'source' is set by the planner to the YAML configuration item the operation was planned for; it is None for
+    deletes of resources that are not in the configuration.  'index' is the position of the operation in the plan
+    written to the operation journal (see journal_plan()).
+    '''
+    operation = OrderedDict()
+    operation['action'] = action
+    operation['resource_type'] = resource_type
+    operation['name'] = name
+    operation['options'] = options
+    operation['source'] = None
+    operation['index'] = None
+    return operation
+
+
+def log_operation_failure(operation,error):
+    '''
+
+    :param operation: Operation that failed (see new_operation())
+    :param error: Error returned by the NetScaler
+    :return: None
+    '''
+    if operation['source'] is not None:
+        log.info('{0}: {1} {2} {3} failed: {4}'.format(operation['source'],operation['action'],
+                                                        operation['resource_type'],operation['name'],error))
+    else:
+        log.info('{0} {1} {2} failed: {3}'.format(operation['action'],operation['resource_type'],
+                                                  operation['name'],error))
+    return None
+
+
+def send_operation(nitro,operation):
+    '''
+
+    :param nitro: NSNitro instance
+    :param operation: Operation to apply (see new_operation())
+    :return: NSNitroResponse returned by the NetScaler; raises NSNitroError on failure
+
+    Uses the NSNitro resource class where one exists.  CS Actions, CS Policies and csvserver_lbvserver_binding
+    have no usable NSNitro class and are sent with NSBaseResource.
+    '''
+    action = operation['action']
+    resource_type = operation['resource_type']
+    if resource_type in ns_resource_classes:
+        resource_class = ns_resource_classes[resource_type]
+        return getattr(resource_class,action)(nitro,resource_class(operation['options']))
+    if action == 'delete' and resource_type in ns_resource_id:
+        return nitro.delete('{0}{1}/{2}'.format(nitro.get_url(),resource_type,operation['name']))
+    resource = NSBaseResource()
+    resource.resourcetype = resource_type
+    resource.set_options(dict(operation['options']))
+    if action == 'add':
+        return resource.add_resource(nitro)
+    elif action == 'update':
+        return resource.update_resource(nitro)
+    return resource.delete_resource(nitro,operation['name'])
+
+
+# Serializes changes to a snapshot shared by the lanes of apply_operations()
+ns_snapshot_lock = threading.Lock()
+
+
+def apply_operation(nitro,snapshot,operation):
+    '''
+
+    :param nitro: NSNitro instance
+    :param snapshot: Snapshot dictionary
+    :param operation: Operation to apply (see new_operation())
+    :return: True if the operation is applied successfully; False otherwise
+    '''
+    ret = True
+    try:
+        send_operation(nitro,operation)
+        with ns_snapshot_lock:
+            update_snapshot(snapshot,operation)
     except NSNitroError as error:
-        log.debug('NSBaseResource.delete_resource() failed: {0}'.format(error))
+        log_operation_failure(operation,error)
         ret = False
     return ret
 
-def update_cs_action(nitro,cs_action):
+
+def get_bulk_request(operation):
+    '''
+
+    :param operation: Operation (see new_operation())
+    :return: Dictionary with the HTTP method and Nitro action used to send the operation in bulk; None if the
+             operation is always sent on its own
+    '''
+    if operation['resource_type'] in ns_binding_types:
+        return ns_bulk_binding_requests.get(operation['action'])
+    return ns_bulk_requests.get(operation['action'])
+
+
+def get_operation_batches(operations,chunk_size):
+    '''
+
+    :param operations: List of operations in the order they must be applied
+    :param chunk_size: Maximum number of operations sent in one Nitro request
+    :return: List of batches (lists of operations) in the order they must be applied
+
+    Consecutive operations with the same resource type and action are grouped into batches of up to chunk_size
+    operations.  They are independent of each other in a plan from get_ns_group_operations(), except for renames,
+    which may depend on the rename before them, and address moves (see new_address_update_operation()), which may
+    need the address freed by the move before them; both are always sent on their own.
+    '''
+    batches = []
+    for operation in operations:
+        if chunk_size > 1 and len(batches) > 0 and get_bulk_request(operation) is not None and \
+                not operation.get('ordered',False):
+            batch = batches[-1]
+            if len(batch) < chunk_size and batch[0]['resource_type'] == operation['resource_type'] and \
+                    batch[0]['action'] == operation['action'] and not batch[0].get('ordered',False):
+                batch.append(operation)
+                continue
+        batches.append([operation])
+    return batches
+
+
+def get_request_resource(operation):
+    '''
+
+    :param operation: Operation (see new_operation())
+    :return: Dictionary of the options sent to the NetScaler for the operation
+    '''
+    return dict([(k, v) for k, v in operation['options'].items() if v is not None and v != ''])
+
+
+def get_bulk_payload(operations):
+    '''
+
+    :param operations: List of operations with the same resource type and action
+    :return: Nitro payload dictionary adding, updating or deleting all resources in one request
+    '''
+    return {'params':{'onerror':'continue'},
+            operations[0]['resource_type']:[get_request_resource(operation) for operation in operations]}
+
+
+def get_operation_batch_bytes(operations):
+    '''
+
+    :param operations: Batch of operations from get_operation_batches()
+    :return: Estimated size in bytes of the Nitro request sending the batch
+
+    The estimate is the size of the JSON payload, or of the URL arguments for a single delete; HTTP headers and
+    the session id are not counted.
+    '''
+    operation = operations[0]
+    if len(operations) > 1:
+        return len(json.dumps(get_bulk_payload(operations)))
+    if operation['action'] == 'delete':
+        return len(urllib.urlencode(get_request_resource(operation)))
+    payload = {operation['resource_type']:get_request_resource(operation)}
+    if operation['action'] == 'rename':
+        payload['params'] = {'action':'rename'}
+    return len(json.dumps(payload))
+
+
+def send_bulk_operations(nitro,operations):
+    '''
+
+    :param nitro: NSNitro instance
+    :param operations: List of operations with the same resource type and action
+    :return: List with an error message for each operation that failed and None for each that succeeded
+
+    Sends all operations in one Nitro request with onerror=continue (see send_nitro_bulk_request()); the response
+    is parsed here since NSNitro drops the per-item results of a failed bulk request.
+    '''
+    resource_type = operations[0]['resource_type']
+    bulk_request = get_bulk_request(operations[0])
+    payload = get_bulk_payload(operations)
+    url = nitro.get_url() + resource_type
+    if bulk_request['action'] is not None:
+        url += '?action=' + bulk_request['action']
+    try:
+        response = nitro.send_bulk(bulk_request['method'],url,payload).get_json_response()
+    except NSNitroError as error:
+        raise NSNitroError('bulk {0} {1} request failed: {2}'.format(operations[0]['action'],resource_type,
+                                                                     error.message))
+
+    errors = [None] * len(operations)
+    if response.get('errorcode',0) != 0:
+        item_responses = response.get('response')
+        if isinstance(item_responses,list) and len(item_responses) == len(operations):
+            for i, item_response in enumerate(item_responses):
+                if item_response.get('errorcode',0) != 0:
+                    errors[i] = item_response.get('message')
+        else:
+            errors = [response.get('message')] * len(operations)
+    return errors
+
+
+def apply_operation_batch(nitro,snapshot,operations):
+    '''
+
+    :param nitro: NSNitro instance
+    :param snapshot: Snapshot dictionary
+    :param operations: Batch of operations from get_operation_batches()
+    :return: True if all operations are applied successfully; False otherwise
+
+    Failures are reported for each operation along with the configuration item it was planned for.
+    '''
+    if len(operations) == 1:
+        return apply_operation(nitro,snapshot,operations[0])
+    ret = True
+    try:
+        errors = send_bulk_operations(nitro,operations)
+    except NSNitroError as error:
+        errors = [error] * len(operations)
+    for operation, error in zip(operations,errors):
+        if error is None:
+            with ns_snapshot_lock:
+                update_snapshot(snapshot,operation)
+        else:
+            log_operation_failure(operation,error)
+            ret = False
+    return ret
+
+
+def get_operation_resource_keys(snapshot,operation):
+    '''
+
+    :param snapshot: Snapshot dictionary the operation was planned from
+    :param operation: Operation (see new_operation())
+    :return: List of the resources ((resource type, name)) and addresses (('address', resource type, address key))
+             the operation changes or depends on
+
+    A binding depends on its parent and target resources.  A resource depends on its new name if renamed, on the
+    resources it refers to and on its address, both as planned and as it exists in the snapshot.
+    '''
+    resource_type = operation['resource_type']
+    options = operation['options']
+    if resource_type in ns_binding_types:
+        binding = ns_binding_types[resource_type]
+        keys = [(binding['parent'],operation['name'])]
+        if options.get(binding['target_property']) is not None:
+            keys.append((binding['target'],options[binding['target_property']]))
+        return keys
+    keys = [(resource_type,operation['name'])]
+    if operation['action'] == 'rename':
+        keys.append((resource_type,options['newname']))
+    existing_options = get_snapshot_resource(snapshot,resource_type,operation['name'])
+    # Updates only carry the changed properties
+    planned_options = dict(existing_options or {})
+    planned_options.update(options)
+    for resource_options in [planned_options,existing_options]:
+        if resource_options is None:
+            continue
+        for reference in ns_resource_references.get(resource_type,[]):
+            if resource_options.get(reference['nitro']) is not None:
+                keys.append((reference['resource_type'],resource_options[reference['nitro']]))
+        address_properties = ns_address_properties.get(resource_type,[])
+        if len(address_properties) > 0 and all([resource_options.get(property) is not None
+                                                for property in address_properties]):
+            keys.append(('address',resource_type,get_snapshot_key(resource_options,address_properties)))
+    return keys
+
+
+def get_operation_components(snapshot,operations):
+    '''
+
+    :param snapshot: Snapshot dictionary the operations were planned from
+    :param operations: List of operations in the order they must be applied
+    :return: List with the component number of each operation; components are numbered in order of their first
+             operation
+
+    Operations are in the same component when they depend on a common resource or address (see
+    get_operation_resource_keys()) or were planned for the same configuration item, directly or through other
+    operations.  Operations in different components can be applied in any order relative to each other.
+    '''
+    parents = {}
+
+    def find(key):
+        parents.setdefault(key,key)
+        while parents[key] != key:
+            parents[key] = parents[parents[key]]
+            key = parents[key]
+        return key
+
+    operation_keys = []
+    for operation in operations:
+        keys = get_operation_resource_keys(snapshot,operation)
+        if operation['source'] is not None:
+            keys.append(('source',operation['source']))
+        root = find(keys[0])
+        for key in keys[1:]:
+            key_root = find(key)
+            if key_root != root:
+                parents[key_root] = root
+        operation_keys.append(keys[0])
+
+    component_numbers = {}
+    components = []
+    for key in operation_keys:
+        components.append(component_numbers.setdefault(find(key),len(component_numbers)))
+    return components
+
+
+def get_operation_lanes(snapshot,operations,workers):
+    '''
+
+    :param snapshot: Snapshot dictionary the operations were planned from
+    :param operations: List of operations in the order they must be applied
+    :param workers: Maximum number of lanes
+    :return: List of lanes (lists of operations in plan order) that can be applied concurrently
+
+    Components from get_operation_components() are assigned largest first to the lane with the fewest operations.
+    Each lane keeps the plan order, so its consecutive adds, updates and deletes are still sent in bulk.
+    '''
+    components = get_operation_components(snapshot,operations)
+    component_sizes = Counter(components)
+    lane_count = min(workers,len(component_sizes))
+    if lane_count <= 1:
+        return [operations]
+    lane_sizes = [0] * lane_count
+    component_lanes = {}
+    for component, size in sorted(component_sizes.items(),key=lambda item: (-item[1],item[0])):
+        lane = lane_sizes.index(min(lane_sizes))
+        component_lanes[component] = lane
+        lane_sizes[lane] += size
+    lanes = [[] for i in range(lane_count)]
+    for operation, component in zip(operations,components):
+        lanes[component_lanes[component]].append(operation)
+    return lanes
+
+
+def apply_operation_batches(nitro,snapshot,batches,journal=None,stop=None):
+    '''
+
+    :param nitro: NSNitro instance
+    :param snapshot: Snapshot dictionary
+    :param batches: List of batches from get_operation_batches()
+    :param journal: Journal dictionary from get_journal(); None to apply without a journal
+    :param stop: threading.Event that stops the batches before the next one is sent; None to send every batch
+    :return: True if all operations are applied successfully; False otherwise
+
+    With a journal, each batch is journaled before it is sent and again with its outcome.
+    '''
+    ret = True
+    for batch in batches:
+        if stop is not None and stop.is_set():
+            return False
+        indexes = [operation['index'] for operation in batch]
+        if journal is not None:
+            append_journal(journal,[{'event':'start','operations':indexes}])
+        success = apply_operation_batch(nitro,snapshot,batch)
+        if journal is not None:
+            append_journal(journal,[{'event':'done','operations':indexes,'success':success}])
+        if not success:
+            ret = False
+    return ret
+
+
+def apply_operations(nitro,snapshot,operations,chunk_size=1,journal=None,workers=1):
+    '''
+
+    :param nitro: NSNitro instance
+    :param snapshot: Snapshot dictionary the operations were planned from
+    :param operations: List of operations to apply in order
+    :param chunk_size: Maximum number of operations sent in one Nitro request
+    :param journal: Journal dictionary from get_journal() the plan of the operations was written to; None to apply
+                    without a journal
+    :param workers: Maximum number of lanes of independent operations applied concurrently
+    :return: True if all operations are applied successfully; False otherwise
+
+    The operations are split into lanes that share no resource (see get_operation_lanes()) and each lane is applied
+    on its own thread, with its own batches; the Nitro requests of all lanes are scheduled by the scheduler of the
+    NetScaler.  With a journal, the end of the plan is journaled once every lane has been applied.
+    '''
+    lanes = get_operation_lanes(snapshot,operations,workers) if workers > 1 else [operations]
+    if len(lanes) > 1:
+        log.info('Applying {0} operations in {1} concurrent lanes'.format(len(operations),len(lanes)))
+        ns_group_name = getattr(ns_group_context,'name',None)
+        stop = threading.Event()
+
+        def apply_lane(lane):
+            ns_group_context.name = ns_group_name
+            try:
+                return apply_operation_batches(nitro,snapshot,get_operation_batches(lane,chunk_size),journal,stop)
+            finally:
+                ns_group_context.name = None
+
+        pool = ThreadPool(len(lanes))
+        try:
+            # Waiting with a timeout keeps the wait interruptible; when interrupted, every lane stops after the
+            # batch it is sending
+            ret = all(pool.map_async(apply_lane,lanes).get(sys.maxint))
+        finally:
+            stop.set()
+            pool.close()
+            pool.join()
+    else:
+        ret = apply_operation_batches(nitro,snapshot,get_operation_batches(operations,chunk_size),journal)
+    if journal is not None:
+        append_journal(journal,[{'event':'end','success':ret}],sync=True)
+    return ret
+
+
+def get_binding_operations(snapshot,binding_type,parent_name,desired_bindings):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param binding_type: Nitro binding type listed in ns_binding_types
+    :param parent_name: Name of the resource the bindings belong to
+    :param desired_bindings: OrderedDict of binding key -> Nitro options built from the input configuration
+    :return: List of operations needed to match the desired bindings
+
+    - Existing bindings that are not in the input configuration, or that differ from it, are deleted
+    - Bindings in the input configuration that do not exist (or were deleted) are added
+    '''
+    operations = []
+    binding = ns_binding_types[binding_type]
+    existing_bindings = get_snapshot_bindings(snapshot,binding_type,parent_name)
+    changed_keys = set()
+    for key, existing_options in existing_bindings.items():
+        if key not in desired_bindings or get_changed_properties(existing_options,desired_bindings[key]):
+            changed_keys.add(key)
+            options = {binding['parent_property']:parent_name}
+            for property in binding['key']:
+                options[property] = existing_options[property]
+            operations.append(new_operation('delete',binding_type,parent_name,options))
+    for key, options in desired_bindings.items():
+        if key not in existing_bindings or key in changed_keys:
+            operations.append(new_operation('add',binding_type,parent_name,options))
+    return operations
+
+
+def get_orphan_operations(snapshot,resource_type,resources_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :param resources_conf: List of configuration items of the resource type from input file; None if not present
+    :return: List of delete operations for existing resources that do not match a configuration item name
+    '''
+    operations = []
+    names = set()
+    if resources_conf is not None:
+        for resource_conf in resources_conf:
+            names.add(resource_conf['name'])
+    for name in snapshot['resources'][resource_type].keys():
+        if name not in names:
+            operations.append(new_operation('delete',resource_type,name,{ns_resource_id[resource_type]:name}))
+    return operations
+
+
+def get_server_operations(snapshot,server_conf):
     '''
 
-    :param nitro: NSNitro instance
-    :param cs_action: Content Switching Action object (NSBaseResource)
-    :return: True if updated successfully; False otherwise
+    :param snapshot: Snapshot dictionary
+    :param server_conf: Server configuration item from input file
+    :return: List of operations needed to match the input server configuration item
 
-    Updates existing Content Switching Action on NS
-    - No NSNitro object implements this functionality
-    - Used to implement CRUD capability for CS Actions
+    - If a server name and IP match the input configuration, nothing changes.
+    - If a server name matches the input configuration but the IP doesn't, the IP is updated.
+    - If an existing server with another name still has the IP address used in the configuration after
+      get_address_operations(), it is deleted.
+    - A new server is created if no server name matches the input configuration.
     '''
-    ret = True
-    updated_cs_action = NSBaseResource()
-    updated_cs_action.resourcetype = 'csaction'
-    updated_cs_action.options = {'name':cs_action.options['name'],'targetlbvserver':cs_action.options['targetlbvserver']}
-    try:
-        updated_cs_action.update_resource(nitro)
-    except NSNitroError as error:
-        log.debug('NSBaseResource.update_resource() failed: {0}'.format(error))
-        ret = False
-    return ret
+    operations = []
+    desired_server = map_yaml_config_to_nitro_object_options('server',server_conf)
+    existing_server = get_snapshot_resource(snapshot,'server',server_conf['name'])
+    address_owner = get_snapshot_address_owner(snapshot,'server',desired_server)
+    if address_owner is not None and address_owner != server_conf['name']:
+        operations.append(new_operation('delete','server',address_owner,{'name':address_owner}))
+    if existing_server is None:
+        operations.append(new_operation('add','server',server_conf['name'],desired_server))
+    elif get_changed_properties(existing_server,desired_server):
+        operations.append(new_operation('update','server',server_conf['name'],desired_server))
+    return operations
+
+
+def get_service_group_operations(snapshot,service_group_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param service_group_conf: Service Group configuration item from input file
+    :return: List of operations needed to match the input service group configuration item
 
-def ensure_cs_action_state(nitro,cs_action_conf):
+    - A new service group is created if no matching service group name exists
+    - An existing service group with a service type that differs from the protocol in the configuration item is
+      deleted and created again
     '''
+    operations = []
+    desired_service_group = map_yaml_config_to_nitro_object_options('servicegroup',service_group_conf)
+    existing_service_group = get_snapshot_resource(snapshot,'servicegroup',service_group_conf['name'])
+    if existing_service_group is not None and get_changed_properties(existing_service_group,desired_service_group):
+        operations.append(new_operation('delete','servicegroup',service_group_conf['name'],
+                                        {'servicegroupname':service_group_conf['name']}))
+        existing_service_group = None
+    if existing_service_group is None:
+        operations.append(new_operation('add','servicegroup',service_group_conf['name'],desired_service_group))
+    return operations
 
-    :param nitro: NSNitro instance
+
+def get_service_group_binding_operations(snapshot,service_group_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param service_group_conf: Service Group configuration item from input file
+    :return: List of operations needed to match the server bindings of the service group configuration item
+    '''
+    binding_type = 'servicegroup_servicegroupmember_binding'
+    desired_bindings = OrderedDict()
+    for server_binding_conf in service_group_conf['servers']:
+        options = {'servicegroupname':service_group_conf['name'],
+                   'servername':server_binding_conf['name'],
+                   'port':server_binding_conf['port']}
+        desired_bindings[get_snapshot_key(options,ns_binding_types[binding_type]['key'])] = options
+    return get_binding_operations(snapshot,binding_type,service_group_conf['name'],desired_bindings)
+
+
+def get_vserver_operations(snapshot,resource_type,vserver_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: 'lbvserver' or 'csvserver'
+    :param vserver_conf: Virtual server configuration item from input file
+    :return: List of operations needed to match the input virtual server configuration item
+
+    - An existing vserver with another name still using the VIP and port of the configuration item after
+      get_address_operations() is deleted
+    - An existing vserver with a matching name is deleted and created again if the port or protocol differ
+    - An existing vserver with a matching name is updated if the VIP differs
+    - Creates a vserver using the configuration item if one does not exist
+    '''
+    operations = []
+    name = vserver_conf['name']
+    desired_vserver = map_yaml_config_to_nitro_object_options(resource_type,vserver_conf)
+    existing_vserver = get_snapshot_resource(snapshot,resource_type,name)
+    address_owner = get_snapshot_address_owner(snapshot,resource_type,desired_vserver)
+    if address_owner is not None and address_owner != name:
+        operations.append(new_operation('delete',resource_type,address_owner,{'name':address_owner}))
+    if existing_vserver is not None:
+        changed_properties = get_changed_properties(existing_vserver,desired_vserver)
+        if 'servicetype' in changed_properties or 'port' in changed_properties:
+            operations.append(new_operation('delete',resource_type,name,{'name':name}))
+            existing_vserver = None
+        elif 'ipv46' in changed_properties:
+            operations.append(new_operation('update',resource_type,name,{'name':name,'ipv46':desired_vserver['ipv46']}))
+    if existing_vserver is None:
+        operations.append(new_operation('add',resource_type,name,desired_vserver))
+    return operations
+
+
+def get_lbvserver_operations(snapshot,lbvserver_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param lbvserver_conf: Load balancing virtual server configuration item from input file
+    :return: List of operations needed to match the input lbvserver configuration item
+
+    See get_vserver_operations().
+    '''
+    return get_vserver_operations(snapshot,'lbvserver',lbvserver_conf)
+
+
+def get_lbvserver_binding_operations(snapshot,lbvserver_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param lbvserver_conf: Load balancing virtual server configuration item from input file
+    :return: List of operations needed to match the service group bindings of the lbvserver configuration item
+    '''
+    binding_type = 'lbvserver_servicegroup_binding'
+    desired_bindings = OrderedDict()
+    for service_group_name in lbvserver_conf['service_group_bindings']:
+        options = {'name':lbvserver_conf['name'],'servicegroupname':service_group_name}
+        desired_bindings[get_snapshot_key(options,ns_binding_types[binding_type]['key'])] = options
+    return get_binding_operations(snapshot,binding_type,lbvserver_conf['name'],desired_bindings)
+
+
+def get_cs_action_operations(snapshot,cs_action_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary
     :param cs_action_conf: Content Switching Action config item from input file
-    :return: True if configuration is applied successfully; False otherwise
+    :return: List of operations needed to match the input cs_action configuration item
 
-    Validates NS configuration and applies any changes needed to match the input cs_action configuration item.
-   - Checks for an existing CS Action on the NS and validates/updates the targetlbvserver parameter
+   - Updates the targetlbvserver parameter of an existing CS Action with a matching name if it differs
    - Creates new CS Action on NS for cs_action config item without an existing match
    '''
-    ret = True
-    existing_cs_action = get_cs_action(nitro,cs_action_conf['name'])
+    operations = []
+    desired_cs_action = map_yaml_config_to_nitro_object_options('csaction',cs_action_conf)
+    existing_cs_action = get_snapshot_resource(snapshot,'csaction',cs_action_conf['name'])
+    if existing_cs_action is None:
+        operations.append(new_operation('add','csaction',cs_action_conf['name'],desired_cs_action))
+    elif get_changed_properties(existing_cs_action,desired_cs_action):
+        operations.append(new_operation('update','csaction',cs_action_conf['name'],desired_cs_action))
+    return operations
 
-    if existing_cs_action:
-        if existing_cs_action.options['targetlbvserver'] != cs_action_conf['target_lbvserver']:
-            existing_cs_action.options['targetlbvserver'] = cs_action_conf['target_lbvserver']
-            update_cs_action(nitro, existing_cs_action)
-    else:
-        ret = add_cs_action(nitro, cs_action_conf)
-    return ret
 
+def get_cs_policy_operations(snapshot,cs_policy_conf):
+    '''
 
+    :param snapshot: Snapshot dictionary
+    :param cs_policy_conf: Content Switching Policy config item from input file
+    :return: List of operations needed to match the input cs_policy configuration item
 
-def get_all_cs_actions(nitro):
+    - Updates the existing cs policy on the NS if there is a mismatch with config item
+    - With unchangeable properties mismatched (classic policy), the existing policy is deleted
+    - Creates new cs policy on NS if needed
     '''
-    :param nitro: NSNitro object
-    :return: list of csaction objects
-    Creates custom url string to get all csaction objects from the Netscaler.  Copies name and targetlbvserver options
-    to empty csaction objects to avoid update issues with read-only options present.
+    operations = []
+    desired_cs_policy = map_yaml_config_to_nitro_object_options('cspolicy',cs_policy_conf)
+    existing_cs_policy = get_snapshot_resource(snapshot,'cspolicy',cs_policy_conf['name'])
+    if existing_cs_policy is not None and existing_cs_policy.get('cspolicytype','Advanced Policy') != 'Advanced Policy':
+        operations.append(new_operation('delete','cspolicy',cs_policy_conf['name'],{'policyname':cs_policy_conf['name']}))
+        existing_cs_policy = None
+    if existing_cs_policy is None:
+        operations.append(new_operation('add','cspolicy',cs_policy_conf['name'],desired_cs_policy))
+    elif get_changed_properties(existing_cs_policy,desired_cs_policy):
+        operations.append(new_operation('update','cspolicy',cs_policy_conf['name'],desired_cs_policy))
+    return operations
+
+
+def get_csvserver_operations(snapshot,csvserver_conf):
     '''
-    all_cs_actions = []
-    resource_type = 'csaction'
-    url = nitro.get_url() + resource_type
-    cs_actions_options = nitro.get(url).get_response_field(resource_type)
 
-    if cs_actions_options:
-        for cs_action_options in cs_actions_options:
-            cs_action = NSBaseResource()
-            cs_action.resourcetype = resource_type
-            cs_action.options = {'name':cs_action_options['name'],'targetlbvserver':cs_action_options['targetlbvserver']}
-            all_cs_actions.append(cs_action)
-    return all_cs_actions
+    :param snapshot: Snapshot dictionary
+    :param csvserver_conf: Config item for csvserver from config file
+    :return: List of operations needed to match the input csvserver configuration item
+
+    See get_vserver_operations().
+    '''
+    return get_vserver_operations(snapshot,'csvserver',csvserver_conf)
 
 
-def ensure_cs_actions_state(nitro, cs_actions_conf):
+def get_csvserver_lbvserver_binding_operations(snapshot,csvserver_conf):
     '''
 
-    :param nitro: NSNitro instance
-    :param cs_actions_conf: List of Content Switching Action configuration items from input file
-    :return: True if configuration is applied successfully; False otherwise
+    :param snapshot: Snapshot dictionary
+    :param csvserver_conf: Config item for csvserver from config file
+    :return: List of operations needed to match the default_lbvserver value of the csvserver configuration item
 
-    Validates NS configuration and applies any changes needed to match the input list of CS Action configuration items.
-   - Iterates through list of cs_action config items and matches them to existing CS Actions on NS
-   - Sends cs_action config items that match existing CS Actions on NS to ensure_cs_action_state()
-   - Deletes existing CS Actions from NS that do not match cs_action config items in list
-   - Sends cs_action config items that do not exist on the NS to ensure_cs_action_state()
-   '''
-    ret = True
-    if cs_actions_conf is not None:
-        for cs_action_conf in cs_actions_conf:
-            ensure_cs_action_state(nitro,cs_action_conf)
-        remove_all_existing_cs_actions = False
+    - Sets csvserver_lbvserver_binding for default_lbvserver value in config item
+    - Deletes the existing csvserver_lbvserver_binding if the config item has no default_lbvserver
+    '''
+    operations = []
+    name = csvserver_conf['name']
+    existing_lbvserver_bindings = get_snapshot_bindings(snapshot,'csvserver_lbvserver_binding',name)
+    if 'default_lbvserver' in csvserver_conf.keys():
+        options = {'name':name,'lbvserver':csvserver_conf['default_lbvserver']}
+        if len(existing_lbvserver_bindings) == 0:
+            operations.append(new_operation('add','csvserver_lbvserver_binding',name,options))
+        elif get_snapshot_key(options,['lbvserver']) not in existing_lbvserver_bindings:
+            operations.append(new_operation('update','csvserver_lbvserver_binding',name,options))
     else:
-        remove_all_existing_cs_actions = True
+        for existing_options in existing_lbvserver_bindings.values():
+            operations.append(new_operation('delete','csvserver_lbvserver_binding',name,
+                                            {'name':name,'lbvserver':existing_options['lbvserver']}))
+    return operations
+
 
-    all_cs_actions = get_all_cs_actions(nitro)
+def get_csvserver_policy_binding_operations(snapshot,csvserver_conf):
+    '''
 
-    if all_cs_actions is not None:
-        for existing_cs_action in all_cs_actions:
-            found_match = False
-            if not remove_all_existing_cs_actions:
-                for cs_action_conf in cs_actions_conf:
-                    if existing_cs_action.options['name'] == cs_action_conf['name']:
-                        found_match = True
+    :param snapshot: Snapshot dictionary
+    :param csvserver_conf: Config item for csvserver from config file
+    :return: List of operations needed to match the policy bindings of the csvserver configuration item
 
-            if not found_match:
-                delete_cs_action(nitro,existing_cs_action.options['name'])
+    - Deletes existing csvserver policy bindings on the NS that do not match the csvserver config item
+    - Creates csvserver policy binding on the NS for each csvserver config item binding that does not exist
+    '''
+    binding_type = 'csvserver_cspolicy_binding'
+    desired_bindings = OrderedDict()
+    for binding in csvserver_conf['policy_bindings']:
+        options = {'name':csvserver_conf['name'],'policyname':binding['name'],'priority':binding['priority']}
+        desired_bindings[get_snapshot_key(options,ns_binding_types[binding_type]['key'])] = options
+    return get_binding_operations(snapshot,binding_type,csvserver_conf['name'],desired_bindings)
+
+
+# Planner nodes: one node per YAML configuration item and node type.  'parent' is the node type of the same name
+# that bindings belong to.  'references' are the reference fields checked in validate_config_yaml(); 'item' is the
+# key holding the name when the field is a list of dictionaries.
+ns_plan_node_types = OrderedDict([('server',
+                                   {'yaml':'servers','operations':get_server_operations,
+                                    'parent':None,'references':[]}),
+                                  ('servicegroup',
+                                   {'yaml':'service_groups','operations':get_service_group_operations,
+                                    'parent':None,'references':[]}),
+                                  ('servicegroup_servicegroupmember_binding',
+                                   {'yaml':'service_groups','operations':get_service_group_binding_operations,
+                                    'parent':'servicegroup',
+                                    'references':[{'yaml':'servers','item':'name','node_type':'server'}]}),
+                                  ('lbvserver',
+                                   {'yaml':'lbvservers','operations':get_lbvserver_operations,
+                                    'parent':None,'references':[]}),
+                                  ('lbvserver_servicegroup_binding',
+                                   {'yaml':'lbvservers','operations':get_lbvserver_binding_operations,
+                                    'parent':'lbvserver',
+                                    'references':[{'yaml':'service_group_bindings','item':None,'node_type':'servicegroup'}]}),
+                                  ('csaction',
+                                   {'yaml':'cs_actions','operations':get_cs_action_operations,
+                                    'parent':None,
+                                    'references':[{'yaml':'target_lbvserver','item':None,'node_type':'lbvserver'}]}),
+                                  ('cspolicy',
+                                   {'yaml':'cs_policies','operations':get_cs_policy_operations,
+                                    'parent':None,
+                                    'references':[{'yaml':'action','item':None,'node_type':'csaction'}]}),
+                                  ('csvserver',
+                                   {'yaml':'csvservers','operations':get_csvserver_operations,
+                                    'parent':None,'references':[]}),
+                                  ('csvserver_lbvserver_binding',
+                                   {'yaml':'csvservers','operations':get_csvserver_lbvserver_binding_operations,
+                                    'parent':'csvserver',
+                                    'references':[{'yaml':'default_lbvserver','item':None,'node_type':'lbvserver'}]}),
+                                  ('csvserver_cspolicy_binding',
+                                   {'yaml':'csvservers','operations':get_csvserver_policy_binding_operations,
+                                    'parent':'csvserver',
+                                    'references':[{'yaml':'policy_bindings','item':'name','node_type':'cspolicy'}]})
+                                  ])
+
+
+def get_referenced_names(resource_conf,reference):
+    '''
 
-    return ret
+    :param resource_conf: Configuration item from input file
+    :param reference: Reference field description from ns_plan_node_types
+    :return: List of resource names referenced by the configuration item
+    '''
+    names = []
+    value = resource_conf.get(reference['yaml'])
+    if value is not None:
+        if not isinstance(value,list):
+            value = [value]
+        for item in value:
+            if reference['item'] is not None:
+                item = item[reference['item']]
+            names.append(item)
+    return names
+
+
+def get_plan_nodes(ns_group_conf):
+    '''
+
+    :param ns_group_conf: Configuration dictionary representing an ns_group
+    :return: OrderedDict of (node type, name) -> {'conf': configuration item, 'requires': list of (node type, name)}
+
+    Builds the dependency graph of the ns_group configuration.  A node requires its parent node and every node
+    it references by name.
+    '''
+    nodes = OrderedDict()
+    for node_type, node_type_properties in ns_plan_node_types.items():
+        resources_conf = ns_group_conf.get(node_type_properties['yaml'])
+        if resources_conf is not None:
+            for resource_conf in resources_conf:
+                requires = []
+                if node_type_properties['parent'] is not None:
+                    requires.append((node_type_properties['parent'],resource_conf['name']))
+                for reference in node_type_properties['references']:
+                    for name in get_referenced_names(resource_conf,reference):
+                        requires.append((reference['node_type'],name))
+                nodes[(node_type,resource_conf['name'])] = {'conf':resource_conf,'requires':requires}
+    return nodes
+
+
+def sort_plan_nodes(nodes):
+    '''
+
+    :param nodes: OrderedDict of node key -> dictionary with a 'requires' list of node keys
+    :return: List of node keys ordered so that every node follows the nodes it requires
+
+    Topological sort (Kahn's algorithm); of the nodes ready, the first in input order comes next.  Since
+    get_plan_nodes() lists the nodes type by type in the order of ns_plan_node_types, the nodes of one type stay
+    together, ordered as in the configuration, and their operations can be batched (see get_operation_batches()).
+    Required nodes that are not in the input are ignored.  Nodes in a dependency cycle are logged and appended
+    in input order.
+    '''
+    positions = {}
+    remaining_requires = {}
+    dependents = {}
+    for position, (key, node) in enumerate(nodes.items()):
+        positions[key] = position
+        remaining_requires[key] = 0
+        for required_key in node['requires']:
+            if required_key in nodes:
+                remaining_requires[key] += 1
+                dependents.setdefault(required_key,[]).append(key)
+
+    ready = [(positions[key], key) for key in nodes.keys() if remaining_requires[key] == 0]
+    ordered_keys = []
+    while ready:
+        key = heapq.heappop(ready)[1]
+        ordered_keys.append(key)
+        for dependent_key in dependents.get(key,[]):
+            remaining_requires[dependent_key] -= 1
+            if remaining_requires[dependent_key] == 0:
+                heapq.heappush(ready,(positions[dependent_key], dependent_key))
+
+    if len(ordered_keys) != len(nodes):
+        ordered = set(ordered_keys)
+        for key in nodes.keys():
+            if key not in ordered:
+                log.info('dependency cycle found for {} {}'.format(key[0],key[1]))
+                ordered_keys.append(key)
+    return ordered_keys
+
+
+def get_resource_type_order():
+    '''
+
+    :return: List of resource types ordered so that every resource type follows the resource types it depends on
+
+    Binding node types are folded into their parent resource type since deleting a resource removes its bindings,
+    so a resource with bindings must be deleted before the resources it is bound to.
+    '''
+    resource_types = OrderedDict()
+    for node_type, node_type_properties in ns_plan_node_types.items():
+        resource_type = node_type_properties['parent'] or node_type
+        requires = resource_types.setdefault(resource_type,{'requires':[]})['requires']
+        for reference in node_type_properties['references']:
+            requires.append(reference['node_type'])
+    return sort_plan_nodes(resource_types)
+
+
+def get_fingerprint(obj):
+    '''
+
+    :param obj: JSON serializable object
+    :return: Content hash of the object
+    '''
+    return hashlib.sha1(json.dumps(obj,sort_keys=True,default=str)).hexdigest()
+
+
+def get_managed_properties(resource_type):
+    '''
+
+    :param resource_type: Nitro resource or binding type
+    :return: List of the Nitro properties that identify, are managed or are planned from for the resource type
+    '''
+    properties = []
+    if resource_type in ns_resource_id:
+        properties.append(ns_resource_id[resource_type])
+    if resource_type in ns_binding_types:
+        properties.append(ns_binding_types[resource_type]['parent_property'])
+        properties.extend(ns_binding_types[resource_type]['key'])
+    for property in rw_properties.get(resource_type,[]):
+        properties.append(property['nitro'])
+    properties.extend(ns_state_properties.get(resource_type,[]))
+    return sorted(set(properties))
+
+
+def is_changeable_in_place(existing_options,desired_options):
+    '''
+
+    :param existing_options: Dictionary of Nitro options of an existing resource
+    :param desired_options: Dictionary of Nitro options built from a configuration item of the same resource type
+    :return: True if the existing resource can become the configuration item by a rename and updates; False if it
+             must be deleted and created again (the service type or port of a vserver differ)
+    '''
+    changed_properties = get_changed_properties(existing_options,desired_options)
+    return 'servicetype' not in changed_properties and 'port' not in changed_properties
+
+
+def new_rename_operation(resource_type,name,new_name,source_name):
+    '''
+
+    :param resource_type: Nitro resource type
+    :param name: Current name of the resource
+    :param new_name: New name of the resource
+    :param source_name: Name of the configuration item the rename is planned for
+    :return: Rename operation (see new_operation())
+    '''
+    operation = new_operation('rename',resource_type,name,{'name':name,'newname':new_name})
+    operation['source'] = '{0} {1}'.format(ns_plan_node_types[resource_type]['yaml'],source_name)
+    return operation
+
+
+def get_temporary_name(snapshot,resource_type,name,reserved_names):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :param name: Name the temporary name is derived from
+    :param reserved_names: Names that must not be used, in addition to the existing resources of the type
+    :return: Name that no resource of the type has
+    '''
+    temporary_name = '{}_tmp'.format(name)
+    suffix = 1
+    while temporary_name in snapshot['resources'][resource_type] or temporary_name in reserved_names:
+        suffix += 1
+        temporary_name = '{0}_tmp{1}'.format(name,suffix)
+    return temporary_name
+
+
+def get_address_cycles(pending,addresses):
+    '''
+
+    :param pending: OrderedDict of resource name -> address key the resource is moving to
+    :param addresses: Dictionary of address key -> name of the resource holding it
+    :return: List of cycles; in each cycle (list of names), every resource moves to the address held by the next
+    '''
+    cycles = []
+    visited = set()
+    for start in pending.keys():
+        path = []
+        name = start
+        while name in pending and name not in visited:
+            visited.add(name)
+            path.append(name)
+            name = addresses.get(pending[name])
+        if name in path:
+            cycles.append(path[path.index(name):])
+    return cycles
+
+
+def get_resource_binding_count(snapshot,resource_type,name):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :param name: Name of the resource
+    :return: Number of bindings of the resource, or to it, that the NetScaler removes when the resource is deleted
+    '''
+    count = 0
+    for binding_type, binding in ns_binding_types.items():
+        if binding['parent'] == resource_type:
+            count += len(get_snapshot_bindings(snapshot,binding_type,name))
+        elif binding['target'] == resource_type:
+            count += len(snapshot['targets'][binding_type].get(name,()))
+    return count
+
+
+def new_address_update_operation(resource_type,existing_options,desired_options,source_name):
+    '''
+
+    :param resource_type: Nitro resource type listed in ns_address_properties
+    :param existing_options: Dictionary of Nitro options of the existing resource
+    :param desired_options: Dictionary of Nitro options built from the configuration item of the same name
+    :param source_name: Name of the configuration item the update is planned for
+    :return: Update operation (see new_operation()) changing the address properties that differ
+
+    The update may move the resource to an address freed by the operation planned before it, so it is marked
+    'ordered' to be sent on its own (see get_operation_batches()).
+    '''
+    name = desired_options[ns_resource_id[resource_type]]
+    options = {ns_resource_id[resource_type]:name}
+    for property in get_changed_properties(existing_options,desired_options):
+        if property in ns_address_properties[resource_type]:
+            options[property] = desired_options[property]
+    operation = new_operation('update',resource_type,name,options)
+    operation['source'] = '{0} {1}'.format(ns_plan_node_types[resource_type]['yaml'],source_name)
+    operation['ordered'] = True
+    return operation
+
+
+def get_plan_costs(snapshot,resource_type,groups,nodes,node_order):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type of the resources renamed or moved
+    :param groups: List of (list of the resource names involved, list of operations)
+    :param nodes: Plan nodes from get_plan_nodes()
+    :param node_order: Node keys from sort_plan_nodes()
+    :return: List with the number of operations each group takes, including the operations planned after it
+
+    The operations of every group are applied to a copy of the snapshot, then the nodes of the resources involved,
+    and the nodes that bind or refer to them as configured or as they exist, are planned on the copy.  The
+    operations of each node are counted for every group it belongs to.
+    '''
+    snapshot_copy = copy_ns_snapshot(snapshot)
+    dependents = {}
+    for key in node_order:
+        for required_key in nodes[key]['requires']:
+            dependents.setdefault(required_key,[]).append(key)
+    referrers = {}
+    for referring_type, references in ns_resource_references.items():
+        for reference in references:
+            if reference['resource_type'] == resource_type:
+                for name, options in snapshot['resources'][referring_type].items():
+                    referrers.setdefault(options.get(reference['nitro']),[]).append((referring_type,name))
+
+    costs = []
+    node_groups = {}
+    for index, (names, operations) in enumerate(groups):
+        costs.append(len(operations))
+        for operation in operations:
+            update_snapshot(snapshot_copy,operation)
+        for name in names:
+            keys = [(resource_type,name)] + dependents.get((resource_type,name),[]) + referrers.get(name,[])
+            for binding_type, binding in ns_binding_types.items():
+                if binding['target'] == resource_type:
+                    keys.extend([(binding_type,parent_name)
+                                 for parent_name in snapshot['targets'][binding_type].get(name,[])])
+            for key in keys:
+                if key in nodes:
+                    node_groups.setdefault(key,set()).add(index)
+
+    for key in node_order:
+        if key in node_groups:
+            node_operations = ns_plan_node_types[key[0]]['operations'](snapshot_copy,nodes[key]['conf'])
+            for operation in node_operations:
+                update_snapshot(snapshot_copy,operation)
+            for index in node_groups[key]:
+                costs[index] += len(node_operations)
+    return costs
+
+
+def choose_plan_operations(snapshot,resource_type,groups,nodes,node_order):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type of the resources renamed or moved
+    :param groups: List of (list of the resource names involved, list of renames, list of alternative operations)
+    :param nodes: Plan nodes from get_plan_nodes()
+    :param node_order: Node keys from sort_plan_nodes()
+    :return: List of the operations chosen for the groups: the renames of a group if they take no more operations
+             than its alternative (see get_plan_costs()), the alternative otherwise
+    '''
+    operations = []
+    if len(groups) == 0:
+        return operations
+    rename_costs = get_plan_costs(snapshot,resource_type,[(names, renames) for names, renames, alternative in groups],
+                                  nodes,node_order)
+    alternative_costs = get_plan_costs(snapshot,resource_type,
+                                       [(names, alternative) for names, renames, alternative in groups],
+                                       nodes,node_order)
+    for group, rename_cost, alternative_cost in zip(groups,rename_costs,alternative_costs):
+        operations.extend(group[1] if rename_cost <= alternative_cost else group[2])
+    return operations
+
+
+def get_address_operations(snapshot,resource_type,nodes,node_order):
+    '''
 
+    :param snapshot: Snapshot dictionary; the planned operations are applied to it
+    :param resource_type: Nitro resource type listed in ns_address_properties
+    :param nodes: Plan nodes from get_plan_nodes()
+    :param node_order: Node keys from sort_plan_nodes()
+    :return: List of renames, address updates and deletes that move existing resources of the type to the names
+             and addresses of the configuration
+
+    Runs before the node planners, which delete any resource still holding the address of a configuration item
+    under another name:
+    - A resource that is not in the configuration and holds the address of a configuration item that does not
+      exist is renamed to the item
+    - Configuration items moving to another address are updated once the address is free, in dependency order; a
+      resource that is not in the configuration holding the address is deleted first
+    - Configuration items moving along a cycle of addresses (two servers swapping IPs) are renamed around the cycle
+      through a temporary name, so each name ends up on the resource that holds its address.  Otherwise the item
+      with the fewest bindings is deleted to free its address, and the other items move in turn.
+
+    Renames keep the bindings and references of the resource renamed.  They are only planned where they take no
+    more operations than deleting instead, counting the changes to bindings and references planned afterwards (see
+    get_plan_costs()).  Items sharing an address with another item are left to the node planners.
+    '''
+    operations = []
+    address_properties = ns_address_properties[resource_type]
+    resources = snapshot['resources'][resource_type]
+    addresses = snapshot['addresses'][resource_type]
+    desired = OrderedDict()
+    for key in node_order:
+        if key[0] == resource_type:
+            desired[key[1]] = map_yaml_config_to_nitro_object_options(resource_type,nodes[key]['conf'])
+    desired_addresses = Counter([get_snapshot_key(options,address_properties) for options in desired.values()])
+
+    def plan(planned_operations):
+        for operation in planned_operations:
+            update_snapshot(snapshot,operation)
+        operations.extend(planned_operations)
+
+    # Renames in place, and the items moving to another address
+    rename_groups = []
+    pending = OrderedDict()
+    for name, options in desired.items():
+        address = get_snapshot_key(options,address_properties)
+        if address is None or desired_addresses[address] > 1:
+            continue
+        owner = addresses.get(address)
+        if name not in resources:
+            if owner is not None and owner not in desired and is_changeable_in_place(resources[owner],options):
+                rename_groups.append(([owner,name],[new_rename_operation(resource_type,owner,name,name)],[]))
+        elif owner != name and is_changeable_in_place(resources[name],options):
+            pending[name] = address
+    plan(choose_plan_operations(snapshot,resource_type,rename_groups,nodes,node_order))
+
+    while len(pending) > 0:
+        moved = False
+        for name, address in list(pending.items()):
+            holder = addresses.get(address)
+            if holder is not None and holder not in desired:
+                operation = new_operation('delete',resource_type,holder,{ns_resource_id[resource_type]:holder})
+                operation['source'] = '{0} {1}'.format(ns_plan_node_types[resource_type]['yaml'],name)
+                plan([operation])
+                holder = None
+            if holder is None:
+                plan([new_address_update_operation(resource_type,resources[name],desired[name],name)])
+                pending.pop(name)
+                moved = True
+        if moved:
+            continue
+
+        # Every item left waits for an address held by another item; cycles are broken, the rest is left
+        cycle_groups = []
+        for cycle in get_address_cycles(pending,addresses):
+            for name in cycle:
+                pending.pop(name)
+            # Renamed, the resource holding the address of each item must be able to become the item
+            if not all([is_changeable_in_place(resources[cycle[(i + 1) % len(cycle)]],desired[cycle[i]])
+                        for i in range(len(cycle))]):
+                continue
+            temporary_name = get_temporary_name(snapshot,resource_type,cycle[0],desired)
+            renames = [new_rename_operation(resource_type,cycle[0],temporary_name,cycle[-1])]
+            for i in range(1,len(cycle)):
+                renames.append(new_rename_operation(resource_type,cycle[i],cycle[i - 1],cycle[i - 1]))
+            renames.append(new_rename_operation(resource_type,temporary_name,cycle[-1],cycle[-1]))
+            # The deleted item is added back by its node planner once every other item moved
+            deleted = min(range(len(cycle)),key=lambda i: get_resource_binding_count(snapshot,resource_type,
+                                                                                     cycle[i]))
+            alternative = [new_operation('delete',resource_type,cycle[deleted],
+                                         {ns_resource_id[resource_type]:cycle[deleted]})]
+            alternative[0]['source'] = '{0} {1}'.format(ns_plan_node_types[resource_type]['yaml'],cycle[deleted])
+            for i in range(1,len(cycle)):
+                name = cycle[deleted - i]
+                alternative.append(new_address_update_operation(resource_type,resources[name],desired[name],name))
+            cycle_groups.append((cycle,renames,alternative))
+        if len(cycle_groups) == 0:
+            break
+        plan(choose_plan_operations(snapshot,resource_type,cycle_groups,nodes,node_order))
+    return operations
+
+
+def get_ns_group_operations(snapshot,ns_group_conf):
+    '''
 
-def ensure_cs_policies_state(nitro,cs_policies_conf):
+    :param snapshot: Snapshot dictionary
+    :param ns_group_conf: Configuration dictionary representing an ns_group
+    :return: List of operations that brings the NetScaler to the ns_group configuration in a single pass
+
+    - Servers and vservers are first renamed and moved to the addresses in the configuration where that avoids
+      deleting them (see get_address_operations())
+    - Creates and updates are planned node by node in dependency order (see get_plan_nodes())
+    - Deletes of existing resources that are not in the configuration are planned last, in reverse dependency order
+    - Each planned operation is applied to a copy of the snapshot so later nodes see its effects (e.g. bindings
+      removed along with a replaced resource)
+    '''
+    operations = []
+    working_snapshot = copy_ns_snapshot(snapshot)
+    nodes = get_plan_nodes(ns_group_conf)
+    node_order = sort_plan_nodes(nodes)
+    for resource_type in ns_plan_node_types.keys():
+        if resource_type in ns_address_properties:
+            operations.extend(get_address_operations(working_snapshot,resource_type,nodes,node_order))
+    for key in node_order:
+        node_operations = ns_plan_node_types[key[0]]['operations'](working_snapshot,nodes[key]['conf'])
+        for operation in node_operations:
+            operation['source'] = '{0} {1}'.format(ns_plan_node_types[key[0]]['yaml'],key[1])
+            update_snapshot(working_snapshot,operation)
+        operations.extend(node_operations)
+
+    for resource_type in reversed(get_resource_type_order()):
+        resources_conf = ns_group_conf.get(ns_plan_node_types[resource_type]['yaml'])
+        orphan_operations = get_orphan_operations(working_snapshot,resource_type,resources_conf)
+        for operation in orphan_operations:
+            update_snapshot(working_snapshot,operation)
+        operations.extend(orphan_operations)
+    return operations
+
+
+def apply_ns_group_state(nitro,ns_group_conf,snapshot,chunk_size=1,journal=None,workers=1):
     '''
 
     :param nitro: NSNitro instance
-    :param cs_policies_conf: List of Content Switching Policy configuration items from input file
+    :param ns_group_conf: Configuration dictionary representing an ns_group
+    :param snapshot: Snapshot dictionary from get_ns_snapshot()
+    :param chunk_size: Maximum number of operations sent in one Nitro request
+    :param journal: Journal dictionary from get_journal(); None to apply without a journal
+    :param workers: Maximum number of lanes of independent operations applied concurrently
     :return: True if configuration is applied successfully; False otherwise
 
-    Validates NS configuration and applies any changes needed to match the input list of cs_policies configuration items.
-    - Iterates through existing CS Policies on the NS to find matches to list of cs_policies config items
-    - Config items with matching existing policies on NS are sent to ensure_cs_policy_state()
-    - Deletes existing CS policies on the NS with no match in the list of config items
-    - Sends items in the config list that do not have an existing match to ensure_cs_policy_state()
-   '''
-    ret = True
+    Plans every change needed to match the ns_group configuration and applies them in dependency order; changes to
+    unrelated resources are applied concurrently (see apply_operations()).
+    '''
+    operations = get_ns_group_operations(snapshot,ns_group_conf)
+    if journal is not None and not journal_plan(journal,ns_group_conf,operations):
+        journal = None
+    return apply_operations(nitro,snapshot,operations,chunk_size,journal,workers)
 
-    if cs_policies_conf is not None:
-        for cs_policy_conf in cs_policies_conf:
-            ensure_cs_policy_state(nitro,cs_policy_conf)
-        remove_all_existing_cs_policies = False
-    else:
-        remove_all_existing_cs_policies = True
 
-    try:
-        all_cs_policies = NSCSPolicy().get_all(nitro)
-    except NSNitroError as error:
-        all_cs_policies = None
-
-    if all_cs_policies is not None:
-        for existing_cs_policy in all_cs_policies:
-            found_match = False
-            if not remove_all_existing_cs_policies:
-                for cs_policy_conf in cs_policies_conf:
-                    if existing_cs_policy.get_policyname() == cs_policy_conf['name']:
-                        found_match = True
-            if not found_match:
-                delete_cs_policy(nitro,existing_cs_policy)
+# Operation journals by journal filename; see get_journal()
+ns_journals = {}
+ns_journals_lock = threading.Lock()
 
-    else:
-        remove_all_existing_cs_policies = True
 
-    return ret
+def get_journal_filename(journal_dir,address):
+    '''
+
+    :param journal_dir: Directory of the journal files
+    :param address: NetScaler address
+    :return: Filename of the operation journal of the NetScaler
+    '''
+    return os.path.join(journal_dir,'journal_{}.jsonl'.format(re.sub(r'[^A-Za-z0-9.-]','_',address)))
 
 
-def delete_cs_policy(nitro,cs_policy):
+def read_journal_pending(filename):
     '''
 
-    :param nitro: NSNitro instance
-    :param cs_policy: Existing NSCSPolity object from NS
-    :return: True if delete succeeds, False otherwise
-    
-    - Deletes existing CS Policy from NS
-    - Created to work around NSCSPolicy object not deleting properly
+    :param filename: Operation journal filename
+    :return: Dictionary of ns_group name -> last plan of the ns_group that did not end; a plan is a dictionary
+             with the fingerprint of the ns_group configuration ('config'), the planned operations ('operations'),
+             the indexes of the operations sent ('started') and of the operations applied successfully ('confirmed')
+
+    A journal cut short by an interrupted run is read up to its last complete line.
     '''
-    ret = True
-    url = "%s%s/%s" % (nitro.get_url(), cs_policy.resourcetype, cs_policy.get_policyname())
+    plans = {}
+    if not os.path.exists(filename):
+        return plans
     try:
-        response = nitro.delete(url)
-    except NSNitroError as error:
-        log.debug('delete_cs_policy failed: {0}'.format(error))
-        ret = False
-    return ret
+        with open(filename,'r') as f:
+            for line in f:
+                record = json.loads(line)
+                event = record['event']
+                if event == 'plan':
+                    plans[record['ns_group']] = {'config':record['config'],'operations':[],'started':set(),
+                                                 'confirmed':set(),'ended':False}
+                    continue
+                plan = plans.get(record['ns_group'])
+                if plan is None:
+                    continue
+                if event == 'operation':
+                    plan['operations'].append(convert_json_strings(record['operation']))
+                elif event == 'start':
+                    plan['started'].update(record['operations'])
+                elif event == 'done' and record['success']:
+                    plan['confirmed'].update(record['operations'])
+                elif event == 'end':
+                    plan['ended'] = True
+    except (IOError, ValueError, KeyError) as error:
+        log.info('Journal {} is incomplete; read up to the last complete record: {}'.format(filename,error))
+    return dict([(name, plan) for name, plan in plans.items() if not plan['ended']])
+
+
+def get_journal(journal_dir,address):
+    '''
 
+    :param journal_dir: Directory of the journal files
+    :param address: NetScaler address
+    :return: Journal dictionary shared by every ns_group of the NetScaler; None if the journal cannot be opened
 
-def ensure_cs_policy_state(nitro,cs_policy_conf):
+    The journal is read and opened once per run.  Plans that did not end are kept in 'pending' for --resume; if
+    there are none, the journal is started over.
     '''
-    
-    :param nitro: NSNitro instance
-    :param cs_policy_conf: 
-    :return: True if config is applied successfully, False otherwise
-    
-    - Checks for an existing match to cs_policy config item
-    - Updates the existing cs policy on the NS if there is a mismatch with config item
-    - With unchangeable properties mismatched, the existing policy is deleted
-    - Creates new cs policy on NS if needed
-    
+    filename = get_journal_filename(journal_dir,address)
+    with ns_journals_lock:
+        if filename not in ns_journals:
+            pending = read_journal_pending(filename)
+            try:
+                stream = open(filename,'a' if len(pending) > 0 else 'w')
+            except IOError as error:
+                log.info('Journal {} could not be opened: {}'.format(filename,error))
+                return None
+            ns_journals[filename] = {'filename':filename,'stream':stream,'lock':threading.Lock(),'pending':pending}
+        return ns_journals[filename]
+
+
+def append_journal(journal,records,sync=False):
     '''
-    
-    ret = True
 
-    try:
-        url = nitro.get_url() + 'cspolicy/' + cs_policy_conf['name']
-        response = nitro.get(url).get_response_field('cspolicy')[0]
-        if response:
-            existing_cs_policy = NSCSPolicy()
-            for key in response.keys():
-                existing_cs_policy.options[key] = response[key]
-    except NSNitroError as error:
-        existing_cs_policy = None
+    :param journal: Journal dictionary from get_journal()
+    :param records: List of record dictionaries; each is tagged with the ns_group of the current thread
+    :param sync: True to sync the journal to disk after the records are written
+    :return: None
 
+    Records are flushed after every append, so they survive the end of the process.
+    '''
+    ns_group_name = getattr(ns_group_context,'name',None)
+    with journal['lock']:
+        for record in records:
+            record['ns_group'] = ns_group_name
+            journal['stream'].write(json.dumps(record) + '\n')
+        journal['stream'].flush()
+        if sync:
+            os.fsync(journal['stream'].fileno())
+    return None
 
-    need_new_policy = True
-    if existing_cs_policy is not None:
-        if existing_cs_policy.options['cspolicytype'] == 'Advanced Policy':
-            need_new_policy = False
-            update = False
-            if existing_cs_policy.get_rule() != cs_policy_conf['expression']:
-                update = True
-                existing_cs_policy.set_rule(cs_policy_conf['expression'])
-            if 'action' in existing_cs_policy.options.keys():
-                if existing_cs_policy.options['action'] != cs_policy_conf['action']:
-                    update = True
-                    existing_cs_policy.options['action'] = cs_policy_conf['action']
-            else:
-                update = True
-                existing_cs_policy.options['action'] = cs_policy_conf['action']
-            if update:
-                try:
-                    updated_cs_policy = NSCSPolicy()
-                    option_names = ['policyname','rule','action']
-                    for option_name in option_names:
-                        updated_cs_policy.options[option_name] = existing_cs_policy.options[option_name]
-                    updated_cs_policy.update_resource(nitro)
-                except NSNitroError as error:
-                    log.debug('NSCSPolicy.update() failed: {0}'.format(error))
-        else:
-            delete_cs_policy(nitro,existing_cs_policy)
 
-    if need_new_policy:
-        new_cs_policy = NSCSPolicy({'policyname':cs_policy_conf['name'],'rule':cs_policy_conf['expression']})
-        new_cs_policy.options['action'] = cs_policy_conf['action']
-        try:
-            new_cs_policy.add_resource(nitro)
-        except NSNitroError as error:
-            log.debug('NSCSPolicy.add() failed: {0}'.format(error))
+def journal_plan(journal,ns_group_conf,operations):
+    '''
 
+    :param journal: Journal dictionary from get_journal()
+    :param ns_group_conf: Configuration dictionary representing an ns_group
+    :param operations: List of operations in the order they will be applied
+    :return: True if the plan is journaled; False if the plan is empty and there is no pending plan to end
 
-def ensure_csvservers_state(nitro,csvservers_conf):
+    Numbers the operations ('index') and appends the plan to the journal.
+    '''
+    for index, operation in enumerate(operations):
+        operation['index'] = index
+    if len(operations) == 0 and ns_group_conf['name'] not in journal['pending']:
+        return False
+    records = [{'event':'plan','config':get_fingerprint(ns_group_conf)}]
+    records.extend([{'event':'operation','operation':operation} for operation in operations])
+    append_journal(journal,records,sync=True)
+    journal['pending'].pop(ns_group_conf['name'],None)
+    return True
+
+
+def restart_journals():
     '''
-    
-    :param nitro: NSNitro instance
-    :param csvservers_conf: List of csvserver config items from config file 
-    :return: True if config is applied successfully, False otherwise
-    
-    - Sends all csvserver config items to ensure_csvserver_state()
-    - Deletes any existing csvservers from NS if it does not have a matching item in the config file
-    
-    '''
-    
-    ret = True
-    
-    if csvservers_conf is not None:
-        for csvserver_conf in csvservers_conf:
-            ensure_csvserver_state(nitro,csvserver_conf)
-        remove_all_existing_csvservers = False
-    else:
-        remove_all_existing_csvservers = True
 
-    all_csvservers = NSCSVServer.get_all(nitro)
-    csvservers_to_remove = []
+    :return: None
 
-    for csvserver in all_csvservers:
-        found_match = False
-        if not remove_all_existing_csvservers:
-            for csvserver_conf in csvservers_conf:
-                if csvserver_conf['name'] == csvserver.get_name():
-                    found_match = True
-        if not found_match:
-            csvservers_to_remove.append(csvserver)
+    Starts over every open journal without a plan that did not end, so the journal of a long running process (see
+    run_daemon()) only holds the plans since the last time nothing was pending.  The empty journal is written to a
+    new file that replaces the journal, so a journal that cannot be started over is kept as it is.
+    '''
+    with ns_journals_lock:
+        for journal in ns_journals.values():
+            with journal['lock']:
+                if len(read_journal_pending(journal['filename'])) > 0:
+                    continue
+                temp_filename = journal['filename'] + '.tmp'
+                try:
+                    stream = open(temp_filename,'w')
+                    os.rename(temp_filename,journal['filename'])
+                except (IOError, OSError) as error:
+                    log.info('Journal {} could not be started over: {}'.format(journal['filename'],error))
+                    continue
+                journal['stream'].close()
+                journal['stream'] = stream
+                journal['pending'] = {}
+    return None
 
-    for csvserver_to_remove in csvservers_to_remove:
-        try:
-            NSCSVServer.delete(nitro, csvserver_to_remove)
-        except NSNitroError as error:
-            log.debug('NSCSVServer.delete() failed: {0}'.format(error))
-            ret = False
 
-    
-    return ret
+def close_journals():
+    with ns_journals_lock:
+        for journal in ns_journals.values():
+            journal['stream'].close()
+        ns_journals.clear()
+    return None
 
 
-def get_csvserver_lbvserver_binding(nitro, csvserver_name):
+def is_operation_applied(nitro,operation):
     '''
-    
+
     :param nitro: NSNitro instance
-    :param csvserver_name: Name of csvserver
-    :return: NSBaseResource containing csvserver_lbvserver_binding properties, None if not found on NS
-    
-    - Implements CRUD capability for csvserver_lbvserver_binding
-    - No object for csvserver_lbvserver_binding in NSNitro module
-    
+    :param operation: Operation (see new_operation())
+    :return: True if the NetScaler reflects the operation; False otherwise, or if it cannot be checked
     '''
-    ret = None
-    binding = NSBaseResource()
-    binding.resourcetype = 'csvserver_lbvserver_binding'
-    try:
-        binding.get_resource(nitro,csvserver_name)
-        if len(binding.options) != 0:
-            ret = binding
-    except NSNitroError as error:
-        pass
-    return ret
-
-def delete_csvserver_lbvserver_binding(nitro, csvserver_name):
+    action = operation['action']
+    resource_type = operation['resource_type']
+    options = operation['options']
+    if resource_type in ns_binding_types:
+        binding = ns_binding_types[resource_type]
+        bindings = get_all_resources_by_type_and_name(nitro,resource_type,operation['name'])
+        if bindings is None:
+            return False
+        keys = [get_snapshot_key(resource.options,binding['key']) for resource in bindings]
+        return (get_snapshot_key(options,binding['key']) in keys) != (action == 'delete')
+    name = options['newname'] if action == 'rename' else operation['name']
+    resources = get_all_resources_by_type_and_name(nitro,resource_type,name)
+    if action == 'delete':
+        return resources is not None and len(resources) == 0
+    if not resources:
+        return False
+    return action == 'rename' or len(get_changed_properties(resources[0].options,options)) == 0
+
+
+def resume_ns_group_state(nitro,plan,chunk_size=1,journal=None):
     '''
-    
+
     :param nitro: NSNitro instance
-    :param csvserver_name: Name of csvserver
-    :return: NSBaseResource containing csvserver_lbvserver_binding properties, None if not found on NS
-    
-    - Implements CRUD capability for csvserver_lbvserver_binding
-    - No object for csvserver_lbvserver_binding in NSNitro module
+    :param plan: Pending plan of the ns_group from read_journal_pending()
+    :param chunk_size: Maximum number of operations sent in one Nitro request
+    :param journal: Journal dictionary from get_journal()
+    :return: True if the rest of the plan is applied successfully; False otherwise
+
+    Operations confirmed by the journal are skipped.  Operations that were sent without a confirmation are looked up
+    on the NetScaler and skipped if they took effect; every other operation is applied in plan order.  The
+    NetScaler configuration is not read otherwise; without it, the existing resources the operations depend on are
+    not known, so they are applied on a single lane.
+    '''
+    remaining = []
+    verified = []
+    for operation in plan['operations']:
+        if operation['index'] in plan['confirmed']:
+            continue
+        if operation['index'] in plan['started'] and is_operation_applied(nitro,operation):
+            verified.append(operation['index'])
+            continue
+        remaining.append(operation)
+    log.info('Resuming: {0} of {1} operations were applied, {2} more were in flight and took effect; {3} to '
+             'apply'.format(len(plan['confirmed']),len(plan['operations']),len(verified),len(remaining)))
+    if journal is not None and len(verified) > 0:
+        append_journal(journal,[{'event':'done','operations':verified,'success':True}])
+    # Changes are tracked in an empty snapshot since the NetScaler configuration is not read
+    return apply_operations(nitro,new_ns_snapshot(),remaining,chunk_size,journal)
+
+
+def load_state_cache(filename):
     '''
-    ret = False
-    binding = NSBaseResource()
-    binding.resourcetype = 'csvserver_lbvserver_binding'
-    binding.options['name'] = csvserver_name
-    try:
-        binding.delete_resource(nitro,csvserver_name)
-        ret = True
-    except NSNitroError as error:
-        log.debug('delete_csvserver_lbvserver_binding() failed: {0}'.format(error))
-    return ret
 
-def update_csvserver_lbvserver_binding(nitro, csvserver_lbvserver_binding):
+    :param filename: Name of the state cache file
+    :return: Dictionary of NetScaler address -> ns_group name -> [content hash of the ns_group configuration,
+             configuration change marker of the NetScaler] recorded after the last successful apply (see
+             is_ns_group_unchanged()); empty if the file does not exist or cannot be read
     '''
-    
-    :param nitro: NSNitro instance
-    :param csvserver_lbvserver_binding: NSBaseResource mapped to csvserver_lbvserver_binding properties
-    :return: True if update successful; False otherwise
-    
-    - Implements CRUD capability for csvserver_lbvserver_binding
-    - No object for csvserver_lbvserver_binding in NSNitro module
+    state_cache = {}
+    if os.path.exists(filename):
+        try:
+            with open(filename,'r') as f:
+                state_cache = json.load(f)
+        except (IOError, ValueError) as error:
+            log.info('State cache {} could not be read; reconciling every resource: {}'.format(filename,error))
+            state_cache = {}
+    # Entries of a cache written in an earlier layout are dropped
+    for address, ns_group_entries in state_cache.items():
+        if not isinstance(ns_group_entries,dict) or \
+                not all([isinstance(entry,list) and len(entry) == 2 for entry in ns_group_entries.values()]):
+            state_cache.pop(address)
+    return state_cache
+
+
+def save_state_cache(state_cache,filename):
     '''
-    ret = False
-    updated_binding = NSBaseResource()
-    updated_binding.resourcetype = 'csvserver_lbvserver_binding'
-    for property in ['name','lbvserver']:
-        updated_binding.options[property] = csvserver_lbvserver_binding.options[property]
+
+    :param state_cache: Dictionary from load_state_cache()
+    :param filename: Name of the state cache file
+    :return: None
+
+    The cache is written to a temporary file that replaces the previous cache, so an interrupted write never leaves
+    a partial cache behind.
+    '''
+    temp_filename = filename + '.tmp'
     try:
-        updated_binding.update_resource(nitro)
-        ret = True
-    except NSNitroError as error:
-        log.debug('update_csvserver_lbvserver_binding() failed: {0}'.format(error))
-    return ret
+        with open(temp_filename,'w') as f:
+            json.dump(state_cache,f,sort_keys=True)
+        os.rename(temp_filename,filename)
+    except (IOError, OSError) as error:
+        log.info('State cache {} could not be written: {}'.format(filename,error))
+    return None
+
 
-def add_csvserver_lbvserver_binding(nitro, csvserver_conf):
+def get_config_change_marker(nitro):
     '''
-    
-    :param nitro: NSNitro instance
-    :param csvserver_conf: Config item for csvserver from config file 
-    :return: True if addedd successfully; False otherwise
-    
-    - Implements CRUD capability for csvserver_lbvserver_binding
-    - No object for csvserver_lbvserver_binding in NSNitro module
+
+    :param nitro: NSNitro connection object
+    :return: Time of the last configuration change of the NetScaler (lastconfigchangedtime of nsconfig); None if
+             it could not be retrieved
     '''
-    ret = False
-    new_binding = NSBaseResource()
-    new_binding.resourcetype = 'csvserver_lbvserver_binding'
-    new_binding.options['name'] = csvserver_conf['name']
-    new_binding.options['lbvserver'] = csvserver_conf['default_lbvserver']
     try:
-        new_binding.add_resource(nitro)
-        ret = True
+        response = nitro.get(nitro.get_url() + 'nsconfig?attrs=lastconfigchangedtime').get_response_field('nsconfig')
     except NSNitroError as error:
-        log.debug('add_csvserver_lbvserver_binding() failed: {0}'.format(error))
-    return ret
+        log.debug('last configuration change time could not be retrieved: {}'.format(error))
+        return None
+    if type(response) == list:
+        response = response[0] if len(response) > 0 else {}
+    if not isinstance(response,dict):
+        return None
+    return response.get('lastconfigchangedtime')
 
 
-def ensure_csvserver_state(nitro, csvserver_conf):
+def is_ns_group_unchanged(cache_entry,ns_group_conf,change_marker):
     '''
-    
-    :param nitro: NSNitro instance 
-    :param csvserver_conf: Config item for csvserver from config file
-    :return: True if state applied successfully; False otherwise
-    
-    Validates NS configuration and applies any changes needed to match the input csvserver configuration item.
-    - Iterates through existing csvservers on the NS to find matching name and/or IP address contained in the csvserver config item
-    - An existing csvserver on the NS with a matching name is validated and updated if necessary to match the IP of the csvserver config item
-    - An existing csvserver on the NS is deleted if it:
-        - Does not have a name that matches the csvserver config item
-        - Does have an IP address the matches the csvserver config item
-    - Creates an csvserver on the NS using the csvserver config item if one does not exist
-    - Iterates through csvserver bindings to service groups in the config item
-    - Deletes existing csvserver bindings on the NS that do not match the csvserver config item
-    - Creates csvserver binding on the NS for each csvserver config item binding that does not exist
-    - Sets csvserver_lbvserver_binding for default_lbvserver value in config item
-    
+
+    :param cache_entry: Entry of the ns_group in the state cache (see load_state_cache()); None if there is none
+    :param ns_group_conf: Configuration dictionary representing an ns_group
+    :param change_marker: Configuration change marker of the NetScaler from get_config_change_marker()
+    :return: True if neither the ns_group configuration nor the NetScaler configuration changed since the ns_group
+             was last applied successfully
     '''
-    ret = True
-    
-    all_csvservers = NSCSVServer.get_all(nitro)
-    matches_found = {}
-    for csvserver in all_csvservers:
-      if csvserver.get_name() == csvserver_conf['name'] and csvserver.get_ipv46() == csvserver_conf['vip_address'] and csvserver.get_port == csvserver_conf['port'] and csvserver.get_servicetype == csvserver_conf['protocol']:
-          matches_found['full_match'] = csvserver
-      elif csvserver.get_name() == csvserver_conf['name']:
-          matches_found['name'] = csvserver
-      elif csvserver.get_ipv46() == csvserver_conf['vip_address']:
-          matches_found['vip_address'] = csvserver
-
-    if not 'full_match' in matches_found.keys():
-
-        check_for_port_and_protocol_match = False
-
-        if 'vip_address' in matches_found.keys() and not 'name' in matches_found.keys():
-            csvserver_to_delete = matches_found['vip_address']
-            try:
-                NSCSVServer.delete(nitro,csvserver_to_delete)
-            except NSNitroError as error:
-                log.debug('NSCSVServer.delete() failed: {0}'.format(error))
-                ret = False
-
-        if 'name' in matches_found.keys() and not 'vip_address' in matches_found.keys():
-            updated_csvserver = matches_found['name']
-            updated_csvserver.set_ipv46(csvserver_conf['vip_address'])
-            try:
-                NSCSVServer.update(nitro, updated_csvserver)
-            except NSNitroError as error:
-                log.debug('NSCSVServer.update() failed: {0}'.format(error))
-                ret = False
-            check_for_port_and_protocol_match = True
-
-        if 'name' in matches_found.keys() and 'vip_address' in matches_found.keys():
-            update = True
-            csvserver_to_delete = matches_found['vip_address']
-            try:
-                NSCSVServer.delete(nitro,csvserver_to_delete)
-            except NSNitroError as error:
-                log.debug('NSCSVServer.delete() failed: {0}'.format(error))
-                ret = False 
-            updated_csvserver = matches_found['name']
-            updated_csvserver.set_ipv46(csvserver_conf['vip_address'])
-            try:
-                NSCSVServer.update(nitro, updated_csvserver)
-            except NSNitroError as error:
-                log.debug('NSCSVServer.update() failed: {0}'.format(error))
-                ret = False
-            check_for_port_and_protocol_match = True
-        if check_for_port_and_protocol_match:
-            update = False
-            if updated_csvserver.get_port() != csvserver_conf['port']:
-                update = True
-                updated_csvserver.set_port(csvserver_conf['port'])
-            if updated_csvserver.get_servicetype() != csvserver_conf['protocol']:
-                update = True
-                updated_csvserver.set_servicetype(csvserver_conf['protocol'])
-            if update:
-                try:
-                    NSCSVServer.update(nitro, updated_csvserver)
-                except NSNitroError as error:
-                    log.debug('NSCSVServer.update() failed: {0}'.format(error))
-                    ret = False
+    if cache_entry is None or change_marker is None:
+        return False
+    return cache_entry == [get_fingerprint(ns_group_conf),change_marker]
 
-    existing_csvserver = NSCSVServer()
-    existing_csvserver.set_name(csvserver_conf['name'])
 
-    try:
-        existing_csvserver = NSCSVServer.get(nitro,existing_csvserver)
-    except NSNitroError as error:
-        log.debug('no existing csvserver found for {}'.format(csvserver_conf['name']))
-        existing_csvserver = None
-
-    if existing_csvserver:
-        update_needed = False
-        delete_needed = False
-        if existing_csvserver.get_servicetype() != csvserver_conf['protocol'] or existing_csvserver.get_port() != csvserver_conf['port']:
-            delete_needed = True
-        elif existing_csvserver.get_ipv46() != csvserver_conf['vip_address']:
-            update_needed = True
-            existing_csvserver.set_ipv46(csvserver_conf['vip_address'])
-        if delete_needed:
-            try:
-                NSCSVServer.delete(nitro, existing_csvserver)
-            except NSNitroError as error:
-                log.debug('NSCSVServer.delete() failed: {0}'.format(error))
-                ret = False
-            existing_csvserver = None
-        elif update_needed:
-            try:
-                NSCSVServer.update(nitro, existing_csvserver)
-            except NSNitroError as error:
-                log.debug('NSCSVServer.update() failed: {0}'.format(error))
-                ret = False
-
-    if not existing_csvserver:
-        new_csvserver = NSCSVServer()
-        new_csvserver.set_name(csvserver_conf['name'])
-        new_csvserver.set_ipv46(csvserver_conf['vip_address'])
-        new_csvserver.set_port(csvserver_conf['port'])
-        new_csvserver.set_servicetype(csvserver_conf['protocol'])
+# Hostname resolution used to validate ns_instance addresses.  'timeout' is the number of seconds to wait for
+# the hostnames resolved together; 'offline' skips DNS and only checks the syntax of hostnames.
+resolver_settings = {'timeout':5.0,'workers':32,'offline':False}
+
+# Hostname -> IP address, or None if the hostname could not be resolved
+resolver_cache = {}
+
+# Address -> True if the address is an IP address
+ip_address_cache = {}
+
+hostname_pattern = re.compile(r'^(?=.{1,253}\.?$)[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?'
+                              r'(?:\.[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?)*\.?$')
+
+
+def is_ip_address(address):
+    '''
+
+    :param address: Address string
+    :return: True if the address is an IP address; False otherwise
+    '''
+    if address not in ip_address_cache:
         try:
-            NSCSVServer.add(nitro, new_csvserver)
-        except NSNitroError as error:
-            log.debug('NSCSVServer.add() failed: {0}'.format(error))
-            ret = False
+            socket.inet_aton(address)
+            ip_address_cache[address] = True
+        except (socket.error, TypeError):
+            ip_address_cache[address] = False
+    return ip_address_cache[address]
 
-    existing_csvserver_lbvserver_binding = get_csvserver_lbvserver_binding(nitro,csvserver_conf['name'])
-    if 'default_lbvserver' in csvserver_conf.keys():
-        if existing_csvserver_lbvserver_binding is not None:
-            if existing_csvserver_lbvserver_binding.options['lbvserver'] != csvserver_conf['default_lbvserver']:
-                existing_csvserver_lbvserver_binding.options['lbvserver'] = csvserver_conf['default_lbvserver']
-                update_csvserver_lbvserver_binding(nitro,existing_csvserver_lbvserver_binding)
-        else:
-            add_csvserver_lbvserver_binding(nitro,csvserver_conf)
-    elif existing_csvserver_lbvserver_binding is not None:
-        delete_csvserver_lbvserver_binding(nitro,csvserver_conf['name'])
 
-    csvserver_policy_binding = NSCSVServerCSPolicyBinding()
-    csvserver_policy_binding.set_name(csvserver_conf['name'])
-    try:
-        existing_bindings = NSCSVServerCSPolicyBinding.get(nitro, csvserver_policy_binding)
-    except NSNitroError as error:
-        log.debug('no existing csvserver policy bindings found for {}'.format(csvserver_conf['name']))
-        existing_bindings = None
+def resolve_hostnames(hostnames):
+    '''
+
+    :param hostnames: List of hostnames or IP addresses
+    :return: None
+
+    Resolves every unique hostname that is not in resolver_cache concurrently and stores the results in
+    resolver_cache.  Hostnames that fail to resolve, or do not resolve within resolver_settings['timeout'] seconds,
+    are cached as None.  Nothing is resolved in offline mode.
+    '''
+    if resolver_settings['offline']:
+        return None
+    pending = deque(sorted(set([hostname for hostname in hostnames if hostname is not None and
+                                hostname not in resolver_cache and not is_ip_address(hostname)])))
+    if len(pending) == 0:
+        return None
+    unresolved = list(pending)
+    results = {}
+    lock = threading.Lock()
+
+    def resolve_pending():
+        while True:
+            with lock:
+                if len(pending) == 0:
+                    return
+                hostname = pending.popleft()
+            try:
+                results[hostname] = socket.gethostbyname(hostname)
+            except (socket.error, UnicodeError) as error:
+                log.debug('resolving {} failed: {}'.format(hostname,error))
+                results[hostname] = None
+
+    # Resolver threads are not joined past the timeout; a hung lookup does not delay validation
+    threads = [threading.Thread(target=resolve_pending) for i in range(min(resolver_settings['workers'],len(pending)))]
+    deadline = time.time() + resolver_settings['timeout']
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join(max(0,deadline - time.time()))
+    for hostname in unresolved:
+        if hostname not in results:
+            log.debug('resolving {} timed out'.format(hostname))
+        resolver_cache[hostname] = results.get(hostname)
+    return None
+
+
+def get_ns_address_host(address):
+    '''
+
+    :param address: ns_instance address; an IP address or hostname, optionally followed by ':' and a port
+    :return: IP address or hostname of the address; None if the port is not a number
+    '''
+    host, separator, port = address.rpartition(':')
+    if separator == '':
+        return address
+    if not port.isdigit():
+        return None
+    return host
+
 
-    for binding in csvserver_conf['policy_bindings']:
-        if existing_bindings is not None:
-            for existing_binding in existing_bindings:
-                existing_binding_found = False
-                if existing_binding.get_policyname() == binding['name']:
-                    if existing_binding.get_priority() == binding['priority']:
-                        existing_binding_found = True
-                        binding['existing'] = True
-                if not existing_binding_found:
-                    binding_to_remove = existing_binding
-                    try:
-                        NSCSVServerCSPolicyBinding.delete(nitro, binding_to_remove)
-                    except NSNitroError as error:
-                        log.debug('NSCSVServerCSPolicyBinding.delete() failed: {0}'.format(error))
-                        ret = False
-
-        for binding in csvserver_conf['policy_bindings']:
-            if not 'existing' in binding.keys():
-                new_binding = NSCSVServerCSPolicyBinding()
-                new_binding.set_name(csvserver_conf['name'])
-                new_binding.set_policyname(binding['name'])
-                new_binding.set_priority(binding['priority'])
-                try:
-                    NSCSVServerCSPolicyBinding.add(nitro, new_binding)
-                except NSNitroError as error:
-                    log.debug('NSCSVServerCSPolicyBinding.add() failed: {0}'.format(error))
-                    ret = False
-            else:
-                binding.pop('existing')
+def is_valid_ns_address(address):
+    '''
+
+    :param address: ns_instance address; an IP address or hostname, optionally followed by ':' and a port
+    :return: True if the address is an IP address or a hostname that resolves; in offline mode, True if the
+             address is an IP address or a valid hostname
+    '''
+    address = get_ns_address_host(address)
+    if address is None:
+        return False
+    if is_ip_address(address):
+        return True
+    if resolver_settings['offline']:
+        return hostname_pattern.match(address) is not None
+    if address not in resolver_cache:
+        resolve_hostnames([address])
+    return resolver_cache[address] is not None
+
+
+# Schemas of the YAML state declaration.  References between configuration items are checked separately in
+# get_config_yaml_errors() using the references listed in ns_plan_node_types.
+ns_group_schema = Schema({'name':str,Optional('ns_instance'):object,Optional('service_groups'):object,
+                          Optional('servers'):object, Optional('lbvservers'):object,
+                          Optional('csvservers'):object, Optional('cs_policies'):object,
+                          Optional('cs_actions'):object, Optional('build'):object})
+
+ns_instance_schema = Schema({'user': str,
+                             'pass': str,
+                             'address': And(Use(str), is_valid_ns_address),
+                             Optional('max_rps'): And(Use(float), lambda n: n > 0)})
+
+# Schema of a single configuration item, by ns_group key
+config_item_schemas = OrderedDict()
+config_item_schemas['service_groups'] = Schema({'name': str,
+                                                'protocol': str,
+                                                'servers':[
+                                                    {'name': Use(str),
+                                                     'port': And(Use(int), lambda n: 1 <= n <= 65535)}]})
+config_item_schemas['servers'] = Schema({'name': str,
+                                         'ip_address': And(Use(str), is_ip_address)})
+
+config_item_schemas['lbvservers'] = Schema({'name': str,
+                                            'vip_address': And(Use(str),
+                                                               is_ip_address),
+                                            'port':And(Use(int), lambda n: 1 <= n <= 65535),
+                                            'protocol': str,
+                                            'service_group_bindings':[Use(str)]})
+
+config_item_schemas['csvservers'] = Schema({'name': str,
+                                            'vip_address': And(Use(str),
+                                                               is_ip_address),
+                                            'port':And(Use(int), lambda n: 1 <= n <= 65535),
+                                            'protocol': str,
+                                            'default_lbvserver': Use(str),
+                                            'policy_bindings':[
+                                                {'name': Use(str),
+                                                 'priority': int}]
+                                            })
+
+config_item_schemas['cs_policies'] = Schema({'name':str, 'expression': str, 'action':Use(str)})
+
+config_item_schemas['cs_actions'] = Schema({'name': str, 'target_lbvserver': Use(str)})
 
-    
-    return ret
 
 def validate_config_yaml(config_from_yaml):
     '''
@@ -1306,94 +3101,82 @@ def validate_config_yaml(config_from_yaml):
 
     - Validates schema of configuration items from config file
     - Ensures referential integrity of config items that refer to other config items
+    - Every error found is logged
     '''
+    errors = get_config_yaml_errors(config_from_yaml)
+    for error in errors:
+        log.info(error)
+    return len(errors) == 0
 
-    ret = True
 
-    schema = {}
-    schema['ns_groups'] = Schema([{'name':str,Optional('ns_instance'):object,Optional('service_groups'):object,
-                                   Optional('servers'):object, Optional('lbvservers'):object,
-                                   Optional('csvservers'):object, Optional('cs_policies'):object,
-                                   Optional('cs_actions'):object, Optional('build'):object}])
-    schema['ns_instance'] = Schema({'user': str,
-                                    'pass': str,
-                                    'address': Or(And(Use(str), lambda n: socket.inet_aton(n)),And(Use(str), lambda n: socket.gethostbyname(n))) })
-    schema['service_groups'] = Schema([{'name': str,
-                                        'protocol': str,
-                                        'servers':[
-                                            {'name': And(Use(str),lambda n: n in all_servers),
-                                             'port': And(Use(int), lambda n: 1 <= n <= 65535)}]}])
-    schema['servers'] = Schema([{'name': str,
-                                 'ip_address': And(Use(str), lambda n: socket.inet_aton(n))}])
-
-    schema['lbvservers'] = Schema([{'name': str,
-                                    'vip_address': And(Use(str),
-                                                       lambda n: socket.inet_aton(n)),
-                                    'port':And(Use(int), lambda n: 1 <= n <= 65535),
-                                    'protocol': str,
-                                    'service_group_bindings':[
-                                        And(Use(str),lambda n: n in all_service_groups)
-                                    ]}])
-
-    schema['csvservers'] = Schema([{'name': str,
-                                    'vip_address': And(Use(str),
-                                                       lambda n: socket.inet_aton(n)),
-                                    'port':And(Use(int), lambda n: 1 <= n <= 65535),
-                                    'protocol': str,
-                                    'default_lbvserver': And(Use(str),lambda n: n in all_lbvservers),
-                                    'policy_bindings':[
-                                        {'name': And(Use(str),lambda n: n in all_cs_policies),
-                                        'priority': int}]
-                                     }])
-
-    schema['cs_policies'] = Schema([{'name':str, 'expression': str, 'action':And(Use(str),lambda n: n in all_cs_actions)}])
-
-    schema['cs_actions'] = Schema([{'name': str, 'target_lbvserver': And(Use(str),lambda n: n in all_lbvservers)}])
-
-
-    if 'ns_groups' in config_from_yaml.keys():
-        if validate_schema(schema['ns_groups'],config_from_yaml['ns_groups']):
-            conf_items = ['ns_instance','service_groups','servers','lbvservers','csvservers','cs_policies','cs_actions']
-            for group in config_from_yaml['ns_groups']:
-                all_servers = []
-                if 'servers' in group.keys():
-                    for server in group['servers']:
-                        if 'name' in server.keys():
-                            all_servers.append(server['name'])
-                all_service_groups = []
-                if 'service_groups' in group.keys():
-                    for service_group in group['service_groups']:
-                        if 'name' in service_group.keys():
-                            all_service_groups.append(service_group['name'])
-                all_lbvservers = []
-                if 'lbvservers' in group.keys():
-                    for lbvserver in group['lbvservers']:
-                        if 'name' in lbvserver.keys():
-                            all_lbvservers.append(lbvserver['name'])
-                all_cs_policies = []
-                if 'cs_policies' in group.keys():
-                    for cs_policy in group['cs_policies']:
-                        if 'name' in cs_policy.keys():
-                            all_cs_policies.append(cs_policy['name'])
-                all_cs_actions = []
-                if 'cs_actions' in group.keys():
-                    for cs_action in group['cs_actions']:
-                        if 'name' in cs_action.keys():
-                            all_cs_actions.append(cs_action['name'])
-
-                for conf_item in conf_items:
-                    if conf_item in group.keys():
-                        if validate_schema(schema[conf_item],group[conf_item]) is not None:
-                            log.info('validation of {} in ns_groups: {} failed'.format(conf_item,group['name']))
-                            ret = False
-            else:
-                log.info('yaml format error')
-                ret = False
-    else:
-        log.info('yaml format error')
-        ret = False
+def get_config_yaml_errors(config_from_yaml):
+    '''
 
-    return ret
+    :param config_from_yaml: Dictionary containing contents of YAML state declaration
+    :return: List of error messages; empty if the configuration is valid
+
+    Validation continues after an error so every error in the file is reported in one pass.  References are
+    checked against sets of the names defined in the ns_group, so the cost grows linearly with the size of the
+    configuration.
+    '''
+    errors = []
+    if not isinstance(config_from_yaml,dict) or not isinstance(config_from_yaml.get('ns_groups'),list):
+        return ['yaml format error']
+
+    # Resolves every ns_instance hostname once, concurrently, before the ns_groups are validated
+    addresses = []
+    for group in config_from_yaml['ns_groups']:
+        if isinstance(group,dict) and isinstance(group.get('ns_instance'),dict) and \
+                group['ns_instance'].get('address') is not None:
+            addresses.append(get_ns_address_host(str(group['ns_instance']['address'])))
+    resolve_hostnames(addresses)
+
+    for group in config_from_yaml['ns_groups']:
+        error = validate_schema(ns_group_schema,group)
+        if error is not None:
+            errors.append('validation of ns_group {} failed: {}'.format(
+                group.get('name') if isinstance(group,dict) else group,error))
+            continue
+        if 'ns_instance' in group.keys():
+            error = validate_schema(ns_instance_schema,group['ns_instance'])
+            if error is not None:
+                errors.append('validation of ns_instance in ns_groups: {} failed: {}'.format(group['name'],error))
+
+        # Only items that match their schema are checked for references
+        valid_items = {}
+        for conf_item, schema_obj in config_item_schemas.items():
+            if conf_item not in group.keys():
+                continue
+            if not isinstance(group[conf_item],list):
+                errors.append('validation of {} in ns_groups: {} failed: not a list'.format(conf_item,group['name']))
+                continue
+            valid_items[conf_item] = []
+            for index, item in enumerate(group[conf_item]):
+                error = validate_schema(schema_obj,item)
+                if error is None:
+                    valid_items[conf_item].append(item)
+                else:
+                    errors.append('validation of {} item {} in ns_groups: {} failed: {}'.format(
+                        conf_item,item.get('name',index) if isinstance(item,dict) else index,group['name'],error))
+
+        all_names = {}
+        for node_type, node_type_properties in ns_plan_node_types.items():
+            if node_type_properties['parent'] is None:
+                all_names[node_type] = set()
+                if isinstance(group.get(node_type_properties['yaml']),list):
+                    for item in group[node_type_properties['yaml']]:
+                        if isinstance(item,dict) and 'name' in item.keys():
+                            all_names[node_type].add(str(item['name']))
+
+        for node_type, node_type_properties in ns_plan_node_types.items():
+            for item in valid_items.get(node_type_properties['yaml'],[]):
+                for reference in node_type_properties['references']:
+                    for name in get_referenced_names(item,reference):
+                        if str(name) not in all_names[reference['node_type']]:
+                            errors.append('{} {} in ns_groups: {} refers to undefined {} {}'.format(
+                                node_type_properties['yaml'],item['name'],group['name'],
+                                ns_plan_node_types[reference['node_type']]['yaml'],name))
+    return errors
 
 
 def validate_schema(schema_obj,input):
@@ -1431,6 +3214,19 @@ def validate_ns_groups_conf(conf):
     return ret
 
 
+def is_empty_ns_group_conf(ns_group_conf):
+    '''
+
+    :param ns_group_conf:   Dictionary containing contents of ns_group YAML state declaration
+    :return: True if the ns_group configuration only contains its name and ns_instance; False otherwise
+    '''
+    if not 'name' in ns_group_conf.keys():
+        expected_num_keys = 1
+    else:
+        expected_num_keys = 2
+    return expected_num_keys == len(ns_group_conf.keys())
+
+
 def check_populate_ns_group_yaml(ns_group_conf):
     '''
     :param ns_group_conf:   Dictionary containing contents of ns_group YAML state declaration
@@ -1441,12 +3237,7 @@ def check_populate_ns_group_yaml(ns_group_conf):
     for a user to automatically build a config YAML from an existing NetScaler configuration.
 
     '''
-    if not 'name' in ns_group_conf.keys():
-        expected_num_keys = 1
-    else:
-        expected_num_keys = 2
-
-    if expected_num_keys == len(ns_group_conf.keys()):
+    if is_empty_ns_group_conf(ns_group_conf):
         received_valid_input = False
         build_yaml = False
         while not received_valid_input:
@@ -1456,32 +3247,27 @@ def check_populate_ns_group_yaml(ns_group_conf):
                 if user_input.lower() in ['','y']:
                     build_yaml = True
         if build_yaml:
-            schema = Schema({'user': str, 'pass': str,
-                             'address': Or(And(Use(str), lambda n: socket.inet_aton(n)),And(Use(str), lambda n: socket.gethostbyname(n))) })
-
             try:
-                schema.validate(ns_group_conf['ns_instance'])
+                ns_instance_schema.validate(ns_group_conf['ns_instance'])
                 ns_group_conf['build'] = True
             except SchemaError as error:
                 log.info('validation of {} in ns_group: {} failed'.format('ns_instance',ns_group_conf['name']))
     return None
 
 
-def convert_list_of_nitro_objects_to_yaml_config(list_of_nitro_objects):
+def convert_snapshot_resources_to_yaml_config(snapshot,resource_type):
     '''
 
-    :param list_of_nitro_objects: List containing NSBaseResource objects
-    :return: List of YAML configuration objects corresponding to list of input objects
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :return: List of YAML configuration objects corresponding to the resources of the type in the snapshot
 
-    Maps object attributes from NSNitro-based objects to YAML-based configuration syntax
+    Maps Nitro options of the snapshot resources to YAML-based configuration syntax
 
     '''
     return_list = []
-
-    if list_of_nitro_objects is not None:
-        for nitro_object in list_of_nitro_objects:
-            return_list.append(map_nitro_object_options_to_yaml_config(nitro_object.resourcetype,nitro_object))
-
+    for options in snapshot['resources'][resource_type].values():
+        return_list.append(map_nitro_options_to_yaml_config(resource_type,options))
     return return_list
 
 
@@ -1511,155 +3297,242 @@ def get_ns_group_conf_from_ns(nitro,input_ns_group_conf):
 
     Queries the NetScaler for the existing configuration and builds a corresponding YAML-based configuration.
 
+    '''
+    return get_ns_group_conf_from_snapshot(get_ns_snapshot(nitro),input_ns_group_conf)
+
+
+def get_ns_group_conf_from_snapshot(snapshot,input_ns_group_conf):
+    '''
+
+    :param snapshot: Snapshot dictionary from get_ns_snapshot()
+    :param input_ns_group_conf: Configuration dictionary representing an ns_group
+    :return: OrderedDict object with the configuration contained in the snapshot
+
+    Builds the YAML-based configuration of an ns_group from a snapshot.  Bindings are joined to their parent
+    resources by name from the snapshot, so no further requests are sent to the NetScaler.
+
     '''
     ns_group_conf = OrderedDict()
     if 'name' in input_ns_group_conf.keys():
         ns_group_conf['name'] = input_ns_group_conf['name']
     ns_group_conf['ns_instance'] = input_ns_group_conf['ns_instance']
-    assign_if_list_not_empty(ns_group_conf, 'servers', convert_list_of_nitro_objects_to_yaml_config(get_all_resources_by_type(nitro,'server')))
-    assign_if_list_not_empty(ns_group_conf, 'service_groups', convert_list_of_nitro_objects_to_yaml_config(get_all_resources_by_type(nitro,'servicegroup')))
-    assign_if_list_not_empty(ns_group_conf, 'lbvservers', convert_list_of_nitro_objects_to_yaml_config(get_all_resources_by_type(nitro,'lbvserver')))
-    assign_if_list_not_empty(ns_group_conf, 'csvservers', convert_list_of_nitro_objects_to_yaml_config(get_all_resources_by_type(nitro,'csvserver')))
-    assign_if_list_not_empty(ns_group_conf, 'cs_policies', convert_list_of_nitro_objects_to_yaml_config(get_all_resources_by_type(nitro,'cspolicy')))
-    assign_if_list_not_empty(ns_group_conf, 'cs_actions', convert_list_of_nitro_objects_to_yaml_config(get_all_resources_by_type(nitro,'csaction')))
+    assign_if_list_not_empty(ns_group_conf, 'servers', convert_snapshot_resources_to_yaml_config(snapshot,'server'))
+    assign_if_list_not_empty(ns_group_conf, 'service_groups', convert_snapshot_resources_to_yaml_config(snapshot,'servicegroup'))
+    assign_if_list_not_empty(ns_group_conf, 'lbvservers', convert_snapshot_resources_to_yaml_config(snapshot,'lbvserver'))
+    assign_if_list_not_empty(ns_group_conf, 'csvservers', convert_snapshot_resources_to_yaml_config(snapshot,'csvserver'))
+    assign_if_list_not_empty(ns_group_conf, 'cs_policies', convert_snapshot_resources_to_yaml_config(snapshot,'cspolicy'))
+    assign_if_list_not_empty(ns_group_conf, 'cs_actions', convert_snapshot_resources_to_yaml_config(snapshot,'csaction'))
 
     if 'lbvservers' in ns_group_conf.keys():
         for lbvserver in ns_group_conf['lbvservers']:
-            bindings = get_bindings_for_lbvserver(nitro,lbvserver)
+            bindings = get_snapshot_bindings(snapshot,'lbvserver_servicegroup_binding',lbvserver['name'])
             if len(bindings) > 0:
-                lbvserver['service_group_bindings'] = bindings
+                lbvserver['service_group_bindings'] = [binding['servicegroupname'] for binding in bindings.values()]
 
     if 'service_groups' in ns_group_conf.keys():
         for service_group in ns_group_conf['service_groups']:
-            #bindings = get_bindings_for_service_group(nitro,service_group)
-            bindings = get_all_resources_by_type_and_name(nitro,'servicegroup_servicegroupmember_binding',service_group['name'])
+            bindings = get_snapshot_bindings(snapshot,'servicegroup_servicegroupmember_binding',service_group['name'])
             if len(bindings) > 0:
                 service_group['servers'] = []
-                for binding in bindings:
-                    service_group['servers'].append(map_nitro_object_options_to_yaml_config('servicegroup_servicegroupmember_binding',binding))
+                for binding in bindings.values():
+                    service_group['servers'].append(map_nitro_options_to_yaml_config('servicegroup_servicegroupmember_binding',binding))
 
     if 'csvservers' in ns_group_conf.keys():
         for csvserver in ns_group_conf['csvservers']:
-            bindings = get_policy_bindings_for_csvserver(nitro,csvserver)
+            bindings = get_snapshot_bindings(snapshot,'csvserver_cspolicy_binding',csvserver['name'])
             if len(bindings) > 0:
-                csvserver['policy_bindings'] = bindings
-            target_lbvserver = get_all_resources_by_type_and_name(nitro,'csvserver_lbvserver_binding',csvserver['name'])
-            if target_lbvserver is not None:
-                csvserver['target_lbvserver'] = target_lbvserver[0].options['lbvserver']
+                csvserver['policy_bindings'] = []
+                for binding in bindings.values():
+                    csvserver['policy_bindings'].append(map_nitro_options_to_yaml_config('csvserver_cspolicy_binding',binding))
+            bindings = get_snapshot_bindings(snapshot,'csvserver_lbvserver_binding',csvserver['name'])
+            if len(bindings) > 0:
+                csvserver['default_lbvserver'] = list(bindings.values())[0]['lbvserver']
 
     return ns_group_conf
 
 
-def get_all_resources_by_type_and_name(nitro,resource_type,resource_name):
+def get_projected_options(properties,options):
+    '''
+
+    :param properties: List of Nitro property names to keep
+    :param options: Dictionary of Nitro options returned by the NetScaler
+    :return: Dictionary of the options limited to the properties
     '''
+    return dict([(property, options[property]) for property in properties if property in options])
+
+
+def get_projected_response(nitro,url,resource_type,query=''):
+    '''
+
     :param nitro: NSNitro connection object
-    :param resource_type: NetScaler resource name as contained in the Nitro API
-    :param resource_name: Name of resource to send in GET request
-    :return: List of NSBaseResponse objects returned from request to NetScaler; Empty list of no objects returned
+    :param url: Nitro GET URL of a resource type, a resource or the bindings of a resource type
+    :param resource_type: Nitro resource or binding type requested
+    :param query: Additional query arguments, e.g. the page requested; empty for none
+    :return: List of Nitro option dictionaries limited to the managed properties of the resource type; raises
+             NSNitroError if the request fails
+
+    Asks the NetScaler for the managed properties only (attrs=, see get_managed_properties()) instead of the full
+    resource, which for a vserver is well over a hundred mostly read-only or statistical fields.  The response is
+    also projected here so the snapshot holds the managed properties only even if the NetScaler ignores attrs.  If
+    the NetScaler rejects the projected request for any reason other than a missing resource, it is repeated without
+    attrs.
     '''
-    matching_resources = []
-    url = nitro.get_url() + resource_type + '/' + resource_name
+    properties = get_managed_properties(resource_type)
+    separator = '&' if '?' in url else '?'
     try:
-        response = nitro.get(url).get_response_field(resource_type)
-        if type(response) == list:
-            for item in response:
-                resource = NSBaseResource()
-                resource.resourcetype = resource_type
-                resource.options = item
-                matching_resources.append(resource)
-        else:
-            resource = NSBaseResource()
-            resource.resourcetype = resource_type
-            resource.options = item
-            matching_resources.append(resource)
+        response = nitro.get(url + separator + 'attrs=' + ','.join(properties) + query)
     except NSNitroError as error:
-        log.debug('no {} resources found on ns'.format(resource_type))
-        matching_resources = None
-    return matching_resources
-
-def get_bindings_for_lbvserver(nitro,lbvserver_conf):
+        # 258: No such resource; the request without attrs would fail the same way
+        if getattr(error,'code',0) == 258:
+            raise
+        log.debug('projected retrieval of {} failed, retrying without attrs: {}'.format(resource_type,error))
+        response = nitro.get(url + (separator + query[1:] if query else ''))
+    items = response.get_response_field(resource_type)
+    if type(items) != list:
+        items = [items]
+    return [get_projected_options(properties,item) for item in items]
+
+
+def get_resource_count(nitro,url,resource_type):
     '''
 
     :param nitro: NSNitro connection object
-    :param lbvserver_conf: Load Balancing Virtual Server object configuration
-    :return: List of Service Group names that are bound to the named LBVServer in the input config
+    :param url: Nitro GET URL of a resource type or of the bindings of a resource type
+    :param resource_type: Nitro resource or binding type requested
+    :return: Number of resources or bindings on the NetScaler (count=yes); None if it could not be retrieved
     '''
-    returned_bindings = []
-    resource_type = 'lbvserver_servicegroup_binding'
-    bindings = get_all_resources_by_type_and_name(nitro,resource_type,lbvserver_conf['name'])
-    if bindings is not None:
-        for binding in bindings:
-            returned_bindings.append(binding.options['servicegroupname'])
-    return returned_bindings
+    separator = '&' if '?' in url else '?'
+    try:
+        counts = nitro.get(url + separator + 'count=yes').get_response_field(resource_type)
+        return int(counts[0]['__count'])
+    except (NSNitroError, IndexError, KeyError, TypeError, ValueError) as error:
+        log.debug('count of {} failed: {}'.format(resource_type,error))
+        return None
 
 
-def get_policy_bindings_for_csvserver(nitro,csvserver_conf):
+def iter_projected_resources(nitro,url,resource_type):
     '''
 
     :param nitro: NSNitro connection object
-    :param csvserver_conf: Content Switching Virtual Server object configuration
-    :return: List of CS Policy names that are bound to the named CSVServer in the input config
+    :param url: Nitro GET URL of a resource type or of the bindings of a resource type
+    :param resource_type: Nitro resource or binding type requested
+    :return: Generator of Nitro option dictionaries limited to the managed properties (see get_projected_response());
+             raises NSNitroError if any request fails
+
+    Reads the table in pages of nitro_settings['page_size'] resources (pagesize= and pageno=), so a very large table
+    is neither built by the NetScaler in one response nor held in memory as a whole here.  A table that fits in the
+    first page costs a single request, as without pagination.  When the first page is full, the NetScaler is asked
+    for the number of resources (count=yes) and the remaining pages are requested; if the count is not available,
+    pages are requested until one is not full.  A page size of 0 reads the table in one request.  A page that fails
+    after the first is logged as an error, since the resources already read are only part of the table.
     '''
-    returned_bindings = []
-    resource_type = 'cspolicy_csvserver_binding'
-    bindings = get_all_resources_by_type_and_name(nitro,resource_type,csvserver_conf['name'])
-    if bindings is not None:
-        for binding in bindings:
-            returned_bindings.append(map_nitro_object_options_to_yaml_config(resource_type,binding))
-    return returned_bindings
+    page_size = nitro_settings['page_size']
+    if page_size <= 0:
+        for item in get_projected_response(nitro,url,resource_type):
+            yield item
+        return
+    page_query = '&pagesize={0}&pageno={1}'
+    items = get_projected_response(nitro,url,resource_type,page_query.format(page_size,1))
+    for item in items:
+        yield item
+    if len(items) < page_size:
+        return
+    count = get_resource_count(nitro,url,resource_type)
+    pages = None if count is None else (count + page_size - 1) // page_size
+    page = 2
+    while pages is None or page <= pages:
+        log.debug('reading page {} of {} of {}'.format(page,pages or '?',resource_type))
+        try:
+            items = get_projected_response(nitro,url,resource_type,page_query.format(page_size,page))
+        except NSNitroError as error:
+            log.error('reading page {0} of {1} failed; the {1} table read is incomplete: {2}'.format(page,
+                                                                                                 resource_type,error))
+            raise
+        for item in items:
+            yield item
+        if len(items) < page_size:
+            return
+        page += 1
 
 
-def get_lbvserver_bindings_for_csvserver(nitro,csvserver_conf):
+def get_all_resources_by_type_and_name(nitro,resource_type,resource_name):
     '''
-
     :param nitro: NSNitro connection object
-    :param csvserver_conf: Content Switching Virtual Server object configuration
-    :return: Name of default LBVServer bound to CSVServer in the input config
+    :param resource_type: NetScaler resource name as contained in the Nitro API
+    :param resource_name: Name of resource to send in GET request
+    :return: List of NSBaseResponse objects returned from request to NetScaler; Empty list of no objects returned or
+             if the resource does not exist; None if the request failed otherwise
     '''
-    ret = None
-    resource_type = 'csvserver_lbvserver_binding'
-    bindings = get_all_resources_by_type_and_name(nitro,resource_type,csvserver_conf['name'])
-    if bindings is not None:
-        ret = binding.options['lbvserver']
-    return ret
-
+    matching_resources = []
+    url = nitro.get_url() + resource_type + '/' + resource_name
+    try:
+        for item in get_projected_response(nitro,url,resource_type):
+            resource = NSBaseResource()
+            resource.resourcetype = resource_type
+            resource.options = item
+            matching_resources.append(resource)
+    except NSNitroError as error:
+        if getattr(error,'code',0) == 258:
+            log.debug('no {} resources named {} found on ns'.format(resource_type,resource_name))
+        else:
+            log.debug('retrieving {} {} failed: {}'.format(resource_type,resource_name,error))
+            matching_resources = None
+    return matching_resources
 
-def get_all_resources_by_type(nitro,resource_type):
+def get_all_bindings_by_type(nitro,binding_type,parent_names):
     '''
+
     :param nitro: NSNitro connection object
-    :param resource_type: Name of resource type as defined in the Nitro API
-    :return: List of NSBaseResource objects containing the data returned from the NetScaler
-    '''
+    :param binding_type: Nitro binding type listed in ns_binding_types
+    :param parent_names: Names of the parent resources; used only if bulk retrieval is not supported
+    :return: Generator of NSBaseResource binding objects; raises NSNitroError if the bindings cannot be read
 
-    all_resources = []
-    url = nitro.get_url() + resource_type
+    Retrieves the bindings of every parent resource in pages of bulk requests (bulkbindings=yes, see
+    iter_projected_resources()); each binding names its parent resource.  If the NetScaler rejects bulk retrieval,
+    the bindings are requested for each parent resource.
+    '''
+    url = nitro.get_url() + binding_type + '?bulkbindings=yes'
+    bindings = iter_projected_resources(nitro,url,binding_type)
     try:
-        resources = nitro.get(url).get_response_field(resource_type)
+        first_binding = next(bindings,None)
     except NSNitroError as error:
-        log.debug('no {} resources found on ns'.format(resource_type))
-        resources = None
-    if resources is not None:
-        for resource in resources:
-            new_resource = NSBaseResource()
-            new_resource.resourcetype = resource_type
-            new_resource.set_options(resource)
-            all_resources.append(new_resource)
-    return all_resources
+        log.debug('bulk retrieval of {} failed: {}'.format(binding_type,error))
+        for parent_name in parent_names:
+            resources = get_all_resources_by_type_and_name(nitro,binding_type,parent_name)
+            if resources is None:
+                log.error('reading the {} of {} failed; the {} table read is incomplete'.format(binding_type,
+                                                                                              parent_name,
+                                                                                              binding_type))
+                raise NSNitroError('{} of {} could not be read'.format(binding_type,parent_name))
+            for resource in resources:
+                yield resource
+        return
+    if first_binding is None:
+        return
+    for binding in chain([first_binding],bindings):
+        resource = NSBaseResource()
+        resource.resourcetype = binding_type
+        resource.options = binding
+        yield resource
 
 
-def get_bindings_for_service_group(nitro, service_group_conf):
+def get_all_resources_by_type(nitro,resource_type):
     '''
     :param nitro: NSNitro connection object
-    :param csvserver_conf: Service Group object configuration
-    :return: List of Service Group Server Binding configurations from NetScaler
+    :param resource_type: Name of resource type as defined in the Nitro API
+    :return: Generator of NSBaseResource objects containing the data returned from the NetScaler, read in pages
+             (see iter_projected_resources()); raises NSNitroError if any page fails
+
+    An empty table is an empty response, not an error, so a failed request is never taken for a table without
+    resources.
     '''
-    returned_bindings = []
-    resource_type = 'servicegroup_servicegroupmember_binding'
-    bindings = get_all_resources_by_type_and_name(nitro,resource_type,service_group_conf['name'])
-    if bindings is not None:
-        for binding in bindings:
-            returned_bindings.append(map_nitro_object_options_to_yaml_config(resource_type,binding))
-    return returned_bindings
+
+    url = nitro.get_url() + resource_type
+    for resource in iter_projected_resources(nitro,url,resource_type):
+        new_resource = NSBaseResource()
+        new_resource.resourcetype = resource_type
+        new_resource.set_options(resource)
+        yield new_resource
 
 
 def create_ordered_dict_from_config_yaml(config_yaml):
@@ -1679,52 +3552,771 @@ def create_ordered_dict_from_config_yaml(config_yaml):
 
     return ordered_config
 
-def main():
-    log.info('Using config file: {}'.format(sys.argv[1]))
-    conf = get_config_yaml(sys.argv[1])
-    if conf is not None:
-        need_yaml_update = False
+def get_operations_summary(operations,chunk_size):
+    '''
+
+    :param operations: List of operations in the order they would be applied
+    :param chunk_size: Maximum number of operations sent in one Nitro request
+    :return: OrderedDict with the number of operations by action, the estimated number of Nitro calls ('calls')
+             and the estimated request bytes ('bytes') needed to apply them
+    '''
+    summary = OrderedDict([('add',0),('update',0),('rename',0),('delete',0),('calls',0),('bytes',0)])
+    for operation in operations:
+        summary[operation['action']] += 1
+    for batch in get_operation_batches(operations,chunk_size):
+        summary['calls'] += 1
+        summary['bytes'] += get_operation_batch_bytes(batch)
+    return summary
+
+
+def log_operations_plan(operations,chunk_size):
+    '''
+
+    :param operations: List of operations in the order they would be applied
+    :param chunk_size: Maximum number of operations sent in one Nitro request
+    :return: Summary from get_operations_summary()
+    '''
+    for operation in operations:
+        options = ' '.join(['{0}={1}'.format(k, v) for k, v in get_request_resource(operation).items()])
+        log.info('  {0} {1} {2} ({3})'.format(operation['action'],operation['resource_type'],operation['name'],
+                                              options))
+    summary = get_operations_summary(operations,chunk_size)
+    log.info('Plan: {0} to add, {1} to update, {2} to rename, {3} to delete; '
+             'about {4} Nitro calls and {5} bytes'.format(*summary.values()))
+    return summary
+
+
+def process_ns_group(ns_group,args,state_cache=None):
+    '''
+
+    :param ns_group: Configuration dictionary representing an ns_group
+    :param args: argparse.Namespace from get_arguments()
+    :param state_cache: State cache dictionary from load_state_cache(); None if disabled
+    :return: Dictionary with the backup configuration of the ns_group ('backup', None if the connection failed),
+             whether the input file needs to be updated with a built configuration ('build') and whether the state
+             was applied successfully ('success'); with args.plan, the number of pending changes ('changes')
+
+    Connects to the NetScaler of the ns_group with its own Nitro session, backs up the existing configuration and
+    either builds the ns_group configuration from it or applies the ns_group state.  With args.plan, the changes
+    are only logged; nothing is backed up or written to the NetScaler.  Log records of the ns_group are tagged with
+    its name.
+
+    With a state cache, the time of the last configuration change of the NetScaler, read before its configuration,
+    is recorded after a successful apply along with a hash of the ns_group configuration; if neither changed by the
+    next run, the ns_group is skipped after that single request, without reading or backing up the NetScaler.
+
+    Every plan applied is written to the operation journal of the NetScaler.  With args.resume, the plan of an
+    interrupted run is continued instead (see resume_ns_group_state()); the configuration of the NetScaler is not
+    read or backed up again.
+    '''
+    result = {'backup':None,'build':False,'success':False,'changes':0}
+    ns_group_context.name = ns_group['name']
+    try:
+        log.info('Processing group {}'.format(ns_group['name']))
+        address = ns_group['ns_instance']['address']
+        cache_entry = None
+        if state_cache is not None and not args.full_reconcile:
+            cache_entry = state_cache.get(address,{}).get(ns_group['name'])
+        nitro = connect(ns_group['ns_instance'])
+        resume_plan = None
+        if nitro is not None and args.resume and not args.plan and 'build' not in ns_group.keys():
+            resume_plan = get_resume_plan(args,ns_group)
+        change_marker = None
+        if nitro is not None and state_cache is not None and resume_plan is None and 'build' not in ns_group.keys():
+            # Read before the configuration, so a change made while it is read or applied is seen by the next run
+            change_marker = get_config_change_marker(nitro)
+        if nitro is not None and is_ns_group_unchanged(cache_entry,ns_group,change_marker):
+            log.info('NetScaler and ns_group configuration unchanged since the last successful apply; skipping')
+            result['success'] = True
+            disconnect(nitro)
+        elif nitro is not None and args.plan:
+            if 'build' in ns_group.keys() or is_empty_ns_group_conf(ns_group):
+                log.info('Empty ns_group configuration; nothing to plan')
+            else:
+                operations = get_ns_group_operations(get_ns_snapshot(nitro),ns_group)
+                result['changes'] = len(operations)
+                log_operations_plan(operations,args.chunk_size)
+            result['success'] = True
+            disconnect(nitro)
+        elif nitro is not None and resume_plan is not None:
+            # The NetScaler was backed up by the interrupted run
+            result['success'] = resume_ns_group_state(nitro,resume_plan,args.chunk_size,
+                                                      get_journal(args.journal_dir,address))
+            if state_cache is not None:
+                state_cache.get(address,{}).pop(ns_group['name'],None)
+            disconnect(nitro)
+        elif nitro is not None:
+            # Reads the managed configuration once; the backup is built from the same snapshot the state is applied to
+            snapshot = get_ns_snapshot(nitro)
+            backup_ns_group_conf = get_ns_group_conf_from_snapshot(snapshot,ns_group)
+            result['backup'] = backup_ns_group_conf
+            # Check for empty config or the presence of the 'build' flag in the YAML config file
+            if 'build' in ns_group.keys():
+                result['build'] = True
+                for key in backup_ns_group_conf.keys():
+                    ns_group[key] = backup_ns_group_conf[key]
+                ns_group.pop('build')
+                result['success'] = True
+            else:
+                # Applies all changes in dependency order
+                result['success'] = apply_ns_group_state(nitro,ns_group,snapshot,args.chunk_size,
+                                                         get_journal(args.journal_dir,address),args.apply_workers)
+                if state_cache is not None:
+                    # Each ns_group has its own entry, so ns_groups sharing the NetScaler keep theirs
+                    if result['success'] and change_marker is not None:
+                        state_cache.setdefault(address,{})[ns_group['name']] = [get_fingerprint(ns_group),
+                                                                                 change_marker]
+                    else:
+                        state_cache.get(address,{}).pop(ns_group['name'],None)
+            disconnect(nitro)
+        else:
+            log.info('Connection to NetScaler on {} failed'.format(ns_group['ns_instance']['address']))
+    except Exception as error:
+        log.exception('Processing group {} failed: {}'.format(ns_group['name'],error))
+    finally:
+        ns_group_context.name = None
+    return result
+
+
+def get_resume_plan(args,ns_group):
+    '''
+
+    :param args: argparse.Namespace from get_arguments()
+    :param ns_group: Configuration dictionary representing an ns_group
+    :return: Pending plan of the ns_group from the journal of its NetScaler; None if there is no pending plan or the
+             ns_group configuration changed since it was planned
+    '''
+    journal = get_journal(args.journal_dir,ns_group['ns_instance']['address'])
+    if journal is None:
+        return None
+    plan = journal['pending'].get(ns_group['name'])
+    if plan is None:
+        log.info('No interrupted run to resume')
+        return None
+    if plan['config'] != get_fingerprint(ns_group):
+        log.info('The configuration changed since the interrupted run; planning from the NetScaler configuration')
+        return None
+    return plan
+
+
+def process_ns_group_with_log(ns_group,args,state_cache=None):
+    '''
+
+    :param ns_group: Configuration dictionary representing an ns_group
+    :param args: argparse.Namespace from get_arguments()
+    :param state_cache: State cache dictionary from load_state_cache(); None if disabled
+    :return: Return value of process_ns_group()
+
+    Runs process_ns_group() with an additional log file that only contains the records of the ns_group.
+    '''
+    group_log_file = logging.FileHandler('apply_netscaler_state_{}_{}.log'.format(run_timestamp,ns_group['name']))
+    group_log_file.addFilter(NSGroupLogFilter(ns_group['name']))
+    log.addHandler(group_log_file)
+    try:
+        result = process_ns_group(ns_group,args,state_cache)
+    finally:
+        log.removeHandler(group_log_file)
+        group_log_file.close()
+    return result
+
+
+def process_and_backup_ns_group(ns_group,args,state_cache=None,backup=None):
+    '''
+
+    :param ns_group: Configuration dictionary representing an ns_group
+    :param args: argparse.Namespace from get_arguments()
+    :param state_cache: State cache dictionary from load_state_cache(); None if disabled
+    :param backup: Dictionary from open_backup(); None if no backup is written
+    :return: Return value of process_ns_group() without the backup configuration
+
+    Processes the ns_group (with its own log file when ns_groups are processed concurrently) and appends its backup
+    configuration to the backup file, so the backup is not held until every ns_group is processed.
+    '''
+    if args.workers > 1:
+        result = process_ns_group_with_log(ns_group,args,state_cache)
+    else:
+        result = process_ns_group(ns_group,args,state_cache)
+    if backup is not None and result['backup'] is not None:
+        append_backup(backup,result['backup'])
+    result['backup'] = None
+    return result
+
+
+def process_ns_groups(ns_groups,args,state_cache=None,backup=None):
+    '''
+
+    :param ns_groups: List of ns_group configuration dictionaries
+    :param args: argparse.Namespace from get_arguments(); args.workers is the maximum number of ns_groups
+                 processed concurrently
+    :param state_cache: State cache dictionary from load_state_cache(); None if disabled
+    :param backup: Dictionary from open_backup(); None if no backup is written
+    :return: List of process_and_backup_ns_group() results in the order of the input ns_groups
+
+    ns_groups share no state, so with more than one worker they are processed concurrently on a thread pool, each
+    with its own Nitro session and log file.  Backups are appended in the order of the input ns_groups, each as soon
+    as every ns_group before it is processed; only the backups of ns_groups that complete ahead of an earlier one
+    are held until then.
+    '''
+    if args.workers > 1 and len(ns_groups) > 1:
+        pool = ThreadPool(min(args.workers,len(ns_groups)))
+        try:
+            # imap() returns the results in input order; waiting with a timeout keeps the wait interruptible
+            ordered_results = pool.imap(lambda ns_group: process_ns_group_with_log(ns_group,args,state_cache),
+                                        ns_groups)
+            results = []
+            for i in range(len(ns_groups)):
+                result = ordered_results.next(sys.maxint)
+                if backup is not None and result['backup'] is not None:
+                    append_backup(backup,result['backup'])
+                result['backup'] = None
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = []
+        for ns_group in ns_groups:
+            results.append(process_and_backup_ns_group(ns_group,args,state_cache,backup))
+    return results
+
+
+def process_ns_groups_stream(args,state_cache=None):
+    '''
+
+    :param args: argparse.Namespace from get_arguments()
+    :param state_cache: State cache dictionary from load_state_cache(); None if disabled
+    :return: Exit status; see main()
+
+    Reads the ns_groups of the input file one at a time and validates, applies (or plans) and backs up each one
+    before the next is read, so memory use is bounded by the largest ns_groups in flight rather than by the whole
+    file.  At most args.workers ns_groups are in flight; the backup lists ns_groups in the order they complete.
+    Building an ns_group configuration from the NetScaler is not supported since it rewrites the input file.
+    '''
+    # Only the outcome of each ns_group is kept; see process_ns_group()
+    results = []
+    backup = None
+    if not args.plan:
+        backup = open_backup(get_backup_filename(args))
+
+    def process_in_flight(ns_group):
+        # Every ns_group taken in flight records a result and frees its place, even if processing it raised
+        result = {'success':False,'changes':0}
+        try:
+            result = process_and_backup_ns_group(ns_group,args,state_cache,backup)
+        except Exception as error:
+            log.exception('Processing group {} failed: {}'.format(ns_group['name'],error))
+        finally:
+            results.append(result)
+            in_flight.release()
+
+    in_flight = threading.BoundedSemaphore(max(args.workers,1))
+    pool = ThreadPool(max(args.workers,1))
+    try:
+        for ns_group in get_config_ns_groups(args.config_file):
+            if not validate_config_yaml({'ns_groups':[ns_group]}):
+                results.append({'success':False,'changes':0})
+            elif 'build' in ns_group.keys() or is_empty_ns_group_conf(ns_group):
+                log.info('Building ns_group {} is not supported with --stream'.format(ns_group['name']))
+                results.append({'success':False,'changes':0})
+            else:
+                in_flight.acquire()
+                pool.apply_async(process_in_flight,(ns_group,))
+    except (IOError, yaml.YAMLError) as error:
+        log.info('YAML import failed: {}'.format(error))
+        results.append({'success':False,'changes':0})
+    finally:
+        pool.close()
+        pool.join()
+        if backup is not None:
+            close_backup(backup)
+
+    if args.plan:
+        return get_plan_exit_status(results)
+    return 0 if all([result['success'] for result in results]) else 1
+
+
+def get_backup_filename(args,timestamp=None):
+    '''
+
+    :param args: argparse.Namespace from get_arguments()
+    :param timestamp: Timestamp in the filename; None for the start of the run
+    :return: Filename of the backup written during this run
+    '''
+    if timestamp is None:
+        timestamp = run_timestamp
+    if args.backup_format == 'compact':
+        return 'backup_ns_config_{}{}'.format(timestamp,compact_config_extension)
+    return 'backup_ns_config_{}.yml'.format(timestamp)
+
+
+def get_plan_exit_status(results):
+    '''
+
+    :param results: List of process_ns_group() results
+    :return: 1 if any ns_group could not be planned; 2 if changes are pending; 0 otherwise
+    '''
+    if not all([result['success'] for result in results]):
+        return 1
+    changes = sum([result['changes'] for result in results])
+    if changes > 0:
+        log.info('{} changes pending'.format(changes))
+        return 2
+    log.info('No changes pending')
+    return 0
+
+
+def get_arguments(argv=None):
+    '''
 
+    :param argv: List of command line arguments; sys.argv is used if None
+    :return: argparse.Namespace with the parsed arguments
+    '''
+    parser = argparse.ArgumentParser(description='Applies a YAML-based NetScaler state to one or more appliances')
+    parser.add_argument('config_file', help='YAML state declaration file, or a compact ({}) backup'.format(
+                        compact_config_extension))
+    parser.add_argument('--workers', type=int, default=1,
+                        help='maximum number of ns_groups processed concurrently (default: 1)')
+    parser.add_argument('--apply-workers', type=int, default=4,
+                        help='maximum number of independent sets of changes applied concurrently to one ns_group '
+                             '(default: 4)')
+    parser.add_argument('--chunk-size', type=int, default=100,
+                        help='maximum number of adds, updates or deletes of one resource type sent in a single '
+                             'Nitro request; 1 sends every change on its own (default: 100)')
+    parser.add_argument('--plan', action='store_true',
+                        help='only report the changes needed in each ns_group; exits with 2 if changes are pending')
+    parser.add_argument('--state-cache', metavar='FILE',
+                        help='skip ns_groups whose configuration did not change, on NetScalers that did not change, '
+                             'since the last successful apply recorded in FILE')
+    parser.add_argument('--full-reconcile', action='store_true',
+                        help='reconcile every ns_group even if unchanged according to the state cache')
+    parser.add_argument('--dns-timeout', type=float, default=5.0,
+                        help='seconds to wait for the ns_instance hostnames to resolve (default: 5)')
+    parser.add_argument('--offline', action='store_true',
+                        help='validate ns_instance hostnames without DNS lookups')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and apply the changed ns_groups whenever the configuration file changes')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='with --daemon, seconds between checks of the configuration file when inotify is not '
+                             'available (default: 1)')
+    parser.add_argument('--debounce', type=float, default=2.0,
+                        help='with --daemon, seconds the configuration file must be unchanged before it is applied '
+                             '(default: 2)')
+    parser.add_argument('--drift-interval', type=float, default=300.0,
+                        help='with --daemon, seconds between checks for changes made on the NetScalers by others; '
+                             '0 to disable (default: 300)')
+    parser.add_argument('--stream', action='store_true',
+                        help='read, validate, apply and back up one ns_group at a time to bound memory use')
+    parser.add_argument('--backup-format', choices=['yaml','compact'], default='yaml',
+                        help='format of the backup file: YAML or gzip-compressed JSON lines (default: yaml)')
+    parser.add_argument('--convert-to', metavar='FILE',
+                        help='only convert config_file to FILE, in the compact format if FILE ends with {} and '
+                             'YAML otherwise'.format(compact_config_extension))
+    parser.add_argument('--metrics-file', metavar='FILE',
+                        help='write the Nitro call counters and latency histograms to FILE for the Prometheus '
+                             'node exporter textfile collector (use a .prom extension)')
+    parser.add_argument('--journal-dir', default='.',
+                        help='directory of the operation journal of each NetScaler (default: working directory)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the plan of an interrupted run from the journal instead of reading and '
+                             'backing up the NetScaler configuration again')
+    parser.add_argument('--max-in-flight', type=int, default=32,
+                        help='maximum number of Nitro requests in flight to one NetScaler; the limit adapts to '
+                             'the NetScaler latency and errors up to this maximum (default: 32)')
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help='number of resources read from the NetScaler per request; 0 reads each resource or '
+                             'binding type in one request (default: 1000)')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', metavar='FILE',
+                          help='record every Nitro request and response to the cassette FILE, with credentials '
+                               'scrubbed; gzip compressed if FILE ends with .gz')
+    cassette.add_argument('--replay', metavar='FILE',
+                          help='answer Nitro requests from the cassette FILE instead of connecting to the NetScaler')
+    return parser.parse_args(argv)
+
+
+def process_config_file(args):
+    '''
+
+    :param args: argparse.Namespace from get_arguments()
+    :return: Exit status; see main()
+    '''
+    log.info('Using config file: {}'.format(args.config_file))
+    if args.stream:
+        state_cache = None
+        if args.state_cache is not None:
+            state_cache = load_state_cache(args.state_cache)
+        ret = process_ns_groups_stream(args,state_cache)
+        if state_cache is not None and not args.plan:
+            save_state_cache(state_cache,args.state_cache)
+        return ret
+    conf = get_config(args.config_file)
+    if conf is not None and args.convert_to is not None:
+        return 0 if update_config(conf,args.convert_to) else 1
+    ret = 1
+    if conf is not None:
         # Validate YAML configuration file; Prevents applying invalid configuration
         if validate_config_yaml(conf):
-            backup_config = OrderedDict()
-            backup_config['ns_groups'] = []
-            for ns_group in conf['ns_groups']:
-                log.info('Processing group {}'.format(ns_group['name']))
-
-                ns_instance = ns_group['ns_instance']
-                nitro = connect(ns_instance)
-                if nitro.get_sessionid() is not None:
-                    # Create backup configuration from NetScaler instance
-                    backup_ns_group_conf = get_ns_group_conf_from_ns(nitro,ns_group)
-                    backup_config['ns_groups'].append(backup_ns_group_conf)
+            # Prompts for empty ns_group configurations before any ns_group is processed
+            if not args.plan:
+                for ns_group in conf['ns_groups']:
                     check_populate_ns_group_yaml(ns_group)
-                    # Check for empty config or the presence of the 'build' flag in the YAML config file
-                    if 'build' in ns_group.keys():
-                        need_yaml_update = True
-                        for key in backup_ns_group_conf.keys():
-                            ns_group[key] = backup_ns_group_conf[key]
-                        ns_group.pop('build')
-                    else:
-                        # Iterates through 5 times per NS instance to ensure that dependencies are addressed during state configuration
-                        i = 0
-                        while i <= 5:
-                            # Iterates through YAML config file resource types to apply state for each
-                            for yaml_config_resource_type in yaml_config_resource_types:
-                                if yaml_config_resource_type in ns_group.keys():
-                                    exec('ensure_' + yaml_config_resource_type + '_state(nitro,ns_group[yaml_config_resource_type])')
-                                else:
-                                    exec('ensure_' + yaml_config_resource_type + '_state(nitro,None)')
-                            i += 1
-                    disconnect(nitro)
-                else:
-                    log.info('Connection to NetScaler on {} failed'.format(ns_group['ns_instance']['address']))
+            state_cache = None
+            if args.state_cache is not None:
+                state_cache = load_state_cache(args.state_cache)
+            if args.plan:
+                return get_plan_exit_status(process_ns_groups(conf['ns_groups'],args,state_cache))
+            # Each ns_group is written to the backup as soon as it is processed
+            backup = open_backup(get_backup_filename(args))
+            try:
+                results = process_ns_groups(conf['ns_groups'],args,state_cache,backup)
+            finally:
+                if backup is not None:
+                    close_backup(backup)
+            if state_cache is not None:
+                save_state_cache(state_cache,args.state_cache)
+
+            ret = 0
+            need_yaml_update = False
+            for result in results:
+                if result['build']:
+                    need_yaml_update = True
+                if not result['success']:
+                    ret = 1
             if need_yaml_update:
                 # Updates input config file if 'build' option is selected
-                update_yaml(conf,sys.argv[1])
-            #update_yaml(create_ordered_dict_from_config_yaml(backup_config),'backup.yml')
-            update_yaml(backup_config,'backup_ns_config_{}.yml'.format(strftime("%Y%m%d_%H%M%S")))
+                update_config(conf,args.config_file)
+    return ret
+
+
+def get_file_signature(filename):
+    '''
+
+    :param filename: Name of the watched file
+    :return: Tuple of the modification time and size of the file; None if it does not exist
+    '''
+    try:
+        status = os.stat(filename)
+    except OSError:
+        return None
+    return (status.st_mtime,status.st_size)
+
+
+def get_file_digest(filename):
+    '''
+
+    :param filename: Name of the watched file
+    :return: Content hash of the file; None if it cannot be read
+    '''
+    try:
+        with open(filename,'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def new_file_watcher(filename):
+    '''
+
+    :param filename: Name of the watched file
+    :return: Dictionary with the pyinotify notifier watching the directory of the file ('notifier'); the notifier is
+             None if pyinotify is not installed or the directory cannot be watched
+    '''
+    watcher = {'filename':filename,'notifier':None}
+    if pyinotify is None:
+        log.info('pyinotify is not installed; polling {} for changes'.format(filename))
+        return watcher
+    watch_manager = pyinotify.WatchManager()
+    # The directory is watched since editors often replace the file rather than write it in place
+    mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE | pyinotify.IN_DELETE
+    watches = watch_manager.add_watch(os.path.dirname(os.path.abspath(filename)),mask)
+    if min(watches.values() or [-1]) < 0:
+        log.info('{} cannot be watched with inotify; polling it for changes'.format(filename))
+        return watcher
+    watcher['notifier'] = pyinotify.Notifier(watch_manager,pyinotify.ProcessEvent())
+    return watcher
+
+
+def wait_for_file_event(watcher,timeout):
+    '''
+
+    :param watcher: Dictionary from new_file_watcher()
+    :param timeout: Maximum number of seconds to wait
+    :return: None
+
+    Returns when a file in the directory of the watched file changes, or after the timeout.  Without inotify, it
+    always waits for the timeout; the caller compares file signatures to find changes either way.
+    '''
+    notifier = watcher['notifier']
+    if notifier is None:
+        time.sleep(timeout)
+    elif notifier.check_events(int(timeout * 1000)):
+        notifier.read_events()
+        notifier.process_events()
+    return None
+
+
+def new_daemon_group_state():
+    '''
+
+    :return: Dictionary kept by the reconcile daemon for one ns_group between changes:
+             - 'nitro': Nitro session; None when disconnected
+             - 'snapshot': Snapshot kept current after each apply; None when the NetScaler must be read again
+             - 'config': Content hash of the ns_group configuration last applied successfully
+             - 'marker': Configuration change marker of the NetScaler after the last apply (see
+               get_config_change_marker())
+             - 'checked': Time the marker was last checked
+    '''
+    return {'nitro':None,'snapshot':None,'config':None,'marker':None,'checked':0.0}
+
+
+def close_daemon_group_state(group_state):
+    '''
+
+    :param group_state: Dictionary from new_daemon_group_state()
+    :return: None
+    '''
+    if group_state['nitro'] is not None:
+        disconnect(group_state['nitro'])
+        group_state['nitro'] = None
+    return None
+
+
+def get_daemon_change_marker(group_state,ns_group):
+    '''
+
+    :param group_state: Dictionary from new_daemon_group_state()
+    :param ns_group: Configuration dictionary representing an ns_group
+    :return: Configuration change marker of the NetScaler; None if it could not be retrieved
+
+    The kept Nitro session is used if it is still valid; otherwise a new session is opened, as the NetScaler ends
+    idle sessions.  Without a session, the kept snapshot is dropped.
+    '''
+    marker = None
+    if group_state['nitro'] is not None:
+        marker = get_config_change_marker(group_state['nitro'])
+    if marker is None:
+        close_daemon_group_state(group_state)
+        group_state['nitro'] = connect(ns_group['ns_instance'])
+        if group_state['nitro'] is None:
+            log.info('Connection to NetScaler on {} failed'.format(ns_group['ns_instance']['address']))
+            group_state['snapshot'] = None
+            return None
+        marker = get_config_change_marker(group_state['nitro'])
+    group_state['checked'] = time.time()
+    return marker
+
+
+def reconcile_daemon_group(ns_group,group_state,args,backup=None,check_drift=False):
+    '''
+
+    :param ns_group: Configuration dictionary representing an ns_group
+    :param group_state: Dictionary from new_daemon_group_state()
+    :param args: argparse.Namespace from get_arguments()
+    :param backup: Dictionary from open_backup() the NetScaler configuration is appended to before changes are
+                   applied; None if no backup is written
+    :param check_drift: True to check the NetScaler for changes made by others even if the ns_group configuration
+                        did not change
+    :return: True if the ns_group was applied successfully or did not need to be; False otherwise
+
+    An ns_group whose configuration did not change is skipped unless check_drift is set.  Otherwise one request
+    reads the configuration change marker of the NetScaler: if it matches the marker recorded after the last apply,
+    the ns_group is planned against the kept snapshot.  If the NetScaler changed, or there is no snapshot yet, its
+    configuration is read again first.
+    '''
+    config = get_fingerprint(ns_group)
+    if config == group_state['config'] and not check_drift:
+        return True
+    ns_group_context.name = ns_group['name']
+    try:
+        address = ns_group['ns_instance']['address']
+        marker = get_daemon_change_marker(group_state,ns_group)
+        nitro = group_state['nitro']
+        if nitro is None:
+            return False
+        if config == group_state['config'] and marker is not None and marker == group_state['marker']:
+            return True
+        if group_state['snapshot'] is None or marker is None or marker != group_state['marker']:
+            log.info('Reading the NetScaler configuration of group {}'.format(ns_group['name']))
+            group_state['snapshot'] = get_ns_snapshot(nitro)
+        else:
+            log.info('Applying changes to group {}'.format(ns_group['name']))
+        snapshot = group_state['snapshot']
+        if backup is not None:
+            append_backup(backup,get_ns_group_conf_from_snapshot(snapshot,ns_group))
+        success = apply_ns_group_state(nitro,ns_group,snapshot,args.chunk_size,get_journal(args.journal_dir,address),
+                                       args.apply_workers)
+        if success:
+            # The snapshot is kept current while applying, so it holds the state after the apply
+            group_state['config'] = config
+            group_state['marker'] = get_config_change_marker(nitro)
+        else:
+            # Retried from a fresh read of the NetScaler at the next change or drift check
+            group_state.update({'snapshot':None,'config':None,'marker':None})
+        return success
+    except Exception as error:
+        log.exception('Processing group {} failed: {}'.format(ns_group['name'],error))
+        group_state.update({'snapshot':None,'config':None,'marker':None})
+        return False
+    finally:
+        ns_group_context.name = None
+
+
+def get_daemon_ns_groups(filename):
+    '''
+
+    :param filename: Name of the state declaration file
+    :return: List of the ns_group configurations of the file to reconcile; None if the file cannot be read or is
+             invalid
+    '''
+    conf = get_config(filename)
+    if conf is None or not validate_config_yaml(conf):
+        return None
+    ns_groups = []
+    for ns_group in conf['ns_groups']:
+        if 'build' in ns_group.keys() or is_empty_ns_group_conf(ns_group):
+            log.info('Group {} is empty or to be built; not reconciled in daemon mode'.format(ns_group['name']))
+        else:
+            ns_groups.append(ns_group)
+    return ns_groups
+
+
+def reconcile_daemon_groups(ns_groups,group_states,args,check_drift=False):
+    '''
+
+    :param ns_groups: List of ns_group configurations from get_daemon_ns_groups()
+    :param group_states: Dictionary of ns_group name -> new_daemon_group_state(); groups no longer in ns_groups are
+                         removed
+    :param args: argparse.Namespace from get_arguments()
+    :param check_drift: Passed to reconcile_daemon_group()
+    :return: True if every ns_group was applied successfully or did not need to be
+    '''
+    names = set([ns_group['name'] for ns_group in ns_groups])
+    for name in list(group_states.keys()):
+        if name not in names:
+            close_daemon_group_state(group_states.pop(name))
+    for ns_group in ns_groups:
+        group_states.setdefault(ns_group['name'],new_daemon_group_state())
+    # Only the ns_groups applied in this cycle are backed up, in a backup file of their own
+    backup = open_backup(get_backup_filename(args,strftime("%Y%m%d_%H%M%S")))
+    reconcile = lambda ns_group: reconcile_daemon_group(ns_group,group_states[ns_group['name']],args,backup,
+                                                        check_drift)
+    try:
+        if args.workers > 1 and len(ns_groups) > 1:
+            pool = ThreadPool(min(args.workers,len(ns_groups)))
+            try:
+                results = pool.map_async(reconcile,ns_groups).get(sys.maxint)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [reconcile(ns_group) for ns_group in ns_groups]
+    finally:
+        if backup is not None and close_backup(backup) and backup['count'] == 0:
+            os.remove(backup['filename'])
+    # The journals would otherwise grow with every cycle for as long as the daemon runs
+    restart_journals()
+    return all(results)
+
+
+def raise_keyboard_interrupt(signum,frame):
+    '''
 
+    :param signum: Signal number
+    :param frame: Current stack frame
+    :return: None; raises KeyboardInterrupt so SIGTERM stops the daemon the same way as SIGINT
+    '''
+    raise KeyboardInterrupt()
+
+
+def run_daemon(args):
+    '''
+
+    :param args: argparse.Namespace from get_arguments()
+    :return: Exit status; 0 when stopped with SIGINT or SIGTERM
+
+    Keeps reconciling the NetScalers with the state declaration file until stopped.  Each ns_group keeps its Nitro
+    session and NetScaler snapshot between changes (see reconcile_daemon_group()), so a change to the file only
+    costs a request to check the NetScaler of each changed ns_group and the changes themselves.  The file is
+    watched with inotify, or polled every args.poll_interval seconds without it; it is only read once it has not
+    changed for args.debounce seconds, so successive edits are applied together.  An invalid file is logged and
+    ignored until it changes again.  Every args.drift_interval seconds, each ns_group checks whether its NetScaler
+    was changed by others and if so reads it again and reconciles it.
+    '''
+    signal.signal(signal.SIGTERM,raise_keyboard_interrupt)
+    filename = args.config_file
+    watcher = new_file_watcher(filename)
+    group_states = {}
+    ns_groups = []
+    signature = get_file_signature(filename)
+    changed = 0.0
+    applied_digest = None
+    drift_checked = time.time()
+    log.info('Reconciling {} until stopped'.format(filename))
+    try:
+        while True:
+            now = time.time()
+            current = get_file_signature(filename)
+            if current != signature:
+                signature = current
+                changed = now
+            if changed is not None and now - changed >= args.debounce:
+                changed = None
+                digest = get_file_digest(filename)
+                if digest is not None and digest != applied_digest:
+                    log.info('Using config file: {}'.format(filename))
+                    loaded_ns_groups = get_daemon_ns_groups(filename)
+                    if loaded_ns_groups is None:
+                        log.info('Invalid configuration in {}; waiting for the next change'.format(filename))
+                    else:
+                        ns_groups = loaded_ns_groups
+                        applied_digest = digest
+                        reconcile_daemon_groups(ns_groups,group_states,args)
+                        drift_checked = time.time()
+                        if args.metrics_file is not None:
+                            write_nitro_metrics_textfile(args.metrics_file)
+            elif args.drift_interval > 0 and now - drift_checked >= args.drift_interval:
+                reconcile_daemon_groups(ns_groups,group_states,args,True)
+                drift_checked = time.time()
+                if args.metrics_file is not None:
+                    write_nitro_metrics_textfile(args.metrics_file)
+            if changed is not None:
+                timeout = max(changed + args.debounce - time.time(),0.05)
+            else:
+                timeout = args.poll_interval
+            wait_for_file_event(watcher,timeout)
+    except KeyboardInterrupt:
+        log.info('Stopping')
+    finally:
+        for group_state in group_states.values():
+            close_daemon_group_state(group_state)
+    return 0
+
+
+def main():
+    args = get_arguments()
+    add_log_file(log_filename)
+    resolver_settings['timeout'] = args.dns_timeout
+    scheduler_settings['max_limit'] = max(args.max_in_flight,1)
+    nitro_settings['page_size'] = max(args.page_size,0)
+    # No DNS lookups are made when replaying a cassette
+    resolver_settings['offline'] = args.offline or args.replay is not None
+    if args.record is not None or args.replay is not None:
+        nitro_settings['cassette'] = open_cassette(args.record or args.replay,'record' if args.record else 'replay')
+        if nitro_settings['cassette'] is None:
+            return 1
+    try:
+        if args.daemon:
+            ret = run_daemon(args)
+        else:
+            ret = process_config_file(args)
+    finally:
+        close_journals()
+        if nitro_settings['cassette'] is not None:
+            if not close_cassette(nitro_settings['cassette']):
+                ret = 1
+            nitro_settings['cassette'] = None
+    report_nitro_metrics(args.metrics_file)
+    return ret
 
-if __name__ == "__main__": main()
 
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,171 @@
+'''
+Micro-benchmarks for apply_netscaler_state.py
+
+Each benchmark runs at increasing sizes and prints the best time of several runs along with the time per object.
+A constant time per object shows that the cost scales linearly with the size of the configuration.
+
+Usage: python benchmark.py [--sizes 1000,2000,4000,8000] [--repeat 3] [benchmark ...]
+'''
+import sys
+import argparse
+import timeit
+import yaml
+from collections import OrderedDict
+import apply_netscaler_state
+
+# Benchmarks report through print; only warnings from the script under test are shown
+apply_netscaler_state.log.setLevel(apply_netscaler_state.logging.WARNING)
+
+
+def get_sweep_fixture(size):
+    '''
+
+    :param size: Number of objects of each resource type
+    :return: Tuple of a snapshot and an ns_group configuration
+
+    Half of the existing servers, service groups and lbvservers are in the configuration and half are orphans.  Every
+    service group binds one server and every lbvserver binds one service group.
+    '''
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    ns_group_conf = OrderedDict([('name','benchmark'),('servers',[]),('service_groups',[]),('lbvservers',[])])
+    for i in range(size):
+        server = 'server{}'.format(i)
+        service_group = 'sg{}'.format(i)
+        lbvserver = 'lb{}'.format(i)
+        ip_address = '10.{}.{}.{}'.format(i // 65536, i // 256 % 256, i % 256)
+        vip_address = '172.{}.{}.{}'.format(16 + i // 65536, i // 256 % 256, i % 256)
+        apply_netscaler_state.add_resource_to_snapshot(snapshot,'server',{'name':server,'ipaddress':ip_address})
+        apply_netscaler_state.add_resource_to_snapshot(snapshot,'servicegroup',
+                                                       {'servicegroupname':service_group,'servicetype':'HTTP'})
+        apply_netscaler_state.add_resource_to_snapshot(snapshot,'lbvserver',
+                                                       {'name':lbvserver,'ipv46':vip_address,'port':'80',
+                                                        'servicetype':'HTTP'})
+        apply_netscaler_state.add_binding_to_snapshot(snapshot,'servicegroup_servicegroupmember_binding',
+                                                      {'servicegroupname':service_group,'servername':server,
+                                                       'port':'80'})
+        apply_netscaler_state.add_binding_to_snapshot(snapshot,'lbvserver_servicegroup_binding',
+                                                      {'name':lbvserver,'servicegroupname':service_group})
+        if i % 2 == 0:
+            ns_group_conf['servers'].append({'name':server,'ip_address':ip_address})
+            ns_group_conf['service_groups'].append({'name':service_group,'protocol':'HTTP',
+                                                    'servers':[{'name':server,'port':80}]})
+            ns_group_conf['lbvservers'].append({'name':lbvserver,'vip_address':vip_address,'port':80,
+                                                'protocol':'HTTP','service_group_bindings':[service_group]})
+    return snapshot, ns_group_conf
+
+
+def benchmark_sweep(size,repeat):
+    '''
+
+    :param size: Number of objects of each resource type
+    :param repeat: Number of timed runs
+    :return: Best time in seconds to plan the ns_group, including the orphan deletion sweeps
+    '''
+    snapshot, ns_group_conf = get_sweep_fixture(size)
+    timer = timeit.Timer(lambda: apply_netscaler_state.get_ns_group_operations(snapshot,ns_group_conf))
+    return min(timer.repeat(repeat,1))
+
+
+def get_validate_fixture(size):
+    '''
+
+    :param size: Number of servers
+    :return: YAML state declaration with one ns_group
+
+    Every service group has three members, so there are three service group members per server.  There is one
+    lbvserver, CS action and CS policy per service group and one csvserver per 100 lbvservers.
+    '''
+    ns_group_conf = OrderedDict([('name','benchmark'),
+                                 ('ns_instance',{'address':'192.0.2.1','user':'nsroot','pass':'nsroot'}),
+                                 ('servers',[]),('service_groups',[]),('lbvservers',[]),('csvservers',[]),
+                                 ('cs_policies',[]),('cs_actions',[])])
+    for i in range(size):
+        ns_group_conf['servers'].append({'name':'server{}'.format(i),
+                                         'ip_address':'10.{}.{}.{}'.format(i // 65536, i // 256 % 256, i % 256)})
+        ns_group_conf['service_groups'].append({'name':'sg{}'.format(i),'protocol':'HTTP',
+                                                'servers':[{'name':'server{}'.format((i + j) % size),'port':80}
+                                                           for j in range(3)]})
+        ns_group_conf['lbvservers'].append({'name':'lb{}'.format(i),'port':80,'protocol':'HTTP',
+                                            'vip_address':'172.{}.{}.{}'.format(16 + i // 65536, i // 256 % 256,
+                                                                                i % 256),
+                                            'service_group_bindings':['sg{}'.format(i)]})
+        ns_group_conf['cs_actions'].append({'name':'action{}'.format(i),'target_lbvserver':'lb{}'.format(i)})
+        ns_group_conf['cs_policies'].append({'name':'policy{}'.format(i),'action':'action{}'.format(i),
+                                             'expression':'HTTP.REQ.URL.PATH.STARTSWITH("/{}/")'.format(i)})
+        if i % 100 == 0:
+            ns_group_conf['csvservers'].append({'name':'cs{}'.format(i),'port':80,'protocol':'HTTP',
+                                                'vip_address':'192.168.{}.{}'.format(i // 25600 % 256,
+                                                                                      i // 100 % 256),
+                                                'default_lbvserver':'lb{}'.format(i),'policy_bindings':[]})
+        ns_group_conf['csvservers'][-1]['policy_bindings'].append({'name':'policy{}'.format(i),'priority':i + 1})
+    return {'ns_groups':[ns_group_conf]}
+
+
+def benchmark_validate(size,repeat):
+    '''
+
+    :param size: Number of servers
+    :param repeat: Number of timed runs
+    :return: Best time in seconds to validate the configuration
+    '''
+    config = get_validate_fixture(size)
+    timer = timeit.Timer(lambda: apply_netscaler_state.validate_config_yaml(config))
+    return min(timer.repeat(repeat,1))
+
+
+def benchmark_yaml_load(size,repeat,Loader=apply_netscaler_state.YAMLSafeLoader):
+    '''
+
+    :param size: Number of servers
+    :param repeat: Number of timed runs
+    :param Loader: yaml.Loader class
+    :return: Best time in seconds to load the configuration from get_validate_fixture() as YAML
+    '''
+    document = apply_netscaler_state.ordered_dump(get_validate_fixture(size),Dumper=apply_netscaler_state.YAMLSafeDumper)
+    timer = timeit.Timer(lambda: apply_netscaler_state.ordered_load(document,Loader=Loader))
+    return min(timer.repeat(repeat,1))
+
+
+def benchmark_yaml_dump(size,repeat,Dumper=apply_netscaler_state.YAMLSafeDumper):
+    '''
+
+    :param size: Number of servers
+    :param repeat: Number of timed runs
+    :param Dumper: yaml.Dumper class
+    :return: Best time in seconds to dump the configuration from get_validate_fixture() as YAML
+    '''
+    config = get_validate_fixture(size)
+    timer = timeit.Timer(lambda: apply_netscaler_state.ordered_dump(config,Dumper=Dumper))
+    return min(timer.repeat(repeat,1))
+
+
+benchmarks = OrderedDict([('sweep',benchmark_sweep),
+                          ('validate',benchmark_validate),
+                          ('yaml_load',benchmark_yaml_load),
+                          ('yaml_load_python',lambda size, repeat: benchmark_yaml_load(size,repeat,yaml.SafeLoader)),
+                          ('yaml_dump',benchmark_yaml_dump),
+                          ('yaml_dump_python',lambda size, repeat: benchmark_yaml_dump(size,repeat,yaml.SafeDumper))
+                          ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for apply_netscaler_state.py')
+    parser.add_argument('benchmarks', nargs='*', default=list(benchmarks.keys()),
+                        help='benchmarks to run: {} (default: all)'.format(', '.join(benchmarks.keys())))
+    parser.add_argument('--sizes', default='1000,2000,4000,8000',
+                        help='comma separated list of sizes (default: 1000,2000,4000,8000)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per size (default: 3)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error('unknown benchmark: {}'.format(name))
+        for size in sizes:
+            seconds = benchmarks[name](size,args.repeat)
+            print('{0:<18} {1:>8} {2:>10.3f} s {3:>10.2f} us/object'.format(name,size,seconds,
+                                                                            seconds * 1000000 / size))
+    return 0
+
+
+if __name__ == "__main__": sys.exit(main())
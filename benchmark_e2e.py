@@ -0,0 +1,174 @@
+'''
+End-to-end benchmarks for apply_netscaler_state.py against the local Nitro mock in nitro_mock.py
+
+For each size, an ns_group with that many resources is applied to an empty mock NetScaler, applied again without
+changes, once without and once with a state cache, applied with a small change and finally built back from the
+NetScaler.  Each phase reports the wall time and the number of Nitro requests and bytes the mock received and sent.
+The mock runs in the benchmark process.
+
+Usage: python benchmark_e2e.py [--sizes 100,1000,10000,50000] [--chunk-size 100] [--apply-workers 4]
+                               [--latency 0.001] [--page-size 1000]
+'''
+import sys
+import argparse
+import time
+import tempfile
+from collections import OrderedDict, Counter
+import apply_netscaler_state
+import nitro_mock
+
+# Benchmarks report through print; only warnings from the script under test are shown
+apply_netscaler_state.log.setLevel(apply_netscaler_state.logging.WARNING)
+
+# Resources in each unit of get_e2e_fixture(): server, service group, lbvserver, CS action and CS policy
+e2e_unit_resources = 5
+
+
+def get_e2e_fixture(size,ns_address):
+    '''
+
+    :param size: Number of resources
+    :param ns_address: ns_instance address of the mock NetScaler
+    :return: ns_group configuration with about size resources
+
+    Each unit is a server bound to a service group, bound to an lbvserver, targeted by a CS action and CS policy.
+    There is one csvserver per 100 units, bound to the CS policies of its units.
+    '''
+    ns_group_conf = OrderedDict([('name','benchmark'),
+                                 ('ns_instance',{'address':ns_address,'user':'nsroot','pass':'nsroot'}),
+                                 ('servers',[]),('service_groups',[]),('lbvservers',[]),('csvservers',[]),
+                                 ('cs_policies',[]),('cs_actions',[])])
+    for i in range(max(size // e2e_unit_resources,1)):
+        ns_group_conf['servers'].append({'name':'server{}'.format(i),
+                                         'ip_address':'10.{}.{}.{}'.format(i // 65536, i // 256 % 256, i % 256)})
+        ns_group_conf['service_groups'].append({'name':'sg{}'.format(i),'protocol':'HTTP',
+                                                'servers':[{'name':'server{}'.format(i),'port':80}]})
+        ns_group_conf['lbvservers'].append({'name':'lb{}'.format(i),'port':80,'protocol':'HTTP',
+                                            'vip_address':'172.{}.{}.{}'.format(16 + i // 65536, i // 256 % 256,
+                                                                                i % 256),
+                                            'service_group_bindings':['sg{}'.format(i)]})
+        ns_group_conf['cs_actions'].append({'name':'action{}'.format(i),'target_lbvserver':'lb{}'.format(i)})
+        ns_group_conf['cs_policies'].append({'name':'policy{}'.format(i),'action':'action{}'.format(i),
+                                             'expression':'HTTP.REQ.URL.PATH.STARTSWITH("/{}/")'.format(i)})
+        if i % 100 == 0:
+            ns_group_conf['csvservers'].append({'name':'cs{}'.format(i),'port':80,'protocol':'HTTP',
+                                                'vip_address':'192.168.{}.{}'.format(i // 25600 % 256,
+                                                                                      i // 100 % 256),
+                                                'default_lbvserver':'lb{}'.format(i),'policy_bindings':[]})
+        ns_group_conf['csvservers'][-1]['policy_bindings'].append({'name':'policy{}'.format(i),'priority':i + 1})
+    return ns_group_conf
+
+
+def change_e2e_fixture(ns_group_conf):
+    '''
+
+    :param ns_group_conf: ns_group configuration from get_e2e_fixture()
+    :return: None
+
+    Changes about one percent of the configuration in place: the expression of every 100th CS policy and the IP
+    address of every 100th server.
+    '''
+    for cs_policy in ns_group_conf['cs_policies'][::100]:
+        cs_policy['expression'] = cs_policy['expression'].replace('STARTSWITH','CONTAINS')
+    for server in ns_group_conf['servers'][::100]:
+        server['ip_address'] = server['ip_address'].replace('10.','11.',1)
+    return None
+
+
+def get_e2e_batch_counts(ns_group_conf,chunk_size):
+    '''
+
+    :param ns_group_conf: ns_group configuration from get_e2e_fixture()
+    :param chunk_size: Maximum number of operations sent in one Nitro request
+    :return: Number of batches planned to apply the configuration to an empty NetScaler, and the fewest possible:
+             one batch per chunk_size operations of each resource type and action
+    '''
+    operations = apply_netscaler_state.get_ns_group_operations(apply_netscaler_state.new_ns_snapshot(),ns_group_conf)
+    batches = apply_netscaler_state.get_operation_batches(operations,chunk_size)
+    counts = Counter([(operation['resource_type'], operation['action']) for operation in operations])
+    return len(batches), sum([(count + chunk_size - 1) // chunk_size for count in counts.values()])
+
+
+def run_e2e_phase(appliance,ns_group_conf,args,state_cache=None):
+    '''
+
+    :param appliance: Dictionary from nitro_mock.new_mock_appliance()
+    :param ns_group_conf: ns_group configuration
+    :param args: argparse.Namespace from apply_netscaler_state.get_arguments()
+    :param state_cache: State cache dictionary (see apply_netscaler_state.load_state_cache()); None if disabled
+    :return: OrderedDict with the wall time in seconds, whether the phase succeeded and the mock request counters
+    '''
+    nitro_mock.reset_mock_stats(appliance)
+    start = time.time()
+    result = apply_netscaler_state.process_ns_group(ns_group_conf,args,state_cache)
+    seconds = time.time() - start
+    stats = nitro_mock.reset_mock_stats(appliance)
+    return OrderedDict([('seconds',seconds),('success',result['success']),('requests',stats['requests']),
+                        ('bytes',stats['request_bytes'] + stats['response_bytes'])])
+
+
+def benchmark_e2e(size,args,latency=0.0):
+    '''
+
+    :param size: Number of resources
+    :param args: argparse.Namespace from apply_netscaler_state.get_arguments()
+    :param latency: Seconds the mock adds to every request
+    :return: OrderedDict of phase name -> run_e2e_phase() result
+    '''
+    appliance = nitro_mock.new_mock_appliance(latency=latency)
+    server = nitro_mock.start_mock_server(appliance)
+    try:
+        ns_group_conf = get_e2e_fixture(size,server.get_ns_address())
+        # Operations of one type must stay together in the plan so they are sent in full batches
+        batches, fewest_batches = get_e2e_batch_counts(ns_group_conf,args.chunk_size)
+        assert batches <= fewest_batches, '{0} batches planned, {1} needed'.format(batches,fewest_batches)
+        phases = OrderedDict()
+        phases['apply_empty'] = run_e2e_phase(appliance,ns_group_conf,args)
+        phases['apply_noop'] = run_e2e_phase(appliance,ns_group_conf,args)
+        # The state cache is recorded by a run that changes nothing, so the next run skips the ns_group
+        state_cache = {}
+        apply_netscaler_state.process_ns_group(ns_group_conf,args,state_cache)
+        phases['apply_cached'] = run_e2e_phase(appliance,ns_group_conf,args,state_cache)
+        change_e2e_fixture(ns_group_conf)
+        phases['apply_delta'] = run_e2e_phase(appliance,ns_group_conf,args)
+        build_ns_group_conf = OrderedDict([('name','benchmark'),('ns_instance',ns_group_conf['ns_instance']),
+                                           ('build',True)])
+        phases['build'] = run_e2e_phase(appliance,build_ns_group_conf,args)
+    finally:
+        nitro_mock.stop_mock_server(server)
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks for apply_netscaler_state.py against a '
+                                                 'local Nitro mock')
+    parser.add_argument('--sizes', default='100,1000,10000,50000',
+                        help='comma separated list of numbers of resources (default: 100,1000,10000,50000)')
+    parser.add_argument('--chunk-size', type=int, default=100,
+                        help='--chunk-size passed to apply_netscaler_state.py (default: 100)')
+    parser.add_argument('--apply-workers', type=int, default=4,
+                        help='--apply-workers passed to apply_netscaler_state.py (default: 4)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the mock adds to every request (default: 0)')
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help='--page-size passed to apply_netscaler_state.py (default: 1000)')
+    args = parser.parse_args()
+    apply_netscaler_state.nitro_settings['page_size'] = max(args.page_size,0)
+
+    # Operation journals of the mock NetScalers are not kept
+    apply_args = apply_netscaler_state.get_arguments(['benchmark.yml','--chunk-size',str(args.chunk_size),
+                                                      '--apply-workers',str(args.apply_workers),
+                                                      '--journal-dir',tempfile.mkdtemp()])
+    ret = 0
+    print('{0:<12} {1:>8} {2:>10} {3:>9} {4:>12}'.format('phase','size','seconds','requests','bytes'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for name, phase in benchmark_e2e(size,apply_args,args.latency).items():
+            print('{0:<12} {1:>8} {2:>10.3f} {3:>9} {4:>12}{5}'.format(name,size,phase['seconds'],
+                                                                       phase['requests'],phase['bytes'],
+                                                                       '' if phase['success'] else ' FAILED'))
+            if not phase['success']:
+                ret = 1
+    return ret
+
+
+if __name__ == "__main__": sys.exit(main())
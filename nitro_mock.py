@@ -0,0 +1,719 @@
+'''
+Local stand-in for the Nitro configuration API of a NetScaler, for benchmarks and trials of apply_netscaler_state.py
+
+Serves the /nitro/v1/config endpoints used by apply_netscaler_state.py for the server, servicegroup, lbvserver,
+csvserver, cspolicy and csaction resource types and their bindings: login and logout, GET of a resource type, a
+resource or the bindings of a parent (including bulkbindings=yes, attrs=, count=yes and pages with pagesize= and
+pageno=), the lastconfigchangedtime of nsconfig, single adds (POST), updates and binds (PUT), deletes (DELETE) and
+renames, and bulk adds, updates, deletes and unbinds.  The configuration is kept in memory in plain tables of its
+own and changed following the NetScaler rules listed in apply_mock_resource(): a resource referenced by another
+cannot always be deleted, deleting a resource removes its bindings and renaming it keeps its bindings and references.  A
+GET without attrs also returns a sample of the read-only properties of the type, as a NetScaler does.
+
+Every request can be delayed by a fixed latency plus a random jitter, and failures can be injected for a fraction of
+the requests or for every write naming a resource that matches a pattern.  The number of requests and the bytes
+received and sent are counted.
+
+Usage: python nitro_mock.py [--address 127.0.0.1] [--port 8080] [--latency 0.05] [--failure-rate 0.01]
+
+The ns_instance address of an ns_group applied against the mock is the address and port, e.g. 127.0.0.1:8080.
+'''
+import sys
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from collections import OrderedDict
+
+# Nitro error responses returned by the mock
+mock_errors = {'no_resource':{'errorcode':258,'message':'No such resource','status':404},
+               'exists':{'errorcode':273,'message':'Resource already exists','status':409},
+               'invalid':{'errorcode':278,'message':'Invalid argument','status':400},
+               'address_in_use':{'errorcode':304,'message':'Address already in use','status':409},
+               'in_use':{'errorcode':1853,'message':'Resource is referenced by another resource','status':409},
+               'fixed':{'errorcode':1097,'message':'Property cannot be changed','status':400},
+               'login':{'errorcode':354,'message':'Invalid username or password','status':401},
+               'session':{'errorcode':444,'message':'Session expired or killed','status':401},
+               'bulk':{'errorcode':1243,'message':'Bulk operation failed','status':200},
+               'injected':{'errorcode':599,'message':'Injected failure','status':503}
+               }
+
+# Read-only and default properties a NetScaler returns with every resource or binding of a type unless a GET asks
+# for specific attributes (attrs=); a sample of the real fields so responses are of a realistic size
+mock_read_only_options = {'server':{'state':'ENABLED','td':'0','translationip':'0.0.0.0','translationmask':'0.0.0.0',
+                                    'domainresolveretry':5,'ipv6address':'NO','statechangetimesec':'Thu Jan  1 00:00:00 2015',
+                                    'tickssincelaststatechange':'0','graceful':'NO','internal':False,'comment':''},
+                          'servicegroup':{'maxclient':'0','maxreq':'0','cacheable':'NO','cip':'DISABLED','usip':'NO',
+                                          'useproxyport':'YES','sp':'OFF','rtspsessionidremap':'OFF','clttimeout':180,
+                                          'svrtimeout':360,'cka':'NO','tcpb':'NO','cmp':'NO','maxbandwidth':'0',
+                                          'state':'ENABLED','servicegroupeffectivestate':'UP',
+                                          'downstateflush':'ENABLED','monthreshold':'0','appflowlog':'ENABLED',
+                                          'numofconnections':0,'td':'0'},
+                          'lbvserver':{'lbmethod':'LEASTCONNECTION','persistencetype':'NONE','timeout':2,
+                                       'clttimeout':180,'curstate':'UP','effectivestate':'UP','status':1,
+                                       'lbrspstate':'DISABLED','health':'100','totalservices':'1','activeservices':'1',
+                                       'statechangetimesec':'Thu Jan  1 00:00:00 2015','tickssincelaststatechange':'0',
+                                       'range':'1','m':'IP','sessionless':'DISABLED','redirectportrewrite':'DISABLED',
+                                       'downstateflush':'ENABLED','disableprimaryondown':'DISABLED',
+                                       'insertvserveripport':'OFF','icmpvsrresponse':'PASSIVE','rhistate':'PASSIVE',
+                                       'cookiename':'','appflowlog':'ENABLED','td':'0','version':0,'ipmask':'*',
+                                       'hits':'0','pushvserver':'','macmoderetainvlan':'DISABLED'},
+                          'csvserver':{'curstate':'UP','status':1,'cacheable':'NO',
+                                       'statechangetimesec':'Thu Jan  1 00:00:00 2015','tickssincelaststatechange':'0',
+                                       'range':'1','clttimeout':180,'icmpvsrresponse':'PASSIVE','rhistate':'PASSIVE',
+                                       'redirectportrewrite':'DISABLED','downstateflush':'ENABLED',
+                                       'disableprimaryondown':'DISABLED','insertvserveripport':'OFF',
+                                       'appflowlog':'ENABLED','td':'0','ipmask':'*','precedence':'RULE',
+                                       'casesensitive':'ON','sopersistence':'DISABLED','stateupdate':'DISABLED',
+                                       'push':'DISABLED','l2conn':'OFF','mssqlserverversion':'2008R2'},
+                          'cspolicy':{'cspolicytype':'Advanced Policy','hits':'0','activepolicy':0,'priority':'0'},
+                          'csaction':{'hits':'0','referencecount':'0','undefhits':'0','builtin':['IMMUTABLE']},
+                          'servicegroup_servicegroupmember_binding':{'svrstate':'UP',
+                                                                     'statechangetimesec':'Thu Jan  1 00:00:00 2015',
+                                                                     'tickssincelaststatechange':'0','weight':'1',
+                                                                     'customserverid':'None','serverid':'0',
+                                                                     'state':'ENABLED','hashid':'0','graceful':'NO',
+                                                                     'delay':0},
+                          'lbvserver_servicegroup_binding':{'stateflag':'536936451'},
+                          'csvserver_lbvserver_binding':{'stateflag':'536936451','hits':'0'},
+                          'csvserver_cspolicy_binding':{'hits':'0','pipolicyhits':'0','gotopriorityexpression':'END',
+                                                        'bindpoint':'REQUEST','labeltype':'','invoke':False}
+                          }
+
+# Resource types served by the mock: the name property, the properties a NetScaler does not allow to change after
+# the resource is added ('fixed'), the properties forming its address and the address space it is unique in
+# ('address', 'address_space'; lbvservers and csvservers share one), the properties naming another resource
+# ('references': property -> resource type) and those of them that keep the named resource from being deleted
+# ('protects')
+mock_resource_types = OrderedDict([('server',{'name':'name','fixed':[],'address':['ipaddress'],
+                                              'address_space':'server','references':{},'protects':[]}),
+                                   ('servicegroup',{'name':'servicegroupname','fixed':['servicetype'],'address':[],
+                                                    'address_space':None,'references':{},'protects':[]}),
+                                   ('lbvserver',{'name':'name','fixed':['servicetype','port'],
+                                                 'address':['ipv46','port'],'address_space':'vserver',
+                                                 'references':{},'protects':[]}),
+                                   ('csvserver',{'name':'name','fixed':['servicetype','port'],
+                                                 'address':['ipv46','port'],'address_space':'vserver',
+                                                 'references':{},'protects':[]}),
+                                   ('cspolicy',{'name':'policyname','fixed':[],'address':[],'address_space':None,
+                                                'references':{'action':'csaction'},'protects':['action']}),
+                                   ('csaction',{'name':'name','fixed':[],'address':[],'address_space':None,
+                                                'references':{'targetlbvserver':'lbvserver'},'protects':[]})
+                                   ])
+
+# Binding types served by the mock: the parent and target resource types and properties, and the properties that
+# identify a binding of a parent besides the parent name.  A parent holds at most one binding of a type without key
+# properties; binding again replaces it.
+mock_binding_types = OrderedDict([('servicegroup_servicegroupmember_binding',
+                                   {'parent':'servicegroup','parent_property':'servicegroupname',
+                                    'target':'server','target_property':'servername','key':['servername','port']}),
+                                  ('lbvserver_servicegroup_binding',
+                                   {'parent':'lbvserver','parent_property':'name',
+                                    'target':'servicegroup','target_property':'servicegroupname',
+                                    'key':['servicegroupname']}),
+                                  ('csvserver_cspolicy_binding',
+                                   {'parent':'csvserver','parent_property':'name',
+                                    'target':'cspolicy','target_property':'policyname','key':['policyname']}),
+                                  ('csvserver_lbvserver_binding',
+                                   {'parent':'csvserver','parent_property':'name',
+                                    'target':'lbvserver','target_property':'lbvserver','key':[]})
+                                  ])
+
+nitro_config_path = '/nitro/v1/config'
+
+
+class NitroMockError(Exception):
+    def __init__(self, error, detail=None):
+        self.error = mock_errors[error]
+        message = self.error['message'] if detail is None else '{}: {}'.format(self.error['message'],detail)
+        super(NitroMockError, self).__init__(message)
+
+
+def new_mock_appliance(user='nsroot',password='nsroot',latency=0.0,jitter=0.0,failure_rate=0.0,fail_pattern=None,
+                       seed=None):
+    '''
+
+    :param user: Nitro user name accepted at login
+    :param password: Nitro password accepted at login
+    :param latency: Seconds added to every request
+    :param jitter: Maximum random seconds added to every request on top of latency
+    :param failure_rate: Fraction of requests, other than login and logout, answered with an injected failure
+    :param fail_pattern: Regular expression; every add, update, rename or delete of a resource or binding with a
+                         name property matching it fails; None to disable
+    :param seed: Seed of the random generator used for jitter and injected failures; None for a random seed
+    :return: Dictionary holding the configuration (see new_mock_config()), sessions, settings and counters of one
+             mock NetScaler, and the time of its last configuration change
+    '''
+    return {'config':new_mock_config(),
+            'sessions':set(),
+            'lock':threading.Lock(),
+            'random':random.Random(seed),
+            'settings':{'user':user,'password':password,'latency':latency,'jitter':jitter,
+                        'failure_rate':failure_rate,
+                        'fail_pattern':re.compile(fail_pattern) if fail_pattern is not None else None},
+            'stats':new_mock_stats(),
+            'config_changed':get_mock_change_time()}
+
+
+def new_mock_config():
+    '''
+
+    :return: Empty mock NetScaler configuration:
+             - 'resources': resource type -> OrderedDict of name -> options
+             - 'bindings': binding type -> OrderedDict of binding id (see get_mock_binding_id()) -> options
+             - 'addresses': (address space, address values) -> (resource type, name) of the resource using it
+    '''
+    return {'resources':OrderedDict([(resource_type, OrderedDict()) for resource_type in mock_resource_types]),
+            'bindings':OrderedDict([(binding_type, OrderedDict()) for binding_type in mock_binding_types]),
+            'addresses':{}}
+
+
+def get_mock_change_time():
+    '''
+
+    :return: Current time in the format of the lastconfigchangedtime property of nsconfig
+    '''
+    return time.strftime('%a %b %d %H:%M:%S %Y')
+
+
+def new_mock_stats():
+    '''
+
+    :return: Dictionary of request counters: requests by HTTP method, total requests, request bytes (URL and body)
+             and response bytes (body)
+    '''
+    return OrderedDict([('requests',0),('GET',0),('POST',0),('PUT',0),('DELETE',0),
+                        ('request_bytes',0),('response_bytes',0)])
+
+
+def reset_mock_stats(appliance):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :return: Counters before the reset
+    '''
+    with appliance['lock']:
+        stats = appliance['stats']
+        appliance['stats'] = new_mock_stats()
+    return stats
+
+
+def get_mock_resource_options(resource_type,options,attrs=None):
+    '''
+
+    :param resource_type: Nitro resource or binding type
+    :param options: Dictionary of Nitro options held in the mock configuration
+    :param attrs: List of the properties requested (attrs=); None for every property
+    :return: Dictionary of the options as returned by a GET, with the read-only properties of the type
+    '''
+    resource_options = dict(mock_read_only_options.get(resource_type,{}))
+    resource_options.update(options)
+    if attrs is None:
+        return resource_options
+    return dict([(attr, resource_options[attr]) for attr in attrs if attr in resource_options])
+
+
+def get_mock_resources(appliance,resource_type,name=None,attrs=None):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param resource_type: Nitro resource or binding type
+    :param name: Resource name, or parent resource name for a binding type; None for every resource or binding
+    :param attrs: List of the properties requested (attrs=); None for every property
+    :return: List of Nitro option dictionaries
+    '''
+    config = appliance['config']
+    if resource_type in mock_binding_types:
+        parent_property = mock_binding_types[resource_type]['parent_property']
+        return [get_mock_resource_options(resource_type,options,attrs)
+                for options in config['bindings'][resource_type].values()
+                if name is None or options[parent_property] == name]
+    if resource_type not in mock_resource_types:
+        raise NitroMockError('invalid','resource type {}'.format(resource_type))
+    if name is not None:
+        options = config['resources'][resource_type].get(name)
+        if options is None:
+            raise NitroMockError('no_resource',name)
+        return [get_mock_resource_options(resource_type,options,attrs)]
+    return [get_mock_resource_options(resource_type,options,attrs)
+            for options in config['resources'][resource_type].values()]
+
+
+def get_mock_binding_id(binding_type,options):
+    '''
+
+    :param binding_type: Nitro binding type listed in mock_binding_types
+    :param options: Dictionary of Nitro options of a binding
+    :return: Tuple of the parent name and key property values identifying the binding; None if one is missing
+    '''
+    binding = mock_binding_types[binding_type]
+    values = [options.get(binding['parent_property'])] + [options.get(key) for key in binding['key']]
+    if None in values:
+        return None
+    return tuple([str(value) for value in values])
+
+
+def get_mock_address(resource_type,options):
+    '''
+
+    :param resource_type: Nitro resource type listed in mock_resource_types
+    :param options: Dictionary of Nitro options of a resource
+    :return: Tuple of the address space and address values of the resource; None if it has no address
+    '''
+    resource = mock_resource_types[resource_type]
+    values = [options.get(property) for property in resource['address']]
+    if resource['address_space'] is None or None in values:
+        return None
+    return (resource['address_space'],tuple([str(value) for value in values]))
+
+
+def check_mock_fail_pattern(appliance,options):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param options: Dictionary of Nitro options sent in a write request
+    :return: None; raises NitroMockError if a value matches the fail pattern
+    '''
+    fail_pattern = appliance['settings']['fail_pattern']
+    if fail_pattern is not None:
+        for value in options.values():
+            if isinstance(value,basestring) and fail_pattern.search(value):
+                raise NitroMockError('injected',value)
+    return None
+
+
+def apply_mock_binding(appliance,action,binding_type,options):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param action: 'add' or 'delete'
+    :param binding_type: Nitro binding type listed in mock_binding_types
+    :param options: Dictionary of Nitro options sent in the request
+    :return: None; raises NitroMockError if the request would fail on a NetScaler
+
+    Binding requires the parent and the target to exist.  A binding type without key properties holds one binding
+    per parent, which binding again replaces.
+    '''
+    config = appliance['config']
+    binding = mock_binding_types[binding_type]
+    bindings = config['bindings'][binding_type]
+    parent_name = options.get(binding['parent_property'])
+    if parent_name is None:
+        raise NitroMockError('invalid','{} requires {}'.format(binding_type,binding['parent_property']))
+    if parent_name not in config['resources'][binding['parent']]:
+        raise NitroMockError('no_resource',parent_name)
+    binding_id = get_mock_binding_id(binding_type,options)
+    if binding_id is None:
+        raise NitroMockError('invalid','{} requires {}'.format(binding_type,', '.join(binding['key'])))
+    if action == 'delete':
+        if binding_id not in bindings:
+            raise NitroMockError('no_resource',' '.join(binding_id))
+        del bindings[binding_id]
+        return None
+    target_name = options.get(binding['target_property'])
+    if target_name not in config['resources'][binding['target']]:
+        raise NitroMockError('no_resource',target_name)
+    if binding_id in bindings and len(binding['key']) > 0:
+        raise NitroMockError('exists',' '.join(binding_id))
+    bindings[binding_id] = dict(options)
+    return None
+
+
+def get_mock_referrers(appliance,resource_type,name,protecting=False):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param resource_type: Nitro resource type listed in mock_resource_types
+    :param name: Resource name
+    :param protecting: True to only return the references that keep the resource from being deleted
+    :return: List of (resource type, name, property) of the resources with a property naming the resource
+    '''
+    referrers = []
+    for referring_type, referring in mock_resource_types.items():
+        for property, referenced_type in referring['references'].items():
+            if referenced_type == resource_type and (not protecting or property in referring['protects']):
+                for referring_name, options in appliance['config']['resources'][referring_type].items():
+                    if options.get(property) == name:
+                        referrers.append((referring_type,referring_name,property))
+    return referrers
+
+
+def apply_mock_resource(appliance,action,resource_type,options):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param action: 'add', 'update', 'rename' or 'delete'
+    :param resource_type: Nitro resource type listed in mock_resource_types
+    :param options: Dictionary of Nitro options sent in the request
+    :return: None; raises NitroMockError if the request would fail on a NetScaler
+
+    The mock follows these NetScaler rules:
+    - names are unique per resource type; server addresses are unique among servers, and VIP and port among
+      lbvservers and csvservers together
+    - the service type of service groups and vservers and the port of vservers cannot be updated
+    - a CS action cannot be deleted while a CS policy uses it; a CS action refers to its target lbvserver by name
+      only, so the lbvserver can be deleted and added again under it
+    - the bindings of a deleted resource, as parent or as target, are removed with it
+    - renaming a resource keeps its bindings and the references to it
+    '''
+    config = appliance['config']
+    resource = mock_resource_types[resource_type]
+    resources = config['resources'][resource_type]
+    name = options.get(resource['name'])
+    if name is None:
+        raise NitroMockError('invalid','{} requires {}'.format(resource_type,resource['name']))
+    existing_options = resources.get(name)
+    if action == 'add' and existing_options is not None:
+        raise NitroMockError('exists',name)
+    if action != 'add' and existing_options is None:
+        raise NitroMockError('no_resource',name)
+
+    if action in ['add','update']:
+        if action == 'update':
+            for property in resource['fixed']:
+                if property in options and str(options[property]) != str(existing_options.get(property)):
+                    raise NitroMockError('fixed','{} of {}'.format(property,name))
+        for property, referenced_type in resource['references'].items():
+            if options.get(property) is not None and options[property] not in config['resources'][referenced_type]:
+                raise NitroMockError('no_resource',options[property])
+        new_options = dict(existing_options or {})
+        new_options.update(options)
+        old_address = get_mock_address(resource_type,existing_options or {})
+        address = get_mock_address(resource_type,new_options)
+        if address is not None and config['addresses'].get(address,(resource_type,name)) != (resource_type,name):
+            raise NitroMockError('address_in_use','{} is used by {}'.format(' '.join(address[1]),
+                                                                            config['addresses'][address][1]))
+        config['addresses'].pop(old_address,None)
+        if address is not None:
+            config['addresses'][address] = (resource_type,name)
+        resources[name] = new_options
+    elif action == 'delete':
+        referrers = get_mock_referrers(appliance,resource_type,name,True)
+        if len(referrers) > 0:
+            raise NitroMockError('in_use','{} is referenced by {} {}'.format(name,*referrers[0][:2]))
+        config['addresses'].pop(get_mock_address(resource_type,existing_options),None)
+        del resources[name]
+        for binding_type, binding in mock_binding_types.items():
+            for binding_id, binding_options in list(config['bindings'][binding_type].items()):
+                if (binding['parent'] == resource_type and binding_options[binding['parent_property']] == name) or \
+                   (binding['target'] == resource_type and binding_options[binding['target_property']] == name):
+                    del config['bindings'][binding_type][binding_id]
+    elif action == 'rename':
+        new_name = options.get('newname')
+        if new_name is None:
+            raise NitroMockError('invalid','rename requires newname')
+        if new_name in resources:
+            raise NitroMockError('exists',new_name)
+        renamed_options = dict(existing_options)
+        renamed_options[resource['name']] = new_name
+        # Keeps the position of the resource, so pages read before and after the rename do not shift
+        config['resources'][resource_type] = OrderedDict([(new_name if key == name else key,
+                                                           renamed_options if key == name else value)
+                                                          for key, value in resources.items()])
+        address = get_mock_address(resource_type,existing_options)
+        if address is not None:
+            config['addresses'][address] = (resource_type,new_name)
+        for referring_type, referring_name, property in get_mock_referrers(appliance,resource_type,name):
+            config['resources'][referring_type][referring_name][property] = new_name
+        for binding_type, binding in mock_binding_types.items():
+            renamed_bindings = OrderedDict()
+            for binding_options in config['bindings'][binding_type].values():
+                if binding['parent'] == resource_type and binding_options[binding['parent_property']] == name:
+                    binding_options[binding['parent_property']] = new_name
+                if binding['target'] == resource_type and binding_options[binding['target_property']] == name:
+                    binding_options[binding['target_property']] = new_name
+                renamed_bindings[get_mock_binding_id(binding_type,binding_options)] = binding_options
+            config['bindings'][binding_type] = renamed_bindings
+    return None
+
+
+def apply_mock_item(appliance,action,resource_type,options):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param action: 'add', 'update', 'rename' or 'delete'
+    :param resource_type: Nitro resource or binding type
+    :param options: Dictionary of Nitro options sent in the request
+    :return: None; raises NitroMockError if the request would fail on a NetScaler
+    '''
+    check_mock_fail_pattern(appliance,options)
+    if resource_type in mock_binding_types:
+        if action not in ['add','delete']:
+            raise NitroMockError('invalid','{} of {}'.format(action,resource_type))
+        apply_mock_binding(appliance,action,resource_type,options)
+    elif resource_type in mock_resource_types:
+        apply_mock_resource(appliance,action,resource_type,options)
+    else:
+        raise NitroMockError('invalid','resource type {}'.format(resource_type))
+    appliance['config_changed'] = get_mock_change_time()
+    return None
+
+
+def apply_mock_request(appliance,action,resource_type,resources):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param action: 'add', 'update', 'rename' or 'delete'
+    :param resource_type: Nitro resource or binding type
+    :param resources: Dictionary of Nitro options, or a list of them for a bulk request
+    :return: Nitro response dictionary
+
+    Bulk requests are applied in item order and continue after an error, as with onerror=continue, and report the
+    outcome of every item.
+    '''
+    if not isinstance(resources,list):
+        apply_mock_item(appliance,action,resource_type,resources)
+        return {'errorcode':0,'message':'Done','severity':'NONE'}
+    item_responses = []
+    for options in resources:
+        try:
+            apply_mock_item(appliance,action,resource_type,options)
+            item_responses.append({'errorcode':0,'message':'Done','severity':'NONE'})
+        except NitroMockError as error:
+            item_responses.append({'errorcode':error.error['errorcode'],'message':str(error),'severity':'ERROR'})
+    if all([item_response['errorcode'] == 0 for item_response in item_responses]):
+        return {'errorcode':0,'message':'Done','severity':'NONE'}
+    error = mock_errors['bulk']
+    return {'errorcode':error['errorcode'],'message':error['message'],'severity':'ERROR','response':item_responses}
+
+
+def get_delete_options(resource_type,path,query):
+    '''
+
+    :param resource_type: Nitro resource or binding type
+    :param path: List of the URL path segments after the resource type
+    :param query: Dictionary of URL query parameters from urlparse.parse_qs()
+    :return: Dictionary of Nitro options identifying the deleted resource or binding
+
+    The options are taken from the args query parameter (name:value pairs separated by commas) and the name in the
+    URL path.  For a binding, the path holds the parent name and optionally the bound server name.
+    '''
+    options = {}
+    for argument in query.get('args',[''])[0].split(','):
+        if ':' in argument:
+            name, value = argument.split(':',1)
+            options[name] = urllib.unquote_plus(value)
+    if resource_type in mock_binding_types:
+        binding = mock_binding_types[resource_type]
+        if len(path) > 0:
+            options[binding['parent_property']] = path[0]
+        if len(path) > 1:
+            options[binding['target_property']] = path[1]
+    elif len(path) > 0 and resource_type in mock_resource_types:
+        options[mock_resource_types[resource_type]['name']] = path[0]
+    return options
+
+
+def handle_mock_request(appliance,method,url,body,cookie):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param method: HTTP method
+    :param url: Request URL path and query
+    :param body: Request body
+    :param cookie: Value of the Cookie request header; None if missing
+    :return: Tuple of the HTTP status and the Nitro response dictionary
+    '''
+    split_url = urlparse.urlsplit(url)
+    query = urlparse.parse_qs(split_url.query)
+    if not split_url.path.startswith(nitro_config_path):
+        raise NitroMockError('invalid','unknown URL {}'.format(split_url.path))
+    path = [urllib.unquote(segment) for segment in split_url.path[len(nitro_config_path):].split('/') if segment != '']
+
+    payload = {}
+    if method == 'POST':
+        payload = json.loads(urlparse.parse_qs(body).get('object',['{}'])[0])
+    elif method == 'PUT':
+        payload = json.loads(body)
+    params = payload.pop('params',{})
+    session = payload.pop('sessionid',None)
+    resource_types = list(payload.keys())
+
+    if method == 'POST' and resource_types == ['login']:
+        login = payload['login']
+        settings = appliance['settings']
+        if login.get('username') != settings['user'] or login.get('password') != settings['password']:
+            raise NitroMockError('login')
+        session = '{:032x}'.format(appliance['random'].getrandbits(128))
+        appliance['sessions'].add(session)
+        return 201, {'errorcode':0,'message':'Done','severity':'NONE','sessionid':session}
+
+    if cookie is not None:
+        for item in cookie.split(';'):
+            if item.strip().startswith('sessionid='):
+                session = item.strip()[len('sessionid='):]
+    if session not in appliance['sessions']:
+        raise NitroMockError('session')
+    if method == 'POST' and resource_types == ['logout']:
+        appliance['sessions'].discard(session)
+        return 201, {'errorcode':0,'message':'Done','severity':'NONE'}
+
+    failure_rate = appliance['settings']['failure_rate']
+    if failure_rate > 0 and appliance['random'].random() < failure_rate:
+        raise NitroMockError('injected')
+
+    if method in ['GET','DELETE']:
+        if len(path) == 0:
+            raise NitroMockError('invalid','resource type required')
+        resource_type = path[0]
+        if method == 'GET' and resource_type == 'nsconfig':
+            return 200, {'errorcode':0,'message':'Done','severity':'NONE',
+                         'nsconfig':{'lastconfigchangedtime':appliance['config_changed']}}
+        if method == 'GET':
+            name = path[1] if len(path) > 1 else None
+            attrs = query['attrs'][0].split(',') if 'attrs' in query else None
+            resources = get_mock_resources(appliance,resource_type,name,attrs)
+            response = {'errorcode':0,'message':'Done','severity':'NONE'}
+            if query.get('count') == ['yes']:
+                response[resource_type] = [{'__count':len(resources)}]
+                return 200, response
+            if 'pagesize' in query:
+                page_size = int(query['pagesize'][0])
+                page = int(query.get('pageno',['1'])[0])
+                if page_size < 1 or page < 1:
+                    raise NitroMockError('invalid','pagesize {} pageno {}'.format(page_size,page))
+                resources = resources[(page - 1) * page_size:page * page_size]
+            if len(resources) > 0:
+                response[resource_type] = resources
+            return 200, response
+        return 200, apply_mock_request(appliance,'delete',resource_type,
+                                       get_delete_options(resource_type,path[1:],query))
+
+    if len(resource_types) != 1:
+        raise NitroMockError('invalid','one resource type required')
+    resource_type = resource_types[0]
+    resources = payload[resource_type]
+    action = query.get('action',[params.get('action')])[0]
+    if method == 'PUT':
+        action = 'add' if resource_type in mock_binding_types else 'update'
+    elif action in ['rm','unbind']:
+        action = 'delete'
+    elif action is None:
+        action = 'add'
+    elif action != 'rename':
+        raise NitroMockError('invalid','action {}'.format(action))
+    response = apply_mock_request(appliance,action,resource_type,resources)
+    return 201 if method == 'POST' and response['errorcode'] == 0 else 200, response
+
+
+class NitroMockRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        appliance = self.server.appliance
+        body = self.rfile.read(int(self.headers.get('Content-Length',0)))
+        settings = appliance['settings']
+        delay = settings['latency']
+        if settings['jitter'] > 0:
+            delay += appliance['random'].uniform(0,settings['jitter'])
+        if delay > 0:
+            time.sleep(delay)
+        with appliance['lock']:
+            try:
+                status, response = handle_mock_request(appliance,self.command,self.path,body,
+                                                       self.headers.get('Cookie'))
+            except NitroMockError as error:
+                status = error.error['status']
+                response = {'errorcode':error.error['errorcode'],'message':str(error),'severity':'ERROR'}
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                status = mock_errors['invalid']['status']
+                response = {'errorcode':mock_errors['invalid']['errorcode'],
+                            'message':'Invalid request: {}'.format(error),'severity':'ERROR'}
+            data = json.dumps(response)
+            stats = appliance['stats']
+            stats['requests'] += 1
+            stats[self.command] += 1
+            stats['request_bytes'] += len(self.path) + len(body)
+            stats['response_bytes'] += len(data)
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+    do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        # Requests are counted in the appliance stats instead of logged
+        return None
+
+
+class NitroMockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, appliance):
+        BaseHTTPServer.HTTPServer.__init__(self,server_address,NitroMockRequestHandler)
+        self.appliance = appliance
+
+    def get_ns_address(self):
+        return '{}:{}'.format(*self.server_address[:2])
+
+
+def start_mock_server(appliance,address='127.0.0.1',port=0):
+    '''
+
+    :param appliance: Dictionary from new_mock_appliance()
+    :param address: Address to listen on
+    :param port: Port to listen on; 0 for any free port
+    :return: NitroMockServer serving the appliance from a background thread; see get_ns_address() for the
+             ns_instance address to use
+    '''
+    server = NitroMockServer((address,port),appliance)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def stop_mock_server(server):
+    '''
+
+    :param server: NitroMockServer from start_mock_server()
+    :return: None
+    '''
+    server.shutdown()
+    server.server_close()
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Nitro API of a NetScaler')
+    parser.add_argument('--address', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on (default: 8080)')
+    parser.add_argument('--user', default='nsroot', help='user name accepted at login (default: nsroot)')
+    parser.add_argument('--password', default='nsroot', help='password accepted at login (default: nsroot)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='maximum random seconds added to every request on top of --latency (default: 0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of requests answered with an injected failure (default: 0)')
+    parser.add_argument('--fail-pattern', help='fail every write naming a resource that matches this regular '
+                                               'expression')
+    parser.add_argument('--seed', type=int, help='seed for the jitter and injected failures')
+    args = parser.parse_args()
+
+    appliance = new_mock_appliance(args.user,args.password,args.latency,args.jitter,args.failure_rate,
+                                   args.fail_pattern,args.seed)
+    server = NitroMockServer((args.address,args.port),appliance)
+    print('Serving the Nitro API on {}'.format(server.get_ns_address()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(appliance['stats']))
+    return 0
+
+
+if __name__ == "__main__": sys.exit(main())
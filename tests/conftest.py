@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import apply_netscaler_state
+import nitro_mock
+
+
+@pytest.fixture
+def mock_ns():
+    '''
+
+    :return: (appliance, address) of a mock NetScaler served for the test; see nitro_mock.new_mock_appliance()
+    '''
+    appliance = nitro_mock.new_mock_appliance()
+    server = nitro_mock.start_mock_server(appliance)
+    try:
+        yield appliance, server.get_ns_address()
+    finally:
+        apply_netscaler_state.close_journals()
+        nitro_mock.stop_mock_server(server)
+
+
+@pytest.fixture
+def args(tmpdir):
+    '''
+
+    :return: argparse.Namespace from apply_netscaler_state.get_arguments() applying every change on its own, with
+             the journal in the temporary directory of the test
+    '''
+    return apply_netscaler_state.get_arguments([str(tmpdir.join('ns.yml')),'--journal-dir',str(tmpdir),
+                                                '--chunk-size','1','--apply-workers','1'])
@@ -0,0 +1,50 @@
+import time
+import pytest
+import apply_netscaler_state
+
+
+def test_concurrent_backup_in_config_order(tmpdir,monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    names = ['first','second','third','fourth']
+    ns_groups = [{'name':name,'ns_instance':{'address':'127.0.0.1:8080','user':'nsroot','pass':'nsroot'}}
+                 for name in names]
+    args = apply_netscaler_state.get_arguments(['ns.yml','--workers','4'])
+
+    def process_ns_group(ns_group,args,state_cache=None):
+        # The ns_groups complete in reverse order
+        time.sleep(0.1 * (len(names) - names.index(ns_group['name'])))
+        return {'backup':{'name':ns_group['name']},'build':False,'success':True,'changes':0}
+
+    monkeypatch.setattr(apply_netscaler_state,'process_ns_group',process_ns_group)
+    backup = apply_netscaler_state.open_backup(str(tmpdir.join('backup.yml')))
+    results = apply_netscaler_state.process_ns_groups(ns_groups,args,None,backup)
+    assert apply_netscaler_state.close_backup(backup)
+    assert all([result['success'] and result['backup'] is None for result in results])
+    conf = apply_netscaler_state.get_config(str(tmpdir.join('backup.yml')))
+    assert [ns_group['name'] for ns_group in conf['ns_groups']] == names
+
+
+@pytest.mark.parametrize('filename', ['backup.yml','backup.jsonl.gz'])
+def test_interrupted_backup_loads(tmpdir,filename):
+    backup = apply_netscaler_state.open_backup(str(tmpdir.join(filename)))
+    for name in ['first','second']:
+        assert apply_netscaler_state.append_backup(backup,{'name':name,'servers':[{'name':'s0',
+                                                                                  'ip_address':'10.0.0.1'}]})
+    # Until the backup is closed, the ns_groups written so far are in the .partial file
+    assert not tmpdir.join(filename).exists()
+    conf = apply_netscaler_state.get_config(str(tmpdir.join(filename + '.partial')))
+    assert [ns_group['name'] for ns_group in conf['ns_groups']] == ['first','second']
+
+
+def test_compact_config_converts_back_to_yaml(tmpdir):
+    conf = {'ns_groups':[{'name':'web','ns_instance':{'address':'192.0.2.10','user':'nsroot','pass':'nsroot'},
+                          'servers':[{'name':'s0','ip_address':'10.0.0.1'}],
+                          'csvservers':[{'name':'cs','vip_address':'172.16.0.2','port':80,'protocol':'HTTP',
+                                         'default_lbvserver':'lb','policy_bindings':[{'name':'p','priority':100}]}]}]}
+    compact_filename = str(tmpdir.join('ns.jsonl.gz'))
+    assert apply_netscaler_state.update_config(conf,compact_filename)
+    assert apply_netscaler_state.get_config(compact_filename) == conf
+    assert [ns_group['name'] for ns_group in apply_netscaler_state.get_config_ns_groups(compact_filename)] == ['web']
+    assert apply_netscaler_state.update_config(apply_netscaler_state.get_config(compact_filename),
+                                               str(tmpdir.join('ns.yml')))
+    assert apply_netscaler_state.get_config(str(tmpdir.join('ns.yml'))) == conf
@@ -0,0 +1,40 @@
+import apply_netscaler_state
+
+
+def test_bulk_failures_are_reported_per_operation(monkeypatch):
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    operations = [apply_netscaler_state.new_operation('add','server','s{}'.format(i),
+                                                      {'name':'s{}'.format(i),'ipaddress':'10.0.0.{}'.format(i)})
+                  for i in range(3)]
+    sent = []
+
+    def send_bulk_operations(nitro,operations):
+        sent.append(len(operations))
+        return [None,'Resource already exists',None]
+
+    monkeypatch.setattr(apply_netscaler_state,'send_bulk_operations',send_bulk_operations)
+    assert not apply_netscaler_state.apply_operation_batch(None,snapshot,operations)
+    assert sent == [3]
+    # Only the operations that succeeded are applied to the snapshot
+    assert list(snapshot['resources']['server'].keys()) == ['s0','s2']
+
+
+def test_renames_are_sent_on_their_own():
+    operations = [apply_netscaler_state.new_operation('rename','lbvserver','lb{}'.format(i),
+                                                      {'name':'lb{}'.format(i),'newname':'lb{}'.format(i + 1)})
+                  for i in range(3)]
+    assert [len(batch) for batch in apply_netscaler_state.get_operation_batches(operations,100)] == [1,1,1]
+
+
+def test_address_moves_are_sent_on_their_own():
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    for i in range(3):
+        apply_netscaler_state.add_resource_to_snapshot(snapshot,'server',{'name':'s{}'.format(i),
+                                                                           'ipaddress':'10.0.0.{}'.format(i + 1)})
+    # Each server moves to the address of the next one, which must move first
+    ns_group_conf = {'name':'moves','servers':[{'name':'s{}'.format(i),'ip_address':'10.0.0.{}'.format(i + 2)}
+                                               for i in range(3)]}
+    operations = apply_netscaler_state.get_ns_group_operations(snapshot,ns_group_conf)
+    assert [(operation['action'],operation['name']) for operation in operations] == \
+        [('update','s2'),('update','s1'),('update','s0')]
+    assert [len(batch) for batch in apply_netscaler_state.get_operation_batches(operations,100)] == [1,1,1]
@@ -0,0 +1,51 @@
+import json
+import pytest
+import apply_netscaler_state
+import benchmark_e2e
+import nitro_mock
+from nsnitro.nsexceptions import NSNitroError, NSNitroExceptionClassMap
+
+
+def test_replay_repeats_a_recorded_run_offline(args,tmpdir,monkeypatch):
+    filename = str(tmpdir.join('run.jsonl.gz'))
+    appliance = nitro_mock.new_mock_appliance()
+    server = nitro_mock.start_mock_server(appliance)
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(20,server.get_ns_address())
+    cassette = apply_netscaler_state.open_cassette(filename,'record')
+    monkeypatch.setitem(apply_netscaler_state.nitro_settings,'cassette',cassette)
+    try:
+        assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    finally:
+        nitro_mock.stop_mock_server(server)
+    assert apply_netscaler_state.close_cassette(cassette)
+    assert len(cassette['interactions']) == appliance['stats']['requests']
+    assert 'nsroot' not in json.dumps(cassette['interactions'])
+
+    # The mock NetScaler is gone; every request is answered from the cassette
+    cassette = apply_netscaler_state.open_cassette(filename,'replay')
+    monkeypatch.setitem(apply_netscaler_state.nitro_settings,'cassette',cassette)
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    assert apply_netscaler_state.close_cassette(cassette)
+    assert cassette['replayed'] == appliance['stats']['requests']
+
+    # A request missing from the cassette fails the replay
+    cassette = apply_netscaler_state.open_cassette(filename,'replay')
+    monkeypatch.setitem(apply_netscaler_state.nitro_settings,'cassette',cassette)
+    ns_group_conf['servers'][0]['ip_address'] = '10.9.9.9'
+    assert not apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    assert not apply_netscaler_state.close_cassette(cassette)
+
+
+@pytest.mark.parametrize('errorcode', [258,1853])
+def test_replayed_errors_raise_like_live_errors(tmpdir,errorcode):
+    mapped = errorcode in NSNitroExceptionClassMap
+    interaction = {'ns_group':'replay','verb':'DELETE','url':'csaction/a0','body':None,
+                   'error':{'message':'recorded failure','errorcode':errorcode}}
+    tmpdir.join('errors.jsonl').write(json.dumps(interaction) + '\n')
+    cassette = apply_netscaler_state.open_cassette(str(tmpdir.join('errors.jsonl')),'replay')
+    # Codes nsnitro does not map, such as 1853, raise NSNitroError itself and are not added to the map
+    with pytest.raises(NSNitroError) as error:
+        apply_netscaler_state.replay_cassette_interaction(cassette,dict(interaction),None)
+    assert error.value.code == errorcode
+    assert (errorcode in NSNitroExceptionClassMap) == mapped
+    assert cassette['replayed'] == 1
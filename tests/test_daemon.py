@@ -0,0 +1,19 @@
+import os
+import apply_netscaler_state
+import benchmark_e2e
+
+
+def test_daemon_restarts_journal_after_cycle(mock_ns,args,tmpdir,monkeypatch):
+    appliance, address = mock_ns
+    monkeypatch.chdir(tmpdir)
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(50,address)
+    group_states = {}
+    journal_filename = apply_netscaler_state.get_journal_filename(args.journal_dir,address)
+    for expression in ['STARTSWITH','CONTAINS','ENDSWITH']:
+        for cs_policy in ns_group_conf['cs_policies']:
+            cs_policy['expression'] = 'HTTP.REQ.URL.PATH.{}("/{}/")'.format(expression,cs_policy['name'])
+        assert apply_netscaler_state.reconcile_daemon_groups([ns_group_conf],group_states,args)
+        # Every plan of the cycle ended, so the journal is started over
+        assert os.path.getsize(journal_filename) == 0
+    for group_state in group_states.values():
+        apply_netscaler_state.close_daemon_group_state(group_state)
@@ -0,0 +1,50 @@
+import re
+from collections import OrderedDict
+import apply_netscaler_state
+
+
+def get_lanes_conf(address,size):
+    '''
+
+    :param address: ns_instance address of the mock NetScaler
+    :param size: Number of independent server, service group, lbvserver and CS action chains
+    :return: ns_group configuration with the chains
+    '''
+    return OrderedDict([('name','lanes'),('ns_instance',{'address':address,'user':'nsroot','pass':'nsroot'}),
+                        ('servers',[{'name':'s{}'.format(i),'ip_address':'10.0.0.{}'.format(i + 1)}
+                                    for i in range(size)]),
+                        ('service_groups',[{'name':'sg{}'.format(i),'protocol':'HTTP',
+                                            'servers':[{'name':'s{}'.format(i),'port':80}]} for i in range(size)]),
+                        ('lbvservers',[{'name':'lb{}'.format(i),'port':80,'protocol':'HTTP',
+                                        'vip_address':'172.16.0.{}'.format(i + 1),
+                                        'service_group_bindings':['sg{}'.format(i)]} for i in range(size)]),
+                        ('cs_actions',[{'name':'a{}'.format(i),'target_lbvserver':'lb{}'.format(i)}
+                                       for i in range(size)])])
+
+
+def test_independent_chains_are_split_into_lanes():
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    operations = apply_netscaler_state.get_ns_group_operations(snapshot,get_lanes_conf('mock',10))
+    components = apply_netscaler_state.get_operation_components(snapshot,operations)
+    assert len(set(components)) == 10
+    # Every operation of a chain is in the component of its server
+    for operation, component in zip(operations,components):
+        assert component == int(re.sub(r'\D','',operation['name']))
+
+    lanes = apply_netscaler_state.get_operation_lanes(snapshot,operations,4)
+    assert sorted([len(lane) for lane in lanes]) == [12,12,18,18]
+    positions = [[operations.index(operation) for operation in lane] for lane in lanes]
+    assert all([lane_positions == sorted(lane_positions) for lane_positions in positions])
+    assert sorted(sum(positions,[])) == range(len(operations))
+    assert apply_netscaler_state.get_operation_lanes(snapshot,operations,1) == [operations]
+
+
+def test_lanes_apply_concurrently(mock_ns,args):
+    appliance, address = mock_ns
+    ns_group_conf = get_lanes_conf(address,10)
+    args.apply_workers = 4
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    # Lanes apply each chain in order; the mock NetScaler refuses a binding to a resource that does not exist yet
+    assert sorted(appliance['config']['resources']['csaction'].keys()) == sorted(['a{}'.format(i) for i in range(10)])
+    args.plan = True
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['changes'] == 0
@@ -0,0 +1,26 @@
+import apply_netscaler_state
+import benchmark_e2e
+
+
+def test_nitro_calls_are_counted_by_verb_resource_type_and_ns_group(mock_ns,args,tmpdir,monkeypatch):
+    appliance, address = mock_ns
+    monkeypatch.setattr(apply_netscaler_state,'nitro_metrics',{})
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(20,address)
+    args.chunk_size = 100
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    metrics = apply_netscaler_state.nitro_metrics
+    # Every request the mock received was recorded, single and bulk alike
+    assert sum([metric['calls'] for metric in metrics.values()]) == appliance['stats']['requests']
+    assert metrics[('POST','login','benchmark')]['calls'] == metrics[('POST','logout','benchmark')]['calls'] == 1
+    assert metrics[('GET','server','benchmark')]['calls'] == 1
+    assert metrics[('POST','server','benchmark')]['calls'] == 1
+    assert all([metric['errors'] == 0 and metric['buckets'][-1] == metric['calls'] for metric in metrics.values()])
+    assert apply_netscaler_state.get_nitro_metrics_summary()[-1].split()[1] == str(appliance['stats']['requests'])
+
+    metrics_file = tmpdir.join('nitro.prom')
+    apply_netscaler_state.report_nitro_metrics(str(metrics_file))
+    lines = metrics_file.read().splitlines()
+    assert 'netscaler_state_nitro_requests_total{verb="POST",resource_type="server",ns_group="benchmark"} 1' in lines
+    assert 'netscaler_state_nitro_request_duration_seconds_count{verb="POST",resource_type="server",' \
+           'ns_group="benchmark"} 1' in lines
+    assert not tmpdir.join('nitro.prom.tmp').exists()
@@ -0,0 +1,74 @@
+import re
+import pytest
+import apply_netscaler_state
+import benchmark_e2e
+import nitro_mock
+
+
+def fail_mock_requests(monkeypatch,pattern):
+    '''
+
+    :param monkeypatch: pytest monkeypatch fixture
+    :param pattern: Regular expression; every GET request whose URL matches it fails
+    :return: None
+    '''
+    handle_mock_request = nitro_mock.handle_mock_request
+
+    def fail_matching_request(appliance,method,url,body,cookie):
+        if method == 'GET' and re.search(pattern,url):
+            raise nitro_mock.NitroMockError('injected')
+        return handle_mock_request(appliance,method,url,body,cookie)
+
+    monkeypatch.setattr(nitro_mock,'handle_mock_request',fail_matching_request)
+    return None
+
+
+@pytest.mark.parametrize('failed_request', [
+    r'/server\?.*pageno=2',
+    r'/server\?.*pageno=1',
+    r'/servicegroup_servicegroupmember_binding\?bulkbindings=yes.*pageno=2',
+    r'/servicegroup_servicegroupmember_binding(\?bulkbindings=yes|/sg3)'])
+def test_failed_read_fails_the_ns_group(mock_ns,args,monkeypatch,failed_request):
+    appliance, address = mock_ns
+    monkeypatch.setitem(apply_netscaler_state.nitro_settings,'page_size',4)
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(50,address)
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+
+    fail_mock_requests(monkeypatch,failed_request)
+    nitro_mock.reset_mock_stats(appliance)
+    result = apply_netscaler_state.process_ns_group(ns_group_conf,args)
+    # The resources that were not read must not be planned as missing
+    assert not result['success'] and result['backup'] is None
+    stats = nitro_mock.reset_mock_stats(appliance)
+    # Only the login is sent; nothing is changed
+    assert stats['POST'] == 1 and stats['PUT'] == 0 and stats['DELETE'] == 0
+    assert len(appliance['config']['resources']['server']) == 10
+    assert len(appliance['config']['bindings']['servicegroup_servicegroupmember_binding']) == 10
+
+
+def test_bindings_read_per_parent_without_bulk_retrieval(mock_ns,args,monkeypatch):
+    appliance, address = mock_ns
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(50,address)
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    nitro = apply_netscaler_state.connect(ns_group_conf['ns_instance'])
+    try:
+        snapshot = apply_netscaler_state.get_ns_snapshot(nitro)
+        fail_mock_requests(monkeypatch,r'bulkbindings=yes')
+        assert apply_netscaler_state.get_ns_snapshot(nitro) == snapshot
+    finally:
+        apply_netscaler_state.disconnect(nitro)
+
+
+def test_paged_read_matches_single_read(mock_ns,args,monkeypatch):
+    appliance, address = mock_ns
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(50,address)
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    nitro = apply_netscaler_state.connect(ns_group_conf['ns_instance'])
+    try:
+        monkeypatch.setitem(apply_netscaler_state.nitro_settings,'page_size',0)
+        snapshot = apply_netscaler_state.get_ns_snapshot(nitro)
+        for page_size in [1,3,10]:
+            monkeypatch.setitem(apply_netscaler_state.nitro_settings,'page_size',page_size)
+            assert apply_netscaler_state.get_ns_snapshot(nitro) == snapshot
+    finally:
+        apply_netscaler_state.disconnect(nitro)
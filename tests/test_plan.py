@@ -0,0 +1,269 @@
+from collections import OrderedDict
+import pytest
+import apply_netscaler_state
+import benchmark_e2e
+import nitro_mock
+
+
+def get_chain_conf(size):
+    '''
+
+    :param size: Number of server, service group, lbvserver, CS action and CS policy chains
+    :return: ns_group configuration with the chains behind one csvserver
+    '''
+    return OrderedDict([('name','chain'),
+                        ('servers',[{'name':'s{}'.format(i),'ip_address':'10.0.0.{}'.format(i + 1)}
+                                    for i in range(size)]),
+                        ('service_groups',[{'name':'sg{}'.format(i),'protocol':'HTTP',
+                                            'servers':[{'name':'s{}'.format(i),'port':80}]} for i in range(size)]),
+                        ('lbvservers',[{'name':'lb{}'.format(i),'port':80,'protocol':'HTTP',
+                                        'vip_address':'172.16.0.{}'.format(i + 1),
+                                        'service_group_bindings':['sg{}'.format(i)]} for i in range(size)]),
+                        ('cs_actions',[{'name':'a{}'.format(i),'target_lbvserver':'lb{}'.format(i)}
+                                       for i in range(size)]),
+                        ('cs_policies',[{'name':'p{}'.format(i),'expression':'HTTP.REQ.URL.EQ("/{}")'.format(i),
+                                         'action':'a{}'.format(i)} for i in range(size)]),
+                        ('csvservers',[{'name':'cs','vip_address':'172.16.1.1','port':80,'protocol':'HTTP',
+                                        'default_lbvserver':'lb0',
+                                        'policy_bindings':[{'name':'p{}'.format(i),'priority':100 + i}
+                                                           for i in range(size)]}])])
+
+
+def get_referenced_names(operation):
+    '''
+
+    :param operation: Operation from apply_netscaler_state.get_ns_group_operations()
+    :return: List of (resource type, name) the operation needs to exist on the NetScaler
+    '''
+    options = operation['options']
+    binding = apply_netscaler_state.ns_binding_types.get(operation['resource_type'])
+    if binding is not None:
+        return [(binding['parent'],options[binding['parent_property']]),
+                (binding['target'],options[binding['target_property']])]
+    return [(reference['resource_type'],options[reference['nitro']])
+            for reference in apply_netscaler_state.ns_resource_references.get(operation['resource_type'],[])
+            if reference['nitro'] in options]
+
+
+def is_referenced(snapshot,resource_type,name):
+    '''
+
+    :param snapshot: Snapshot dictionary
+    :param resource_type: Nitro resource type
+    :param name: Name of the resource
+    :return: True if another resource refers to the resource by name
+    '''
+    for referring_type, references in apply_netscaler_state.ns_resource_references.items():
+        for reference in references:
+            if reference['resource_type'] == resource_type:
+                for options in snapshot['resources'][referring_type].values():
+                    if options.get(reference['nitro']) == name:
+                        return True
+    return False
+
+
+def apply_plan(snapshot,operations):
+    '''
+
+    :param snapshot: Snapshot dictionary updated with each operation
+    :param operations: Operations to apply in order
+    :return: None
+
+    Fails like a NetScaler would on an operation naming a resource that does not exist yet, or deleting a resource
+    another resource still refers to.
+    '''
+    for operation in operations:
+        if operation['action'] != 'delete':
+            for resource_type, name in get_referenced_names(operation):
+                assert apply_netscaler_state.get_snapshot_resource(snapshot,resource_type,name) is not None, \
+                    '{} {} needs {} {}'.format(operation['resource_type'],operation['name'],resource_type,name)
+        elif operation['resource_type'] not in apply_netscaler_state.ns_binding_types:
+            assert not is_referenced(snapshot,operation['resource_type'],operation['name']), \
+                '{} {} is still in use'.format(operation['resource_type'],operation['name'])
+        apply_netscaler_state.update_snapshot(snapshot,operation)
+
+
+def test_plan_order_from_empty_snapshot():
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    ns_group_conf = get_chain_conf(20)
+    operations = apply_netscaler_state.get_ns_group_operations(snapshot,ns_group_conf)
+    # A server, service group, lbvserver, CS action and CS policy with their bindings per chain, and the csvserver
+    assert len(operations) == 20 * 8 + 2
+    apply_plan(snapshot,operations)
+    assert apply_netscaler_state.get_ns_group_operations(snapshot,ns_group_conf) == []
+
+
+def test_delete_order_in_snapshot():
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    ns_group_conf = get_chain_conf(20)
+    apply_plan(snapshot,apply_netscaler_state.get_ns_group_operations(snapshot,ns_group_conf))
+    for key in ['servers','service_groups','lbvservers','cs_actions','cs_policies','csvservers']:
+        ns_group_conf[key] = []
+    apply_plan(snapshot,apply_netscaler_state.get_ns_group_operations(snapshot,ns_group_conf))
+    assert all([len(resources) == 0 for resources in snapshot['resources'].values()])
+
+
+def test_sort_plan_nodes_takes_ready_nodes_in_input_order():
+    nodes = OrderedDict([('a',{'requires':[]}),('b',{'requires':['c']}),('c',{'requires':['missing']}),
+                         ('d',{'requires':[]})])
+    assert apply_netscaler_state.sort_plan_nodes(nodes) == ['a','c','b','d']
+
+
+def test_plan_operations_of_a_type_stay_together():
+    operations = apply_netscaler_state.get_ns_group_operations(apply_netscaler_state.new_ns_snapshot(),
+                                                               get_chain_conf(250))
+    # One batch per 100 operations of each resource type and action
+    batches = apply_netscaler_state.get_operation_batches(operations,100)
+    assert [(len(batch), batch[0]['resource_type']) for batch in batches] == \
+        [(count, node_type) for node_type in apply_netscaler_state.ns_plan_node_types
+         for count in ([1] if node_type in ['csvserver','csvserver_lbvserver_binding'] else [100,100,50])]
+
+
+def test_plan_summary_counts_operations_and_nitro_calls():
+    operations = apply_netscaler_state.get_ns_group_operations(apply_netscaler_state.new_ns_snapshot(),
+                                                               get_chain_conf(150))
+    summary = apply_netscaler_state.get_operations_summary(operations,100)
+    assert [summary['add'],summary['update'],summary['rename'],summary['delete']] == [150 * 8 + 2,0,0,0]
+    assert summary['calls'] == len(apply_netscaler_state.get_operation_batches(operations,100)) == 8 * 2 + 2
+    assert summary['bytes'] > 0
+    assert apply_netscaler_state.get_operations_summary(operations,1)['calls'] == len(operations)
+
+
+def test_plan_exit_status():
+    assert apply_netscaler_state.get_plan_exit_status([{'success':True,'changes':0}] * 2) == 0
+    assert apply_netscaler_state.get_plan_exit_status([{'success':True,'changes':0},
+                                                       {'success':True,'changes':3}]) == 2
+    assert apply_netscaler_state.get_plan_exit_status([{'success':False,'changes':0},
+                                                       {'success':True,'changes':3}]) == 1
+
+
+def test_backup_from_snapshot_matches_configuration():
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    ns_group_conf = get_chain_conf(3)
+    apply_plan(snapshot,apply_netscaler_state.get_ns_group_operations(snapshot,ns_group_conf))
+    backup_conf = apply_netscaler_state.get_ns_group_conf_from_snapshot(snapshot,{'name':'chain','ns_instance':{}})
+    assert backup_conf['csvservers'][0]['default_lbvserver'] == 'lb0'
+    assert [binding['name'] for binding in backup_conf['csvservers'][0]['policy_bindings']] == ['p0','p1','p2']
+    # Applying the backup changes nothing
+    assert apply_netscaler_state.get_ns_group_operations(snapshot,backup_conf) == []
+
+
+def get_ns_group_conf(address,ips,vips,names=None,service_groups=None,targets=None):
+    '''
+
+    :param address: ns_instance address of the mock NetScaler
+    :param ips: Last octet of the IP address of each server
+    :param vips: Last octet of the VIP address of each lbvserver
+    :param names: Names of the servers; s0, s1, ... if None
+    :param service_groups: Index of the service group bound to each lbvserver; its own if None
+    :param targets: Index of the lbvserver targeted by each CS action; its own if None
+    :return: ns_group configuration with a service group and an lbvserver per server and a CS action per lbvserver
+    '''
+    names = names or ['s{}'.format(i) for i in range(len(ips))]
+    service_groups = service_groups or range(len(vips))
+    targets = targets or range(len(vips))
+    return OrderedDict([('name','plan'),('ns_instance',{'address':address,'user':'nsroot','pass':'nsroot'}),
+                        ('servers',[{'name':names[i],'ip_address':'10.0.0.{}'.format(ip)}
+                                    for i, ip in enumerate(ips)]),
+                        ('service_groups',[{'name':'sg{}'.format(i),'protocol':'HTTP',
+                                            'servers':[{'name':names[i],'port':80}]} for i in range(len(ips))]),
+                        ('lbvservers',[{'name':'lb{}'.format(i),'port':80,'protocol':'HTTP',
+                                        'vip_address':'172.16.0.{}'.format(vip),
+                                        'service_group_bindings':['sg{}'.format(service_groups[i])]}
+                                       for i, vip in enumerate(vips)]),
+                        ('cs_actions',[{'name':'a{}'.format(i),'target_lbvserver':'lb{}'.format(targets[i])}
+                                       for i in range(len(vips))])])
+
+
+def get_plan(ns_group_conf):
+    '''
+
+    :param ns_group_conf: ns_group configuration
+    :return: Operations planned against the current configuration of the NetScaler of the ns_group
+    '''
+    nitro = apply_netscaler_state.connect(ns_group_conf['ns_instance'])
+    try:
+        return apply_netscaler_state.get_ns_group_operations(apply_netscaler_state.get_ns_snapshot(nitro),
+                                                             ns_group_conf)
+    finally:
+        apply_netscaler_state.disconnect(nitro)
+
+
+def get_addresses(appliance,resource_type,property):
+    '''
+
+    :param appliance: Dictionary from nitro_mock.new_mock_appliance()
+    :param resource_type: Nitro resource type
+    :param property: Address property of the resource type
+    :return: Dictionary of resource name -> address on the mock NetScaler
+    '''
+    return dict([(name, options[property])
+                 for name, options in appliance['config']['resources'][resource_type].items()])
+
+
+def test_mock_refuses_what_a_netscaler_refuses(mock_ns):
+    appliance, address = mock_ns
+    with pytest.raises(nitro_mock.NitroMockError, match='No such resource'):
+        nitro_mock.apply_mock_item(appliance,'add','csaction',{'name':'a0','targetlbvserver':'lb0'})
+    nitro_mock.apply_mock_item(appliance,'add','lbvserver',{'name':'lb0','ipv46':'172.16.0.1','port':80,
+                                                            'servicetype':'HTTP'})
+    nitro_mock.apply_mock_item(appliance,'add','csaction',{'name':'a0','targetlbvserver':'lb0'})
+    nitro_mock.apply_mock_item(appliance,'add','cspolicy',{'policyname':'p0','rule':'true','action':'a0'})
+    with pytest.raises(nitro_mock.NitroMockError, match='referenced'):
+        nitro_mock.apply_mock_item(appliance,'delete','csaction',{'name':'a0'})
+    with pytest.raises(nitro_mock.NitroMockError, match='Address already in use'):
+        nitro_mock.apply_mock_item(appliance,'add','lbvserver',{'name':'lb1','ipv46':'172.16.0.1','port':80,
+                                                                'servicetype':'HTTP'})
+
+
+def test_plan_order_from_empty_netscaler(mock_ns,args):
+    appliance, address = mock_ns
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(500,address)
+    operations = get_plan(ns_group_conf)
+    # Every operation of a type follows every operation of the types it depends on, so each type is one run
+    types = [operation['resource_type'] for operation in operations]
+    runs = [resource_type for i, resource_type in enumerate(types) if i == 0 or types[i - 1] != resource_type]
+    assert runs == [node_type for node_type in apply_netscaler_state.ns_plan_node_types if node_type in types]
+    assert len(apply_netscaler_state.get_operation_batches(operations,100)) == len(runs)
+    # The mock NetScaler refuses a resource or binding naming a resource that does not exist yet
+    args.chunk_size = 100
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    assert get_plan(ns_group_conf) == []
+
+
+def test_delete_order(mock_ns,args):
+    appliance, address = mock_ns
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(50,address)
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    for key in ['servers','service_groups','lbvservers','cs_actions','cs_policies','csvservers']:
+        ns_group_conf[key] = []
+    # The mock NetScaler refuses to delete a CS action still used by a CS policy
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    assert all([len(resources) == 0 for resources in appliance['config']['resources'].values()])
+
+
+@pytest.mark.parametrize('title,changes,renames', [
+    ('server swap',{'ips':[2,1,3,4]},0),
+    ('server chain move',{'ips':[3,1,5,4]},0),
+    ('server rename',{'names':['s0','s1','new2','s3']},1),
+    ('vip swap',{'vips':[2,1,3,4]},0),
+    ('vip swap with rebinding',{'vips':[2,1,3,4],'service_groups':[1,0,2,3],'targets':[1,0,2,3]},3),
+    ('vip rotate',{'vips':[2,3,4,1],'service_groups':[3,0,1,2],'targets':[3,0,1,2]},5)])
+def test_rename_and_address_moves(mock_ns,args,title,changes,renames):
+    appliance, address = mock_ns
+    ns_group_conf = get_ns_group_conf(address,[1,2,3,4],[1,2,3,4])
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    options = {'ips':[1,2,3,4],'vips':[1,2,3,4]}
+    options.update(changes)
+    ns_group_conf = get_ns_group_conf(address,**options)
+    operations = get_plan(ns_group_conf)
+    assert len([operation for operation in operations if operation['action'] == 'rename']) == renames
+
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    assert get_plan(ns_group_conf) == []
+    assert get_addresses(appliance,'server','ipaddress') == \
+        dict([(server['name'], server['ip_address']) for server in ns_group_conf['servers']])
+    assert get_addresses(appliance,'lbvserver','ipv46') == \
+        dict([(lbvserver['name'], lbvserver['vip_address']) for lbvserver in ns_group_conf['lbvservers']])
+    assert get_addresses(appliance,'csaction','targetlbvserver') == \
+        dict([(cs_action['name'], cs_action['target_lbvserver']) for cs_action in ns_group_conf['cs_actions']])
@@ -0,0 +1,56 @@
+import json
+import apply_netscaler_state
+import benchmark_e2e
+from nsnitro.nsexceptions import NSNitroError
+from nsnitro.nsutil import NSNitroResponse
+
+
+def test_snapshot_holds_managed_properties_only(mock_ns,args):
+    appliance, address = mock_ns
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(20,address)
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    nitro = apply_netscaler_state.connect(ns_group_conf['ns_instance'])
+    try:
+        snapshot = apply_netscaler_state.get_ns_snapshot(nitro)
+    finally:
+        apply_netscaler_state.disconnect(nitro)
+    # The mock NetScaler adds read-only properties such as the state of an lbvserver unless attrs is given
+    assert 'curstate' not in snapshot['resources']['lbvserver']['lb0']
+    for resource_type, resources in snapshot['resources'].items():
+        managed = set(apply_netscaler_state.get_managed_properties(resource_type))
+        assert all([set(options) <= managed for options in resources.values()])
+    for binding_type, parents in snapshot['bindings'].items():
+        managed = set(apply_netscaler_state.get_managed_properties(binding_type))
+        assert all([set(options) <= managed for bindings in parents.values() for options in bindings.values()])
+
+
+class NoAttrsNitro(object):
+    '''
+    Nitro connection of a NetScaler that rejects attrs= and knows a single server
+    '''
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        if url.startswith('server/missing'):
+            raise NSNitroError('No such resource',258)
+        if 'attrs=' in url:
+            raise NSNitroError('Invalid argument [attrs]',278)
+        return NSNitroResponse(json.dumps({'errorcode':0,'message':'Done','severity':'NONE',
+                                           'server':[{'name':'s0','ipaddress':'10.0.0.1','state':'ENABLED'}]}))
+
+
+def test_rejected_attrs_are_retried_without_projection():
+    nitro = NoAttrsNitro()
+    assert apply_netscaler_state.get_projected_response(nitro,'server','server') == \
+        [{'name':'s0','ipaddress':'10.0.0.1'}]
+    assert nitro.urls == ['server?attrs=' + ','.join(apply_netscaler_state.get_managed_properties('server')),'server']
+    # A missing resource is not requested again
+    nitro.urls = []
+    try:
+        apply_netscaler_state.get_projected_response(nitro,'server/missing','server')
+        assert False, 'the missing resource was found'
+    except NSNitroError as error:
+        assert error.code == 258
+    assert len(nitro.urls) == 1
@@ -0,0 +1,44 @@
+import threading
+import time
+import apply_netscaler_state
+
+
+def test_hostnames_resolve_once_within_the_timeout(monkeypatch):
+    lookups = []
+    hung = threading.Event()
+
+    def gethostbyname(hostname):
+        lookups.append(hostname)
+        if hostname == 'hung.example.com':
+            hung.wait(5)
+        if hostname == 'missing.example.com':
+            raise apply_netscaler_state.socket.gaierror('not found')
+        return '192.0.2.1'
+
+    monkeypatch.setattr(apply_netscaler_state.socket,'gethostbyname',gethostbyname)
+    monkeypatch.setattr(apply_netscaler_state,'resolver_cache',{})
+    monkeypatch.setitem(apply_netscaler_state.resolver_settings,'timeout',0.2)
+    try:
+        start = time.time()
+        apply_netscaler_state.resolve_hostnames(['ns1.example.com','hung.example.com','missing.example.com',
+                                                 'ns1.example.com','192.0.2.10'])
+        assert time.time() - start < 1
+        assert sorted(lookups) == ['hung.example.com','missing.example.com','ns1.example.com']
+        assert apply_netscaler_state.is_valid_ns_address('ns1.example.com')
+        assert not apply_netscaler_state.is_valid_ns_address('hung.example.com')
+        assert not apply_netscaler_state.is_valid_ns_address('missing.example.com')
+        assert apply_netscaler_state.is_valid_ns_address('192.0.2.10')
+        assert len(lookups) == 3
+    finally:
+        hung.set()
+
+
+def test_offline_checks_hostname_syntax_only(monkeypatch):
+    def gethostbyname(hostname):
+        raise AssertionError('{} looked up in offline mode'.format(hostname))
+
+    monkeypatch.setattr(apply_netscaler_state.socket,'gethostbyname',gethostbyname)
+    monkeypatch.setattr(apply_netscaler_state,'resolver_cache',{})
+    monkeypatch.setitem(apply_netscaler_state.resolver_settings,'offline',True)
+    assert apply_netscaler_state.is_valid_ns_address('ns1.example.com')
+    assert not apply_netscaler_state.is_valid_ns_address('ns1..example.com')
@@ -0,0 +1,82 @@
+import apply_netscaler_state
+import benchmark_e2e
+
+
+def remove_e2e_units(ns_group_conf,count):
+    '''
+
+    :param ns_group_conf: ns_group configuration from benchmark_e2e.get_e2e_fixture()
+    :param count: Number of units removed from the end of the configuration
+    :return: None
+    '''
+    for key in ['servers','service_groups','lbvservers','cs_actions','cs_policies']:
+        del ns_group_conf[key][-count:]
+    for csvserver in ns_group_conf['csvservers']:
+        del csvserver['policy_bindings'][-count:]
+    return None
+
+
+def test_resume_after_sent_delete(mock_ns,args,monkeypatch):
+    appliance, address = mock_ns
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(50,address)
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    remove_e2e_units(ns_group_conf,3)
+
+    # The run dies right after the NetScaler applied its first delete of a resource, before the outcome is journaled
+    apply_operation_batch = apply_netscaler_state.apply_operation_batch
+
+    def crash_after_delete(nitro,snapshot,operations):
+        ret = apply_operation_batch(nitro,snapshot,operations)
+        if any(operation['action'] == 'delete' and operation['resource_type'] not in
+               apply_netscaler_state.ns_binding_types for operation in operations):
+            raise KeyboardInterrupt()
+        return ret
+
+    monkeypatch.setattr(apply_netscaler_state,'apply_operation_batch',crash_after_delete)
+    try:
+        apply_netscaler_state.process_ns_group(ns_group_conf,args)
+        assert False, 'the run was not interrupted'
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+    apply_netscaler_state.close_journals()
+
+    args.resume = True
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    args.resume = False
+    args.plan = True
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['changes'] == 0
+    assert 'policy9' not in appliance['config']['resources']['cspolicy']
+
+
+def test_resume_after_crash_mid_batch(mock_ns,args,monkeypatch):
+    appliance, address = mock_ns
+    ns_group_conf = benchmark_e2e.get_e2e_fixture(100,address)
+    args.chunk_size = 8
+
+    # The run dies while its fourth batch is applied: the NetScaler applied half of it, none of it is confirmed
+    apply_operation_batch = apply_netscaler_state.apply_operation_batch
+    batches = []
+
+    def crash_mid_batch(nitro,snapshot,operations):
+        batches.append(operations)
+        if len(batches) < 4:
+            return apply_operation_batch(nitro,snapshot,operations)
+        apply_operation_batch(nitro,snapshot,operations[:len(operations) // 2])
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(apply_netscaler_state,'apply_operation_batch',crash_mid_batch)
+    try:
+        apply_netscaler_state.process_ns_group(ns_group_conf,args)
+        assert False, 'the run was not interrupted'
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+    apply_netscaler_state.close_journals()
+    assert len(batches[3]) == 8
+
+    args.resume = True
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['success']
+    args.resume = False
+    args.plan = True
+    assert apply_netscaler_state.process_ns_group(ns_group_conf,args)['changes'] == 0
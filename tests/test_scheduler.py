@@ -0,0 +1,57 @@
+import time
+import apply_netscaler_state
+
+
+def test_limit_grows_in_use_and_halves_once_per_burst(monkeypatch):
+    monkeypatch.setitem(apply_netscaler_state.scheduler_settings,'max_limit',6)
+    scheduler = apply_netscaler_state.new_appliance_scheduler()
+    assert scheduler['limit'] == 4
+
+    # The limit does not grow while it is not in use
+    for i in range(10):
+        apply_netscaler_state.release_appliance_slot(scheduler,apply_netscaler_state.acquire_appliance_slot(scheduler),
+                                                     False)
+    assert scheduler['limit'] == 4
+
+    # Requests answered within the latency target grow the limit by one per round, up to max_limit
+    for i in range(40):
+        starts = [apply_netscaler_state.acquire_appliance_slot(scheduler) for slot in range(int(scheduler['limit']))]
+        for start in starts:
+            apply_netscaler_state.release_appliance_slot(scheduler,start,False)
+    assert scheduler['limit'] == 6
+    assert scheduler['in_flight'] == 0
+
+    # A burst of failed requests sent before the decrease halves the limit only once
+    starts = [apply_netscaler_state.acquire_appliance_slot(scheduler) for slot in range(6)]
+    for start in starts:
+        apply_netscaler_state.release_appliance_slot(scheduler,start,True)
+    assert (scheduler['limit'], scheduler['decreases']) == (3,1)
+    # A slow request sent after it halves the limit again, down to min_limit
+    monkeypatch.setitem(apply_netscaler_state.scheduler_settings,'latency_target',-1)
+    for limit in [1.5,1,1]:
+        start = apply_netscaler_state.acquire_appliance_slot(scheduler)
+        apply_netscaler_state.release_appliance_slot(scheduler,start,False)
+        assert scheduler['limit'] == limit
+    assert scheduler['decreases'] == 4
+
+
+def test_max_rps_paces_request_starts():
+    scheduler = apply_netscaler_state.new_appliance_scheduler(max_rps=50)
+    begin = time.time()
+    starts = []
+    for i in range(5):
+        starts.append(apply_netscaler_state.acquire_appliance_slot(scheduler))
+        apply_netscaler_state.release_appliance_slot(scheduler,starts[-1],False)
+    assert all([later - earlier >= 0.02 - 1e-6 for earlier, later in zip(starts,starts[1:])])
+    assert time.time() - begin >= 0.08 - 1e-3
+
+
+def test_ns_groups_of_an_appliance_share_its_scheduler(monkeypatch):
+    monkeypatch.setattr(apply_netscaler_state,'appliance_schedulers',{})
+    scheduler = apply_netscaler_state.get_appliance_scheduler({'address':'10.0.0.1'})
+    assert scheduler['max_rps'] is None
+    # The lowest max_rps of the ns_groups of a NetScaler applies
+    assert apply_netscaler_state.get_appliance_scheduler({'address':'10.0.0.1','max_rps':20}) is scheduler
+    apply_netscaler_state.get_appliance_scheduler({'address':'10.0.0.1','max_rps':'50'})
+    assert scheduler['max_rps'] == 20
+    assert apply_netscaler_state.get_appliance_scheduler({'address':'10.0.0.2'}) is not scheduler
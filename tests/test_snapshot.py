@@ -0,0 +1,89 @@
+import apply_netscaler_state
+
+
+def get_snapshot():
+    '''
+
+    :return: Snapshot with a server bound to a service group, an lbvserver with a CS action and policy referring to
+             it and two csvservers sharing a VIP on different ports
+    '''
+    snapshot = apply_netscaler_state.new_ns_snapshot()
+    resources = [('server',{'name':'web1','ipaddress':'10.0.0.1'}),
+                 ('servicegroup',{'servicegroupname':'web_sg','servicetype':'HTTP'}),
+                 ('lbvserver',{'name':'web_lb','ipv46':'0.0.0.0','port':'0','servicetype':'HTTP'}),
+                 ('csaction',{'name':'web_action','targetlbvserver':'web_lb'}),
+                 ('cspolicy',{'policyname':'web_policy','rule':'true','action':'web_action'}),
+                 ('csvserver',{'name':'www_http','ipv46':'10.1.0.1','port':'80','servicetype':'HTTP'}),
+                 ('csvserver',{'name':'www_https','ipv46':'10.1.0.1','port':'443','servicetype':'SSL'})]
+    for resource_type, options in resources:
+        apply_netscaler_state.add_resource_to_snapshot(snapshot,resource_type,options)
+    bindings = [('servicegroup_servicegroupmember_binding',{'servicegroupname':'web_sg','servername':'web1','port':80}),
+                ('lbvserver_servicegroup_binding',{'name':'web_lb','servicegroupname':'web_sg'}),
+                ('csvserver_lbvserver_binding',{'name':'www_http','lbvserver':'web_lb'})]
+    for binding_type, options in bindings:
+        apply_netscaler_state.add_binding_to_snapshot(snapshot,binding_type,options)
+    return snapshot
+
+
+def test_vservers_sharing_a_vip_on_other_ports_are_left_alone():
+    snapshot = get_snapshot()
+    for name, port, protocol in [('www_http',80,'HTTP'),('www_https',443,'SSL')]:
+        csvserver_conf = {'name':name,'vip_address':'10.1.0.1','port':port,'protocol':protocol}
+        assert apply_netscaler_state.get_csvserver_operations(snapshot,csvserver_conf) == []
+
+
+def test_server_taking_an_address_deletes_its_owner():
+    snapshot = get_snapshot()
+    operations = apply_netscaler_state.get_server_operations(snapshot,{'name':'web2','ip_address':'10.0.0.1'})
+    assert [(operation['action'],operation['name']) for operation in operations] == [('delete','web1'),
+                                                                                      ('add','web2')]
+
+
+def test_rename_follows_bindings_and_references():
+    snapshot = get_snapshot()
+    rename = apply_netscaler_state.new_operation('rename','lbvserver','web_lb',{'name':'web_lb','newname':'app_lb'})
+    apply_netscaler_state.update_snapshot(snapshot,rename)
+    assert apply_netscaler_state.get_snapshot_resource(snapshot,'lbvserver','web_lb') is None
+    assert apply_netscaler_state.get_snapshot_resource(snapshot,'csaction','web_action')['targetlbvserver'] == 'app_lb'
+    assert list(apply_netscaler_state.get_snapshot_bindings(snapshot,'lbvserver_servicegroup_binding','app_lb'))
+    assert list(apply_netscaler_state.get_snapshot_bindings(snapshot,'csvserver_lbvserver_binding','www_http')) == \
+        [('app_lb',)]
+    # Nothing left to change once the configuration uses the new name
+    lbvserver_conf = {'name':'app_lb','vip_address':'0.0.0.0','port':0,'protocol':'HTTP',
+                      'service_group_bindings':['web_sg']}
+    assert apply_netscaler_state.get_lbvserver_operations(snapshot,lbvserver_conf) == []
+    assert apply_netscaler_state.get_lbvserver_binding_operations(snapshot,lbvserver_conf) == []
+
+
+def test_delete_removes_bindings_of_the_resource():
+    snapshot = get_snapshot()
+    delete = apply_netscaler_state.new_operation('delete','server','web1',{'name':'web1'})
+    apply_netscaler_state.update_snapshot(snapshot,delete)
+    assert apply_netscaler_state.get_snapshot_address_owner(snapshot,'server',{'ipaddress':'10.0.0.1'}) is None
+    assert not apply_netscaler_state.get_snapshot_bindings(snapshot,'servicegroup_servicegroupmember_binding','web_sg')
+
+
+def test_copy_leaves_the_snapshot_unchanged():
+    snapshot = get_snapshot()
+    snapshot_copy = apply_netscaler_state.copy_ns_snapshot(snapshot)
+    for operation in [apply_netscaler_state.new_operation('rename','server','web1',{'name':'web1','newname':'web2'}),
+                      apply_netscaler_state.new_operation('delete','servicegroup','web_sg',
+                                                          {'servicegroupname':'web_sg'}),
+                      apply_netscaler_state.new_operation('update','csaction','web_action',
+                                                          {'name':'web_action','targetlbvserver':'other_lb'})]:
+        apply_netscaler_state.update_snapshot(snapshot_copy,operation)
+    assert snapshot == get_snapshot()
+    assert apply_netscaler_state.get_snapshot_resource(snapshot_copy,'server','web2') is not None
+    assert not apply_netscaler_state.get_snapshot_bindings(snapshot_copy,'lbvserver_servicegroup_binding','web_lb')
+
+
+def test_renamed_target_is_found_again_in_its_bindings():
+    snapshot = get_snapshot()
+    for name, new_name in [('web1','web2'),('web2','web3')]:
+        rename = apply_netscaler_state.new_operation('rename','server',name,{'name':name,'newname':new_name})
+        apply_netscaler_state.update_snapshot(snapshot,rename)
+    bindings = apply_netscaler_state.get_snapshot_bindings(snapshot,'servicegroup_servicegroupmember_binding','web_sg')
+    assert list(bindings.keys()) == [('web3','80')]
+    apply_netscaler_state.update_snapshot(snapshot,apply_netscaler_state.new_operation('delete','server','web3',
+                                                                                       {'name':'web3'}))
+    assert not apply_netscaler_state.get_snapshot_bindings(snapshot,'servicegroup_servicegroupmember_binding','web_sg')
@@ -0,0 +1,63 @@
+import apply_netscaler_state
+import nitro_mock
+
+
+def test_unchanged_ns_group():
+    ns_group_conf = {'name':'cache','servers':[{'name':'s0','ip_address':'10.0.0.1'}]}
+    cache_entry = [apply_netscaler_state.get_fingerprint(ns_group_conf),'1000']
+    assert apply_netscaler_state.is_ns_group_unchanged(cache_entry,ns_group_conf,'1000')
+    # A change on the NetScaler, a changed configuration or an unknown change marker reconciles the ns_group
+    assert not apply_netscaler_state.is_ns_group_unchanged(cache_entry,ns_group_conf,'1001')
+    assert not apply_netscaler_state.is_ns_group_unchanged(cache_entry,ns_group_conf,None)
+    assert not apply_netscaler_state.is_ns_group_unchanged(None,ns_group_conf,'1000')
+    ns_group_conf['servers'][0]['ip_address'] = '10.0.0.2'
+    assert not apply_netscaler_state.is_ns_group_unchanged(cache_entry,ns_group_conf,'1000')
+
+
+def test_state_cache_file(tmpdir):
+    filename = str(tmpdir.join('state_cache.json'))
+    assert apply_netscaler_state.load_state_cache(filename) == {}
+    state_cache = {'10.0.0.1':{'cache':['a','b']}}
+    apply_netscaler_state.save_state_cache(state_cache,filename)
+    assert apply_netscaler_state.load_state_cache(filename) == state_cache
+    assert not tmpdir.join('state_cache.json.tmp').exists()
+    # Entries of a cache written in an earlier layout, such as per-resource fingerprints, are dropped
+    apply_netscaler_state.save_state_cache({'10.0.0.1':{'cache':{'server s0':['a','b']}},
+                                            '10.0.0.2':{'cache':['a','b']}},filename)
+    assert apply_netscaler_state.load_state_cache(filename) == {'10.0.0.2':{'cache':['a','b']}}
+    # An unreadable cache reconciles every resource
+    tmpdir.join('state_cache.json').write('{')
+    assert apply_netscaler_state.load_state_cache(filename) == {}
+
+
+def get_ns_group_conf(name,address,subnet):
+    '''
+
+    :param name: Name of the ns_group; prefixes the names of its resources
+    :param address: ns_instance address of the mock NetScaler
+    :param subnet: Third octet of the server addresses of the ns_group
+    :return: ns_group configuration with two servers bound to a service group
+    '''
+    return {'name':name,'ns_instance':{'address':address,'user':'nsroot','pass':'nsroot'},
+            'servers':[{'name':'{0}_server{1}'.format(name,i),'ip_address':'10.0.{0}.{1}'.format(subnet,i)}
+                       for i in range(2)],
+            'service_groups':[{'name':'{}_sg'.format(name),'protocol':'HTTP',
+                               'servers':[{'name':'{0}_server{1}'.format(name,i),'port':80} for i in range(2)]}]}
+
+
+def test_state_cache_keeps_ns_groups_sharing_a_netscaler(mock_ns,args):
+    appliance, address = mock_ns
+    ns_groups = [get_ns_group_conf('first',address,1),get_ns_group_conf('second',address,2)]
+    state_cache = {}
+    # The first runs change the NetScaler; once a run changes nothing, both ns_groups are recorded as unchanged
+    for run in range(3):
+        for ns_group in ns_groups:
+            assert apply_netscaler_state.process_ns_group(ns_group,args,state_cache)['success']
+    assert sorted(state_cache[address].keys()) == ['first','second']
+
+    nitro_mock.reset_mock_stats(appliance)
+    for ns_group in ns_groups:
+        result = apply_netscaler_state.process_ns_group(ns_group,args,state_cache)
+        assert result['success'] and result['backup'] is None
+    # Each skipped ns_group only logs in, reads the configuration change time and logs out
+    assert nitro_mock.reset_mock_stats(appliance)['GET'] == 2
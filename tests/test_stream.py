@@ -0,0 +1,26 @@
+import threading
+import apply_netscaler_state
+
+
+def test_stream_records_failed_ns_group(tmpdir,monkeypatch):
+    config_file = str(tmpdir.join('ns.yml'))
+    ns_groups = [{'name':name,'ns_instance':{'address':'127.0.0.1','user':'nsroot','pass':'nsroot'},
+                  'servers':[{'name':'s0','ip_address':'10.0.0.1'}]} for name in ['first','second','third']]
+    apply_netscaler_state.update_yaml({'ns_groups':ns_groups},config_file)
+    args = apply_netscaler_state.get_arguments([config_file,'--stream','--offline','--plan','--workers','1'])
+    processed = []
+
+    def process_ns_group(ns_group,args,state_cache=None):
+        processed.append(ns_group['name'])
+        if ns_group['name'] == 'first':
+            raise RuntimeError('processing failed')
+        return {'success':True,'changes':0,'backup':None}
+
+    monkeypatch.setattr(apply_netscaler_state,'process_ns_group',process_ns_group)
+    # With a single worker, an ns_group that raises must not keep the next one from being taken in flight
+    thread = threading.Thread(target=lambda: processed.append(apply_netscaler_state.process_ns_groups_stream(args)))
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert processed == ['first','second','third',1]
@@ -0,0 +1,39 @@
+import apply_netscaler_state
+
+
+def get_config():
+    '''
+
+    :return: Valid configuration with one ns_group
+    '''
+    return {'ns_groups':[{'name':'web','ns_instance':{'address':'192.0.2.10','user':'nsroot','pass':'nsroot'},
+                          'servers':[{'name':'s0','ip_address':'10.0.0.1'},{'name':'s1','ip_address':'10.0.0.2'}],
+                          'service_groups':[{'name':'sg','protocol':'HTTP',
+                                             'servers':[{'name':'s0','port':80},{'name':'s1','port':80}]}],
+                          'lbvservers':[{'name':'lb','vip_address':'172.16.0.1','port':80,'protocol':'HTTP',
+                                         'service_group_bindings':['sg']}],
+                          'cs_actions':[{'name':'a','target_lbvserver':'lb'}],
+                          'cs_policies':[{'name':'p','expression':'true','action':'a'}],
+                          'csvservers':[{'name':'cs','vip_address':'172.16.0.2','port':80,'protocol':'HTTP',
+                                         'default_lbvserver':'lb','policy_bindings':[{'name':'p','priority':100}]}]}]}
+
+
+def test_valid_configuration():
+    assert apply_netscaler_state.get_config_yaml_errors(get_config()) == []
+    assert apply_netscaler_state.validate_config_yaml(get_config())
+
+
+def test_every_error_is_reported():
+    config = get_config()
+    ns_group = config['ns_groups'][0]
+    ns_group['servers'][0]['ip_address'] = 'not an address'
+    ns_group['service_groups'][0]['servers'].append({'name':'s2','port':80})
+    ns_group['lbvservers'][0]['port'] = 70000
+    ns_group['cs_policies'][0]['action'] = 'missing'
+    errors = apply_netscaler_state.get_config_yaml_errors(config)
+    assert len(errors) == 4
+    assert 'servers item s0' in errors[0]
+    assert 'lbvservers item lb' in errors[1]
+    assert errors[2:] == ['service_groups sg in ns_groups: web refers to undefined servers s2',
+                          'cs_policies p in ns_groups: web refers to undefined cs_actions missing']
+    assert not apply_netscaler_state.validate_config_yaml(config)
@@ -0,0 +1,24 @@
+import time
+import apply_netscaler_state
+
+
+def test_concurrent_ns_groups_keep_input_order_and_log_files(tmpdir,monkeypatch):
+    monkeypatch.chdir(tmpdir)
+
+    def process_ns_group(ns_group,*args):
+        # Later ns_groups complete first
+        time.sleep(0.05 * (3 - ns_group['index']))
+        apply_netscaler_state.ns_group_context.name = ns_group['name']
+        apply_netscaler_state.log.warning('processing {}'.format(ns_group['name']))
+        apply_netscaler_state.ns_group_context.name = None
+        return {'backup':None,'build':False,'success':ns_group['name'] != 'group1'}
+
+    monkeypatch.setattr(apply_netscaler_state,'process_ns_group',process_ns_group)
+    ns_groups = [{'name':'group{}'.format(i),'index':i} for i in range(3)]
+    args = apply_netscaler_state.get_arguments([str(tmpdir.join('ns.yml')),'--workers','3'])
+    results = apply_netscaler_state.process_ns_groups(ns_groups,args)
+    assert [result['success'] for result in results] == [True,False,True]
+    for ns_group in ns_groups:
+        log_file = tmpdir.join('apply_netscaler_state_{}_{}.log'.format(apply_netscaler_state.run_timestamp,
+                                                                        ns_group['name']))
+        assert log_file.read() == 'processing {0}\n'.format(ns_group['name'])
@@ -0,0 +1,31 @@
+from collections import OrderedDict
+import yaml
+import pytest
+import apply_netscaler_state
+
+
+def get_config():
+    '''
+
+    :return: Configuration with keys out of alphabetical order
+    '''
+    return OrderedDict([('ns_groups',[OrderedDict([('name','web'),
+                                                   ('servers',[OrderedDict([('name','s0'),
+                                                                            ('ip_address','10.0.0.1')])]),
+                                                   ('ns_instance',OrderedDict([('user','nsroot'),('pass','nsroot'),
+                                                                               ('address','192.0.2.10')]))])])])
+
+
+def test_state_file_keeps_key_order(tmpdir):
+    filename = str(tmpdir.join('ns.yml'))
+    assert apply_netscaler_state.update_yaml(get_config(),filename)
+    assert apply_netscaler_state.get_config_yaml(filename) == get_config()
+    assert tmpdir.join('ns.yml').read().index('servers') < tmpdir.join('ns.yml').read().index('ns_instance')
+
+
+@pytest.mark.parametrize('loader,dumper', [(yaml.SafeLoader,yaml.SafeDumper),
+                                           (apply_netscaler_state.YAMLSafeLoader,apply_netscaler_state.YAMLSafeDumper)])
+def test_loaders_and_dumpers_agree(loader,dumper):
+    document = apply_netscaler_state.ordered_dump(get_config(),Dumper=dumper)
+    assert document == apply_netscaler_state.ordered_dump(get_config(),Dumper=yaml.SafeDumper)
+    assert apply_netscaler_state.ordered_load(document,Loader=loader) == get_config()